@@ -0,0 +1,279 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints.
+
+Point the OpenAI client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1. Every
+request sleeps for a configurable latency before answering, and calls, inputs and
+tokens are counted per endpoint (GET /stats returns the counters). Optional requests-
+and tokens-per-minute limits answer 429 with the x-ratelimit and retry-after headers of
+the real API once exceeded.
+
+Run standalone with:
+    python benchmarks/mock_openai.py --port 8765 --latency 0.2
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Returned for prompts asking for donation data, in the shape the extraction app expects.
+DONOR_ANSWER = json.dumps([
+    {
+        'data': [
+            {
+                'donor_names_group': ['Anonymous (2)', 'Family Foundation'],
+                'amount_donated_by_group': ['1000', '4999'],
+                'gift_type': 'Annual'
+            }
+        ],
+        'page': '0'
+    }
+])
+PLAIN_ANSWER = 'This is a mock answer from the local stub.'
+
+
+class MockOpenAI:
+    """
+    Mock OpenAI server running on a background thread.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, embedding_dim=1536,
+                 chat_answer=None, rpm_limit=0, tpm_limit=0):
+        """
+        Args:
+        - host (str, optional): Interface to listen on.
+        - port (int, optional): Port to listen on; 0 picks a free port.
+        - latency (float, optional): Seconds each request waits before answering.
+        - jitter (float, optional): Random extra latency of up to this many seconds.
+        - embedding_dim (int, optional): Dimension of the returned embeddings.
+        - chat_answer (callable, optional): Called with the request body and returning the
+          completion text, or a (text, finish_reason) tuple; defaults to a donor-list answer
+          for extraction prompts and a short sentence otherwise.
+        - rpm_limit (int, optional): Requests per minute accepted; 0 for no limit.
+        - tpm_limit (int, optional): Tokens per minute accepted; 0 for no limit.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.embedding_dim = embedding_dim
+        self.chat_answer = chat_answer or default_chat_answer
+        self.stats = {
+            'embeddings': {'calls': 0, 'inputs': 0, 'tokens': 0},
+            'chat': {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0},
+            'errors': {'rate_limited': 0},
+        }
+        self.limits = {'requests': float(rpm_limit), 'tokens': float(tpm_limit)}
+        self._remaining = dict(self.limits)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self):
+        """
+        Returns:
+        - dict: Copy of the per-endpoint counters.
+        """
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def _admit(self, tokens):
+        """
+        Take a request from the per-minute budgets, refilled continuously.
+
+        Args:
+        - tokens (int): Tokens of the request.
+
+        Returns:
+        - tuple: (whether the request is accepted, rate-limit headers to send).
+        """
+        with self._lock:
+            now = time.monotonic()
+            for kind, limit in self.limits.items():
+                if limit:
+                    self._remaining[kind] = min(limit, self._remaining[kind] + (now - self._refilled) * limit / 60)
+            self._refilled = now
+            wanted = {'requests': 1, 'tokens': min(tokens, self.limits['tokens'])}
+            short = [kind for kind, limit in self.limits.items() if limit and self._remaining[kind] < wanted[kind]]
+            if not short:
+                for kind, limit in self.limits.items():
+                    if limit:
+                        self._remaining[kind] -= wanted[kind]
+            headers = {}
+            for kind, limit in self.limits.items():
+                if limit:
+                    headers[f'x-ratelimit-limit-{kind}'] = str(int(limit))
+                    headers[f'x-ratelimit-remaining-{kind}'] = str(max(0, int(self._remaining[kind])))
+            if short:
+                self.stats['errors']['rate_limited'] += 1
+                wait = max((wanted[kind] - self._remaining[kind]) * 60 / self.limits[kind] for kind in short)
+                headers['retry-after-ms'] = str(int(wait * 1000) + 1)
+            return not short, headers
+
+    def _sleep(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def _embedding(self, text):
+        # Deterministic pseudo-random vector derived from the text
+        seed = hashlib.sha256(text.encode('utf-8')).digest()
+        values = random.Random(seed).random
+        return [values() - 0.5 for _ in range(self.embedding_dim)]
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, payload, status=200, headers=None):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/stats'):
+                    self._send_json(mock.snapshot())
+                else:
+                    self._send_json({'error': 'not found'}, status=404)
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}'
+                body = json.loads(raw)
+                accepted, self.rate_headers = mock._admit(len(raw) // 4 + 1 + body.get('max_tokens', 0))
+                if not accepted:
+                    self._send_json({'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                               'code': 'rate_limit_exceeded'}}, status=429, headers=self.rate_headers)
+                    return
+                mock._sleep()
+                if self.path.endswith('/embeddings'):
+                    self._embeddings(body)
+                elif self.path.endswith('/chat/completions'):
+                    self._chat(body)
+                else:
+                    self._send_json({'error': 'not found'}, status=404)
+
+            def _embeddings(self, body):
+                inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+                tokens = sum(len(text) // 4 + 1 for text in inputs)
+                with mock._lock:
+                    mock.stats['embeddings']['calls'] += 1
+                    mock.stats['embeddings']['inputs'] += len(inputs)
+                    mock.stats['embeddings']['tokens'] += tokens
+                self._send_json({
+                    'object': 'list',
+                    'data': [
+                        {'object': 'embedding', 'index': i, 'embedding': mock._embedding(text)}
+                        for i, text in enumerate(inputs)
+                    ],
+                    'model': body.get('model', ''),
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+                }, headers=self.rate_headers)
+
+            def _chat(self, body):
+                answer, finish_reason = mock.chat_answer(body), 'stop'
+                if isinstance(answer, tuple):
+                    answer, finish_reason = answer
+                prompt_tokens = len(json.dumps(body['messages'])) // 4
+                completion_tokens = len(answer) // 4 + 1
+                with mock._lock:
+                    mock.stats['chat']['calls'] += 1
+                    mock.stats['chat']['prompt_tokens'] += prompt_tokens
+                    mock.stats['chat']['completion_tokens'] += completion_tokens
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                }
+                if not body.get('stream'):
+                    self._send_json({
+                        'id': 'chatcmpl-mock',
+                        'object': 'chat.completion',
+                        'created': int(time.time()),
+                        'model': body.get('model', ''),
+                        'choices': [{
+                            'index': 0,
+                            'message': {'role': 'assistant', 'content': answer},
+                            'finish_reason': finish_reason,
+                        }],
+                        'usage': usage,
+                    }, headers=self.rate_headers)
+                    return
+                self.send_response(200)
+                for name, value in self.rate_headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                words = re.findall(r'\S+\s*', answer) or ['']
+                for i, word in enumerate(words):
+                    chunk = {
+                        'id': 'chatcmpl-mock',
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': body.get('model', ''),
+                        'choices': [{
+                            'index': 0,
+                            'delta': {'content': word},
+                            'finish_reason': finish_reason if i == len(words) - 1 else None,
+                        }],
+                    }
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                if body.get('stream_options', {}).get('include_usage'):
+                    chunk = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                             'model': body.get('model', ''), 'choices': [], 'usage': usage}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                self.wfile.write(b'data: [DONE]\n\n')
+
+        return Handler
+
+
+def default_chat_answer(body):
+    """
+    Args:
+    - body (dict): Chat completion request body.
+
+    Returns:
+    - str: Donor JSON for extraction prompts, a short sentence otherwise.
+    """
+    if 'donor_names_group' in json.dumps(body['messages']):
+        return DONOR_ANSWER
+    return PLAIN_ANSWER
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local mock of the OpenAI API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, in seconds')
+    parser.add_argument('--embedding-dim', type=int, default=1536)
+    parser.add_argument('--rpm-limit', type=int, default=0, help='requests per minute before answering 429')
+    parser.add_argument('--tpm-limit', type=int, default=0, help='tokens per minute before answering 429')
+    args = parser.parse_args()
+    mock = MockOpenAI(args.host, args.port, args.latency, args.jitter, args.embedding_dim,
+                      rpm_limit=args.rpm_limit, tpm_limit=args.tpm_limit)
+    print(f'Mock OpenAI API listening on {mock.base_url}')
+    mock.server.serve_forever()
@@ -0,0 +1,480 @@
+"""
+End-to-end benchmarks for the chat backend and the extraction app.
+
+Both apps run in-process against a local mock of the OpenAI API (mock_openai.py) with a
+configurable injected latency, on synthetic PDFs of 1, 50 and 500 pages by default. For
+every stage the wall time, throughput, peak RSS during the stage and API calls are
+recorded and written as JSON so runs on different commits can be compared:
+
+    python benchmarks/run_benchmarks.py --latency 0.1
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<older>.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pymupdf
+
+from mock_openai import MockOpenAI
+from synthetic_pdf import make_pdf
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_DIR, 'chat_with_my_document', 'backend')
+EXTRACTION_DIR = os.path.join(REPO_DIR, 'llm_extraction_app')
+COMMON_DIR = os.path.join(REPO_DIR, 'common')
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+
+QUESTIONS = [
+    'Who gave $100,000 and above?',
+    'List the donors in the $1,000 - $9,999 range',
+    'What did the programs achieve this year?',
+    'Which gifts are annual gifts?',
+    'How many donors gave up to $999?',
+]
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _process_tree_rss():
+    # Resident pages of this process and its descendants, such as extraction pool
+    # workers, read from /proc
+    parents, resident = {}, {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces, so fields are counted from its ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        parents[int(entry)] = int(fields[1])
+        resident[int(entry)] = int(fields[21])
+    tree, pending = set(), [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        tree.add(pid)
+        pending.extend(child for child, parent in parents.items() if parent == pid and child not in tree)
+    return sum(resident.get(pid, 0) for pid in tree) * PAGE_SIZE
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process and its descendants on a background
+    thread, so every stage reports its own peak. ru_maxrss only holds the peak of the
+    whole run, which is what is reported on systems without /proc.
+    """
+
+    def __init__(self, interval=0.01):
+        """
+        Args:
+        - interval (float, optional): Seconds between samples.
+        """
+        self.interval = interval
+        self.enabled = os.path.isdir('/proc')
+        self._peak = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start sampling; the first stage starts now.
+
+        Returns:
+        - RssSampler: This sampler.
+        """
+        if self.enabled:
+            self._peak = _process_tree_rss()
+            threading.Thread(target=self._sample, name='rss-sampler', daemon=True).start()
+        return self
+
+    def _sample(self):
+        while True:
+            rss = _process_tree_rss()
+            with self._lock:
+                self._peak = max(self._peak, rss)
+            time.sleep(self.interval)
+
+    def take_peak(self):
+        """
+        Returns:
+        - int: Peak RSS in bytes since the previous call, which starts the next stage.
+        """
+        if not self.enabled:
+            scale = 1 if sys.platform == 'darwin' else 1024
+            return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+        rss = _process_tree_rss()
+        with self._lock:
+            peak, self._peak = max(self._peak, rss), rss
+        return peak
+
+
+RSS = RssSampler()
+
+
+def api_calls(before, after):
+    """
+    Returns:
+    - dict: Difference between two mock counter snapshots.
+    """
+    return {
+        endpoint: {key: after[endpoint][key] - before[endpoint][key] for key in after[endpoint]}
+        for endpoint in after
+    }
+
+
+def record(results, suite, pages, stage, seconds, mock, before, units=None, unit_name=None, **extra):
+    result = {
+        'suite': suite,
+        'pages': pages,
+        'stage': stage,
+        'wall_seconds': round(seconds, 4),
+        'peak_rss_bytes': RSS.take_peak(),
+        'api_calls': api_calls(before, mock.snapshot()),
+    }
+    if units is not None:
+        result[f'{unit_name}_per_second'] = round(units / seconds, 3) if seconds else None
+    result.update(extra)
+    results.append(result)
+    rate = f", {result[f'{unit_name}_per_second']} {unit_name}/s" if units is not None else ''
+    print(f'{suite:<12} {pages:>4}p  {stage:<16} {seconds:8.3f}s{rate}')
+
+
+def bench_chat_backend(pdf_paths, mock, queries, results):
+    """
+    Upload each PDF to the Flask backend, then query it, through the Flask test client.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    import chatdoc
+    client = chatdoc.app.test_client()
+
+    def upload(path):
+        with open(path, 'rb') as f:
+            response = client.post('/upload', data={'file': (f, os.path.basename(path))})
+        if response.status_code != 202:
+            raise RuntimeError(f'Upload failed: {response.status_code} {response.data!r}')
+        while True:
+            job = client.get(response.json['status_url']).json
+            if job['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.01)
+        if job['status'] == 'failed':
+            raise RuntimeError(f"Upload job failed: {job['error']}")
+        return job
+
+    for path, pages in pdf_paths:
+        for stage in ('upload', 'upload_cached'):
+            before = mock.snapshot()
+            started = time.perf_counter()
+            job = upload(path)
+            record(results, 'chat', pages, stage, time.perf_counter() - started, mock, before,
+                   units=pages, unit_name='pages',
+                   stages={name: info['seconds'] for name, info in job['stages'].items()})
+            if stage == 'upload':
+                # The summary is generated after the upload; time until it can be fetched
+                before = mock.snapshot()
+                started = time.perf_counter()
+                while client.get(f"/documents/{job['result']['doc_id']}/summary").status_code == 202:
+                    time.sleep(0.01)
+                record(results, 'chat', pages, 'summary', time.perf_counter() - started, mock, before)
+        doc_id = job['result']['doc_id']
+
+        # The suffix keeps repeated questions out of the query cache on the first pass
+        # without naming a page, which would answer them from the lexical index alone
+        questions = [f'{QUESTIONS[i % len(QUESTIONS)]} [{i}]' for i in range(queries)]
+        page_questions = [f'Summarize page {i % pages + 1}' for i in range(queries)]
+        for stage, stage_questions in (('query', questions), ('query_repeat', questions),
+                                       ('query_page', page_questions)):
+            before = mock.snapshot()
+            started = time.perf_counter()
+            for question in stage_questions:
+                response = client.post('/query', json={'query': question, 'doc_id': doc_id})
+                if response.status_code != 200:
+                    raise RuntimeError(f'Query failed: {response.status_code} {response.data!r}')
+            record(results, 'chat', pages, stage, time.perf_counter() - started, mock, before,
+                   units=len(stage_questions), unit_name='queries')
+
+        before = mock.snapshot()
+        started = time.perf_counter()
+        response = client.post('/query', json={'query': questions[0] + ' streamed', 'doc_id': doc_id, 'stream': True},
+                               buffered=False)
+        first_fragment = next(iter(response.response))
+        time_to_first = time.perf_counter() - started
+        b''.join(response.response)
+        record(results, 'chat', pages, 'query_stream', time.perf_counter() - started, mock, before,
+               time_to_first_token=round(time_to_first, 4), first_fragment_bytes=len(first_fragment))
+
+
+def bench_extraction(pdf_paths, mock, results):
+    """
+    Run the extraction app's PDF parsing and GPT extraction functions directly.
+
+    Returns:
+    - str or None: Why the suite could not run, or None if it ran.
+    """
+    sys.path[:0] = [COMMON_DIR, EXTRACTION_DIR]
+    try:
+        import pdf_processing
+        from page_extraction import document_key
+    except ImportError as e:
+        # The app needs its own requirements, such as streamlit
+        print(f'Skipping extraction benchmarks: {e}', file=sys.stderr)
+        return str(e)
+    client_openai = pdf_processing.load_openai_client(os.environ['OPENAI_API_KEY'])
+
+    for path, pages in pdf_paths:
+        with open(path, 'rb') as f:
+            pdf_bytes = f.read()
+        doc_key = document_key(pdf_bytes)
+
+        for stage in ('parse', 'parse_cached'):
+            # Only the disk cache is measured on the second pass, not the in-memory layer
+            pdf_processing.get_page_texts.clear()
+            before = mock.snapshot()
+            started = time.perf_counter()
+            text_list = pdf_processing.get_page_texts(doc_key, pdf_bytes)
+            record(results, 'extraction', pages, stage, time.perf_counter() - started, mock, before,
+                   units=pages, unit_name='pages')
+
+        before = mock.snapshot()
+        started = time.perf_counter()
+        pdf_processing.render_page_image(doc_key, pdf_bytes, 0)
+        record(results, 'extraction', pages, 'first_thumbnail', time.perf_counter() - started, mock, before)
+
+        for stage in ('extract', 'extract_cached'):
+            before = mock.snapshot()
+            started = time.perf_counter()
+            datasets, failed_pages = pdf_processing.process_pdf_with_gpt(client_openai, doc_key, text_list)
+            record(results, 'extraction', pages, stage, time.perf_counter() - started, mock, before,
+                   units=pages, unit_name='pages', datasets=len(datasets), failed_pages=len(failed_pages))
+
+
+def bench_scheduler(args, results):
+    """
+    Send bursts of bulk embedding calls and a trickle of interactive chat calls through
+    the OpenAI scheduler against a mock enforcing a requests-per-minute limit.
+    """
+    sys.path.insert(0, COMMON_DIR)
+    import openai
+    import openai_scheduler
+
+    mock = MockOpenAI(latency=args.latency, jitter=args.jitter, embedding_dim=args.embedding_dim,
+                      rpm_limit=args.rpm_limit).start()
+    scheduler = openai_scheduler.OpenAIScheduler()
+    client = openai.OpenAI(api_key='mock-key', base_url=mock.base_url, max_retries=0,
+                           http_client=openai_scheduler.scheduled_http_client(openai_scheduler=scheduler))
+    # A fifth more calls than the per-minute limit, so the burst runs into it
+    calls = args.rpm_limit + args.rpm_limit // 5
+    done = threading.Event()
+
+    def embed(i):
+        with openai_scheduler.request_priority(openai_scheduler.PRIORITY_BULK):
+            started = time.perf_counter()
+            client.embeddings.create(input=[f'bulk chunk {i}'], model='text-embedding-ada-002')
+            return time.perf_counter() - started
+
+    def chat():
+        latencies = []
+        while not done.is_set():
+            started = time.perf_counter()
+            client.chat.completions.create(model='gpt-4', messages=[{'role': 'user', 'content': 'Who gave?'}],
+                                           max_tokens=50)
+            latencies.append(time.perf_counter() - started)
+            # Interactive traffic takes a quarter of the limit; more would starve the bulk calls
+            time.sleep(4 * 60 / args.rpm_limit)
+        return latencies
+
+    before = mock.snapshot()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=33) as executor:
+        interactive = executor.submit(chat)
+        try:
+            bulk = [future.result() for future in [executor.submit(embed, i) for i in range(calls)]]
+        finally:
+            done.set()
+        interactive = interactive.result()
+    seconds = time.perf_counter() - started
+    stats = scheduler.stats()
+    record(results, 'scheduler', 0, 'bulk_and_chat', seconds, mock, before, units=calls, unit_name='calls',
+           rpm_limit=args.rpm_limit, retries=stats['retries'], rate_limited=stats['rate_limited'],
+           final_concurrency=stats['concurrency'], max_bulk_seconds=round(max(bulk), 4),
+           mean_interactive_seconds=round(sum(interactive) / len(interactive), 4),
+           max_interactive_seconds=round(max(interactive), 4))
+    mock.stop()
+
+
+# Opens a store in a fresh interpreter and times it up to the first query answered
+COLD_START_SCRIPT = '''
+import sys, json, time
+started = time.perf_counter()
+import numpy as np
+if sys.argv[1] == 'numpy':
+    from vector_store import NumpyVectorStore
+    client = NumpyVectorStore(sys.argv[2])
+else:
+    import chromadb
+    client = chromadb.PersistentClient(path=sys.argv[2])
+collection = client.get_or_create_collection('bench-vectors')
+collection.query(query_embeddings=np.ones(int(sys.argv[3])).tolist(), n_results=5)
+print(json.dumps(time.perf_counter() - started))
+'''
+
+
+def bench_vector_store(pdf_paths, args, results):
+    """
+    Compare the ChromaDB and memory-mapped NumPy vector stores on collections of the size
+    the synthetic documents produce: cold start to the first answer, single queries and
+    batched queries.
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    import numpy as np
+    import chromadb
+    from vector_store import NumpyVectorStore
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.embedding_dim)).astype(np.float32).tolist()
+    for _, pages in pdf_paths:
+        # About three chunks per page
+        rows = pages * 3
+        vectors = rng.standard_normal((rows, args.embedding_dim)).astype(np.float32)
+        for store in ('chroma', 'numpy'):
+            path = tempfile.mkdtemp(prefix=f'pdfqa-bench-{store}-')
+            client = NumpyVectorStore(path) if store == 'numpy' else chromadb.PersistentClient(path=path)
+            collection = client.get_or_create_collection('bench-vectors')
+            started = time.perf_counter()
+            for start in range(0, rows, 1000):
+                collection.upsert(ids=[f'chunk-{i}' for i in range(start, min(rows, start + 1000))],
+                                  embeddings=vectors[start:start + 1000].tolist(),
+                                  documents=[f'text {i}' for i in range(start, min(rows, start + 1000))])
+            record(results, f'vectors_{store}', pages, 'upsert', time.perf_counter() - started, NO_MOCK, {},
+                   units=rows, unit_name='rows')
+
+            output = subprocess.check_output([sys.executable, '-c', COLD_START_SCRIPT, store, path,
+                                              str(args.embedding_dim)], cwd=BACKEND_DIR, text=True)
+            record(results, f'vectors_{store}', pages, 'cold_start', json.loads(output.splitlines()[-1]), NO_MOCK, {})
+
+            started = time.perf_counter()
+            for query in queries:
+                collection.query(query_embeddings=[query], n_results=5)
+            record(results, f'vectors_{store}', pages, 'query', time.perf_counter() - started, NO_MOCK, {},
+                   units=len(queries), unit_name='queries')
+
+            started = time.perf_counter()
+            collection.query(query_embeddings=queries, n_results=5)
+            record(results, f'vectors_{store}', pages, 'query_batch', time.perf_counter() - started, NO_MOCK, {},
+                   units=len(queries), unit_name='queries')
+
+
+class _NoMock:
+    """
+    Stands in for the mock in record() for stages that make no API calls.
+    """
+
+    def snapshot(self):
+        return {}
+
+
+NO_MOCK = _NoMock()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, baseline_path):
+    """
+    Print the wall-time ratio of every stage against a previous results file.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['suite'], r['pages'], r['stage']): r['wall_seconds'] for r in baseline['results']}
+    print(f"\nCompared with {baseline['commit']} (ratio > 1 is slower):")
+    for result in current['results']:
+        key = (result['suite'], result['pages'], result['stage'])
+        if previous.get(key):
+            print(f'{key[0]:<12} {key[1]:>4}p  {key[2]:<16} {result["wall_seconds"] / previous[key]:6.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the chat backend and the extraction app.')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 50, 500], help='synthetic PDF sizes')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock API latency per request, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra mock latency, in seconds')
+    parser.add_argument('--embedding-dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=10, help='queries per document')
+    parser.add_argument('--suites', nargs='+', default=['chat', 'extraction'],
+                        choices=['chat', 'extraction', 'scheduler', 'vectors'])
+    parser.add_argument('--vector-store', choices=['chroma', 'numpy'],
+                        help='vector store of the chat backend (default: its VECTOR_STORE setting)')
+    parser.add_argument('--rpm-limit', type=int, default=600,
+                        help='requests per minute the mock accepts in the scheduler suite')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    args = parser.parse_args()
+
+    mock = MockOpenAI(latency=args.latency, jitter=args.jitter, embedding_dim=args.embedding_dim).start()
+    os.environ['OPENAI_BASE_URL'] = mock.base_url
+    os.environ['OPENAI_API_KEY'] = 'mock-key'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.vector_store:
+        os.environ['VECTOR_STORE'] = args.vector_store
+
+    workdir = tempfile.mkdtemp(prefix='pdfqa-bench-')
+    pdf_paths = []
+    for pages in args.pages:
+        path = make_pdf(os.path.join(workdir, f'synthetic_{pages}.pdf'), pages)
+        with pymupdf.open(path) as pdf_document:
+            pdf_paths.append((path, pdf_document.page_count))
+
+    # The backend keeps its uploads folder relative to the working directory
+    os.chdir(workdir)
+    RSS.start()
+    results = []
+    skipped = {}
+    if 'chat' in args.suites:
+        bench_chat_backend(pdf_paths, mock, args.queries, results)
+    if 'extraction' in args.suites:
+        reason = bench_extraction(pdf_paths, mock, results)
+        if reason:
+            skipped['extraction'] = reason
+    if 'vectors' in args.suites:
+        bench_vector_store(pdf_paths, args, results)
+    if 'scheduler' in args.suites:
+        bench_scheduler(args, results)
+    mock.stop()
+
+    commit = git_commit()
+    output = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': vars(args),
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'results': results,
+        'skipped': skipped,
+    }
+    output_path = args.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f'\nResults written to {output_path}')
+    if args.compare:
+        compare(output, args.compare)
+    for suite, reason in skipped.items():
+        print(f'The {suite} suite was skipped: {reason}', file=sys.stderr)
+    return 1 if skipped else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
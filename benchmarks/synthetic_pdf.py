@@ -0,0 +1,44 @@
+"""
+Generate synthetic donor-report PDFs for benchmarks.
+"""
+import random
+import pymupdf
+
+FIRST_NAMES = ['Alice', 'Bob', 'Carmen', 'David', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jamal']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Okafor', 'Novak', 'Haddad', 'Kim', 'Silva', 'Brown', 'Ivanova']
+RANGES = ['$100,000 and above', '$50,000 - $99,999', '$10,000 - $49,999', '$1,000 - $9,999', 'Up to $999']
+NARRATIVE = ('Our programs reached more families this year than ever before, thanks to the '
+             'continued generosity of our community and the dedication of our volunteers. ')
+
+
+def make_pdf(path, pages, seed=0):
+    """
+    Write a PDF alternating narrative pages and donor-list pages.
+
+    Args:
+    - path (str): Output path.
+    - pages (int): Number of pages.
+    - seed (int, optional): Seed for the generated names.
+
+    Returns:
+    - str: The output path.
+    """
+    rng = random.Random(seed)
+    pdf_document = pymupdf.open()
+    for page_num in range(pages):
+        page = pdf_document.new_page()
+        if page_num % 3 == 0:
+            page.insert_text((50, 70), f'Annual Report - Section {page_num // 3 + 1}', fontsize=18)
+            page.insert_textbox(pymupdf.Rect(50, 100, 545, 790), NARRATIVE * 12, fontsize=10)
+            continue
+        page.insert_text((50, 70), f'Annual Gifts - {rng.choice(RANGES)}', fontsize=16)
+        y = 100
+        for _ in range(4):
+            page.insert_text((50, y), rng.choice(RANGES), fontsize=12)
+            y += 18
+            names = ', '.join(f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}' for _ in range(24))
+            page.insert_textbox(pymupdf.Rect(50, y, 545, y + 140), names, fontsize=9)
+            y += 150
+    pdf_document.save(path)
+    pdf_document.close()
+    return path
@@ -1,7 +1,32 @@
 
 import os
-import pymupdf
-import base64
+import time
+import logging
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from page_extraction import extract_pages
+from embeddings import as_provider
+from lexical_index import is_confident, reciprocal_rank_fusion
+from context_builder import estimate_tokens, build_context
+from metrics import span, run_in_context
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds for a single embeddings request (the API allows 2048 inputs and
+# 300k tokens per request); tokens are estimated at roughly 4 characters each.
+EMBEDDING_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', 100000))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 2048))
+EMBEDDING_WORKERS = int(os.environ.get('EMBEDDING_WORKERS', 4))
+# Number of rows written to ChromaDB per upsert call.
+CHROMA_BATCH_SIZE = int(os.environ.get('CHROMA_BATCH_SIZE', 1000))
+# Candidates taken from each of the lexical and vector searches before they are fused.
+HYBRID_CANDIDATES = int(os.environ.get('HYBRID_CANDIDATES', 20))
+# Summaries are built map-reduce style: pages are packed into windows of about this many
+# tokens, summarized concurrently, and the partial summaries are combined.
+SUMMARY_MODEL = os.environ.get('SUMMARY_MODEL', 'gpt-4')
+SUMMARY_WINDOW_TOKENS = int(os.environ.get('SUMMARY_WINDOW_TOKENS', 5000))
+SUMMARY_PART_TOKENS = int(os.environ.get('SUMMARY_PART_TOKENS', 300))
+SUMMARY_WORKERS = int(os.environ.get('SUMMARY_WORKERS', 4))
 
 def get_text(document_path):
     """
@@ -13,179 +38,441 @@ def get_text(document_path):
     Returns:
     - list: List of text extracted from each page of the PDF.
     """
-    all_pages_text = []
-    pdf_document = pymupdf.open(document_path)
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        text = page.get_text()
-        all_pages_text.append(text)
-    pdf_document.close()
-    return all_pages_text
+    return extract_pages(document_path, images=False)[0]
 
 
-def get_images(document_path):
+def create_embeddings(client_openai,text):
     """
-    Extract images from each page of a PDF document.
+    Create embeddings for a given text using OpenAI API or another embedding provider.
 
     Args:
-    - document_path (str): Path to the PDF document.
+    - client_openai (OpenAI Client or embedding provider): Instance of OpenAI client, or a
+      provider from embeddings.py.
+    - text (str): Text for which embeddings are to be created.
 
     Returns:
-    - list: List of image bytes extracted from each page of the PDF.
+    - list: Embedding generated for the text.
     """
-    pdf_document = pymupdf.open(document_path)
-    images = []
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        pix = page.get_pixmap()
-        image_bytes = pix.tobytes("png")
-        images.append(image_bytes)
-    pdf_document.close()
-    return images
+    return as_provider(client_openai).embed([text])[0]
 
-def save_images(images, output_folder):
+def make_batches(text_list, max_batch_tokens=EMBEDDING_BATCH_TOKENS, max_batch_size=EMBEDDING_BATCH_SIZE):
     """
-    Save extracted images to the specified output folder.
+    Pack text chunks into consecutive batches bounded by a token budget and a size limit.
 
     Args:
-    - images (list): List of image bytes to save.
-    - output_folder (str): Path to the output folder where images will be saved.
+    - text_list (list): List of text chunks.
+    - max_batch_tokens (int, optional): Estimated token budget per batch.
+    - max_batch_size (int, optional): Maximum number of chunks per batch.
 
     Returns:
-    - list: List of paths to saved images.
+    - list: List of (start_index, chunks) tuples, in input order.
     """
-    image_paths = []
-    for i, image_bytes in enumerate(images):
-        image_path = os.path.join(output_folder, f'image_{i}.png')  # Use 'png' as the extension
-        with open(image_path, 'wb') as image_file:
-            image_file.write(image_bytes)
-        image_paths.append(image_path)
-    return image_paths
-
-def create_embeddings(client_openai,text):
+    batches = []
+    start, batch, batch_tokens = 0, [], 0
+    for i, text in enumerate(text_list):
+        tokens = estimate_tokens(text)
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_size):
+            batches.append((start, batch))
+            start, batch, batch_tokens = i, [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append((start, batch))
+    return batches
+
+def create_batch_embeddings(client_openai, batch):
     """
-    Create embeddings for a given text using OpenAI API.
+    Create embeddings for a batch of text chunks with a single provider call (one OpenAI
+    API request for the OpenAI provider).
 
     Args:
-    - client_openai (OpenAI Client): Instance of OpenAI client.
-    - text (str): Text for which embeddings are to be created.
+    - client_openai (OpenAI Client or embedding provider): Instance of OpenAI client, or a
+      provider from embeddings.py.
+    - batch (list): List of text chunks.
 
     Returns:
-    - str: Embedding generated for the text.
+    - list: List of embeddings, in the same order as the batch.
     """
-    response = client_openai.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+    return as_provider(client_openai).embed(batch)
 
-def create_all_embeddings(client_openai,text_list):
+def create_all_embeddings(client_openai,text_list, max_batch_tokens=EMBEDDING_BATCH_TOKENS,
+                          max_batch_size=EMBEDDING_BATCH_SIZE, max_workers=EMBEDDING_WORKERS, stats=None,
+                          progress=None):
     """
     Create embeddings for a list of text chunks using OpenAI API.
 
+    Chunks are packed into batches and up to max_workers batches are sent concurrently.
+
     Args:
-    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - client_openai (OpenAI Client or embedding provider): Instance of OpenAI client, or a
+      provider from embeddings.py.
     - text_list (list): List of text chunks for which embeddings are to be created.
+    - max_batch_tokens (int, optional): Estimated token budget per request.
+    - max_batch_size (int, optional): Maximum number of chunks per request.
+    - max_workers (int, optional): Maximum number of requests in flight.
+    - stats (list, optional): If given, one dict per batch with its start index, size,
+      estimated tokens and latency in seconds is appended to it.
+    - progress (callable, optional): Called with the completed fraction after each batch.
 
     Returns:
     - list: List of embeddings generated for each text chunk.
     """
-    return [create_embeddings(client_openai,chunk) for chunk in text_list]
+    batches = make_batches(text_list, max_batch_tokens, max_batch_size)
+
+    def run(batch_item):
+        start, batch = batch_item
+        started = time.perf_counter()
+        embeddings = create_batch_embeddings(client_openai, batch)
+        latency = time.perf_counter() - started
+        batch_stats = {
+            'start': start,
+            'size': len(batch),
+            'tokens': sum(estimate_tokens(text) for text in batch),
+            'latency': latency,
+        }
+        logger.info("Embedded batch at %d: %d chunks, ~%d tokens in %.3fs",
+                    start, batch_stats['size'], batch_stats['tokens'], latency)
+        return embeddings, batch_stats
+
+    embeddings_list = []
+    with span('embed', chunks=len(text_list), batches=len(batches)), \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # Futures are read in submission order, which keeps the output aligned with text_list
+        futures = [executor.submit(run_in_context(run, batch_item)) for batch_item in batches]
+        for (start, batch), future in zip(batches, futures):
+            try:
+                embeddings, batch_stats = future.result()
+            except Exception:
+                # A missing batch would shift every later embedding onto the wrong chunk
+                logger.error("Embedding batch at %d (%d chunks) failed", start, len(batch))
+                raise
+            embeddings_list.extend(embeddings)
+            if stats is not None:
+                stats.append(batch_stats)
+            if progress is not None:
+                progress(len(embeddings_list) / len(text_list))
+    return embeddings_list
+
+def chunk_id(text, page_num, chunk_num=0):
+    """
+    Build a stable collection ID for a chunk from its content hash and position.
+
+    Args:
+    - text (str): Text of the chunk.
+    - page_num (int): Zero-based page number.
+    - chunk_num (int, optional): Position of the chunk within its page. Defaults to 0.
 
-def create_collection(client_cdb,embeddings_list,text_list,col_name):
+    Returns:
+    - str: ID of the form '<sha256 prefix>-<page_num>-<chunk_num>'.
+    """
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    return f"{digest[:32]}-{page_num}-{chunk_num}"
+
+def chunk_metadata(chunk, chunk_num):
     """
-    Create a collection in ChromaDB and add documents with embeddings.
+    Build the collection metadata of a chunk (ChromaDB only accepts scalar values).
+
+    Args:
+    - chunk (dict): Chunk with 'page' and optional 'bbox'.
+    - chunk_num (int): Position of the chunk within its page.
+
+    Returns:
+    - dict: Page, chunk position and bounding box coordinates.
+    """
+    metadata = {'page': chunk['page'], 'chunk': chunk_num}
+    if chunk.get('bbox'):
+        metadata.update(zip(('x0', 'y0', 'x1', 'y1'), (float(value) for value in chunk['bbox'])))
+    return metadata
+
+def chunk_bbox(metadata):
+    """
+    Read the bounding box back from chunk metadata.
+
+    Args:
+    - metadata (dict): Metadata stored with the chunk.
+
+    Returns:
+    - tuple or None: (x0, y0, x1, y1), or None for whole-page chunks.
+    """
+    if 'x0' not in metadata:
+        return None
+    return tuple(metadata[key] for key in ('x0', 'y0', 'x1', 'y1'))
+
+def chunk_rows(chunks):
+    """
+    Build the collection IDs and metadata of the chunks of a document.
+
+    Args:
+    - chunks (list): Chunks with 'text', 'page' and optional 'bbox', in document order.
+
+    Returns:
+    - tuple: (ID of each chunk, metadata of each chunk).
+    """
+    chunk_nums = []
+    for i, chunk in enumerate(chunks):
+        same_page = i > 0 and chunks[i - 1]['page'] == chunk['page']
+        chunk_nums.append(chunk_nums[-1] + 1 if same_page else 0)
+    ids = [chunk_id(chunk['text'], chunk['page'], num) for chunk, num in zip(chunks, chunk_nums)]
+    metadatas = [chunk_metadata(chunk, num) for chunk, num in zip(chunks, chunk_nums)]
+    return ids, metadatas
+
+def create_collection(client_cdb,embeddings_list,text_list,col_name,ids=None,metadatas=None,batch_size=CHROMA_BATCH_SIZE):
+    """
+    Create a collection in ChromaDB and upsert documents with embeddings in batches.
 
     Args:
     - client_cdb (ChromaDB Client): Instance of ChromaDB client.
     - embeddings_list (list): List of embeddings corresponding to each document.
     - text_list (list): List of documents/texts to be added to the collection.
     - col_name (str): Name of the collection to be created or retrieved.
+    - ids (list, optional): IDs of the documents. Defaults to page-level content-hash IDs.
+    - metadatas (list, optional): Metadata of the documents. Defaults to the page number.
+    - batch_size (int, optional): Number of documents written per upsert call.
 
     Returns:
     - None
     """
     collection = client_cdb.get_or_create_collection(col_name)
-    for i, embedding in enumerate(embeddings_list):
-        collection.add(
-            documents=[text_list[i]],
-            embeddings=[embedding],
-            ids=[str(i)]
-        )
+    if ids is None:
+        ids = [chunk_id(text, i) for i, text in enumerate(text_list)]
+    if metadatas is None:
+        metadatas = [{'page': i, 'chunk': 0} for i in range(len(text_list))]
+    with span('chroma_upsert', rows=len(ids)):
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.upsert(
+                documents=text_list[start:end],
+                embeddings=embeddings_list[start:end],
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
     #return collection
 
-def retrieve_chunk(client_cdb,client_openai, col_name, query, k=5):
+def index_chunks(client_cdb,client_openai,chunks,col_name,embeddings_list=None,stats=None,progress=None):
+    """
+    Incrementally index the chunks of a document into a ChromaDB collection.
+
+    Chunks whose content-hash ID is already in the collection are skipped without
+    re-embedding or re-writing; rows that no longer match any chunk are deleted.
+
+    Args:
+    - client_cdb (ChromaDB Client): Instance of ChromaDB client.
+    - client_openai (OpenAI Client or embedding provider): Used to embed text.
+    - chunks (list): Chunks with 'text', 'page' and optional 'bbox', in document order.
+    - col_name (str): Name of the collection to update.
+    - embeddings_list (list, optional): Precomputed embedding of each chunk. When given,
+      no embeddings are requested from the API.
+    - stats (dict, optional): If given, filled with the number of chunks added, skipped
+      and stale rows deleted.
+    - progress (callable, optional): Called with the completed fraction of the embedding work.
+
+    Returns:
+    - list: Embedding of each chunk.
+    """
+    collection = client_cdb.get_or_create_collection(col_name)
+    ids, metadatas = chunk_rows(chunks)
+    with span('chroma_get'):
+        existing = collection.get(include=['embeddings'])
+    existing_embeddings = {
+        row_id: [float(value) for value in embedding]
+        for row_id, embedding in zip(existing['ids'], existing['embeddings'])
+    }
+
+    wanted_ids = set(ids)
+    stale_ids = [row_id for row_id in existing['ids'] if row_id not in wanted_ids]
+    if stale_ids:
+        with span('chroma_delete', rows=len(stale_ids)):
+            for start in range(0, len(stale_ids), CHROMA_BATCH_SIZE):
+                collection.delete(ids=stale_ids[start:start + CHROMA_BATCH_SIZE])
+
+    new_chunks = [i for i, row_id in enumerate(ids) if row_id not in existing_embeddings]
+    if new_chunks:
+        new_texts = [chunks[i]['text'] for i in new_chunks]
+        if embeddings_list is None:
+            new_embeddings = create_all_embeddings(client_openai, new_texts, progress=progress)
+        else:
+            new_embeddings = [embeddings_list[i] for i in new_chunks]
+        create_collection(
+            client_cdb, new_embeddings, new_texts, col_name,
+            ids=[ids[i] for i in new_chunks],
+            metadatas=[metadatas[i] for i in new_chunks]
+        )
+        existing_embeddings.update(zip((ids[i] for i in new_chunks), new_embeddings))
+
+    chunk_stats = {'added': len(new_chunks), 'skipped': len(ids) - len(new_chunks), 'deleted': len(stale_ids)}
+    logger.info("Indexed %s: %d chunks added, %d skipped, %d stale rows deleted",
+                col_name, chunk_stats['added'], chunk_stats['skipped'], chunk_stats['deleted'])
+    if stats is not None:
+        stats.update(chunk_stats)
+    return [existing_embeddings[row_id] for row_id in ids]
+
+def retrieve_lexical(lexical, query, k=HYBRID_CANDIDATES):
+    """
+    Search the lexical index of a collection.
+
+    Args:
+    - lexical (LexicalIndex): Lexical index of the collection.
+    - query (str): Query to search for.
+    - k (int, optional): Number of hits to return.
+
+    Returns:
+    - list: Hits from LexicalIndex.search(), best first.
+    """
+    with span('lexical_query', chunks=len(lexical)) as fields:
+        hits = lexical.search(query, k)
+        fields['hits'] = len(hits)
+    return hits
+
+def lexical_results(hits, k):
+    """
+    Shape lexical hits like the results of a collection query.
+
+    Args:
+    - hits (list): Hits from LexicalIndex.search(), best first.
+    - k (int): Number of results to keep.
+
+    Returns:
+    - dict: 'ids', 'documents', 'metadatas', 'distances' (None, there is no vector
+      distance) and 'scores', each holding one list.
+    """
+    hits = hits[:k]
+    return {
+        'ids': [[hit['id'] for hit in hits]],
+        'documents': [[hit['text'] for hit in hits]],
+        'metadatas': [[hit['metadata'] for hit in hits]],
+        'distances': [[None] * len(hits)],
+        'scores': [[hit['score'] for hit in hits]],
+    }
+
+def retrieve_chunk(client_cdb,client_openai, col_name, query, k=5, query_embedding=None, lexical_hits=None):
     """
     Retrieve matching chunks of text from the collection based on a query.
 
+    With lexical hits, the vector and lexical rankings are merged by reciprocal rank
+    fusion. If no query embedding is given and the lexical hits are confident (see
+    lexical_index.is_confident()), they are returned without embedding the query.
+
     Args:
     - client_cdb (ChromaDB Client): Instance of ChromaDB client.
-    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - client_openai (OpenAI Client or embedding provider): Used to embed text.
     - col_name (str): Name of the collection to query.
     - query (str): Query to search for in the collection.
-    - k (int, optional): Number of results to retrieve. Defaults to 10.
+    - k (int, optional): Number of results to retrieve. Defaults to 5.
+    - query_embedding (list, optional): Precomputed embedding of the query.
+    - lexical_hits (list, optional): Hits of retrieve_lexical() on this collection.
 
     Returns:
-    - dict: Results containing matching chunks of text.
+    - dict: Results containing matching chunks of text, plus 'scores' (fused scores,
+      higher is better) when lexical hits were given.
     """
+    if lexical_hits is not None and query_embedding is None and is_confident(lexical_hits):
+        return lexical_results(lexical_hits, k)
 
     collection = client_cdb.get_or_create_collection(col_name)
 
-    query_embedding = create_embeddings(client_openai,query)
-    results = collection.query(
-        query_embeddings=query_embedding,
-        n_results=k
-    )
-    #return [doc for doc in results['documents'][0]]
-    return results
-
-def generate_summary(client_openai,text_list):
+    if query_embedding is None:
+        with span('embed_query'):
+            query_embedding = create_embeddings(client_openai,query)
+    with span('chroma_query', collection=col_name):
+        results = collection.query(
+            query_embeddings=query_embedding,
+            n_results=k if lexical_hits is None else max(k, HYBRID_CANDIDATES)
+        )
+    if lexical_hits is None:
+        #return [doc for doc in results['documents'][0]]
+        return results
+
+    rows = {hit['id']: (hit['text'], hit['metadata'], None) for hit in lexical_hits}
+    rows.update(zip(results['ids'][0], zip(results['documents'][0], results['metadatas'][0], results['distances'][0])))
+    # Chunks that share no term with the query do not count as lexical matches
+    fused = reciprocal_rank_fusion([results['ids'][0], [hit['id'] for hit in lexical_hits if hit['score'] > 0]])
+    ranked = sorted(fused, key=fused.get, reverse=True)[:k]
+    return {
+        'ids': [ranked],
+        'documents': [[rows[row_id][0] for row_id in ranked]],
+        'metadatas': [[rows[row_id][1] for row_id in ranked]],
+        'distances': [[rows[row_id][2] for row_id in ranked]],
+        'scores': [[fused[row_id] for row_id in ranked]],
+    }
+
+def summarize_text(client_openai, prompt_text, text, max_tokens):
     """
-    Generate a summary of the document using OpenAI API.
+    Summarize a text with a single OpenAI API request.
 
     Args:
     - client_openai (OpenAI Client): Instance of OpenAI client.
-    - text_list (list): List of text chunks representing the document.
+    - prompt_text (str): Instruction placed before the text.
+    - text (str): Text to summarize.
+    - max_tokens (int): Maximum length of the summary.
 
     Returns:
-    - str: Generated summary of the document.
+    - str: Generated summary.
     """
-
-    input_text=''
-    for text in text_list[0:4]:
-        input_text=input_text+'/n/n'+text
-
-    prompt_text = 'Generate summary of the document'
     response = client_openai.chat.completions.create(
-        model="gpt-4",
+        model=SUMMARY_MODEL,
         messages=[
             {
                 "role": "user",
-                "content": prompt_text + input_text
+                "content": prompt_text + text
             }
         ],
         temperature=0,
-        max_tokens=200,
+        max_tokens=max_tokens,
         top_p=1,
         frequency_penalty=0,
         presence_penalty=0
     )
     return response.choices[0].message.content
 
-def encode_image(image_path):
+def generate_summary(client_openai,text_list,window_tokens=SUMMARY_WINDOW_TOKENS,max_workers=SUMMARY_WORKERS,
+                     progress=None):
     """
-    Encode an image to base64 format.
+    Generate a summary of the whole document using OpenAI API.
+
+    Pages are packed into windows of about window_tokens, and the windows are summarized
+    concurrently. While the partial summaries do not fit in one window they are packed
+    and summarized again; the last level is combined into the final summary. A document
+    that fits in one window costs a single request.
 
     Args:
-    - image_path (str): Path to the image file.
+    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - text_list (list): List of text chunks representing the document.
+    - window_tokens (int, optional): Estimated token budget of a single request.
+    - max_workers (int, optional): Maximum number of requests in flight.
+    - progress (callable, optional): Called with the completed fraction of the first level.
 
     Returns:
-    - str: Base64 encoded representation of the image.
+    - str: Generated summary of the document.
     """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-
+    # Each part is labeled with its pages so partial summaries keep their place in the document
+    parts = [(i + 1, i + 1, f'Page {i + 1}:\n{text[:window_tokens * 4]}') for i, text in enumerate(text_list) if text.strip()]
+    if not parts:
+        return ''
+    # A window must hold several partial summaries, or the levels would never shrink
+    window_tokens = max(window_tokens, 4 * SUMMARY_PART_TOKENS)
+    part_prompt = 'Summarize these pages of a document, keeping names, figures and dates:\n\n'
+    with span('summarize', pages=len(text_list)) as fields, \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        fields['levels'] = 1
+        while True:
+            batches = make_batches([text for _, _, text in parts], window_tokens)
+            if len(batches) == 1:
+                break
+            futures = [
+                executor.submit(run_in_context(summarize_text, client_openai, part_prompt, '\n\n'.join(batch),
+                                               SUMMARY_PART_TOKENS))
+                for _, batch in batches
+            ]
+            summaries = []
+            for future in futures:
+                summaries.append(future.result())
+                if progress is not None and fields['levels'] == 1:
+                    progress(len(summaries) / len(futures))
+            ranges = [(parts[start][0], parts[start + len(batch) - 1][1]) for start, batch in batches]
+            parts = [(first, last, f'Pages {first}-{last}:\n{summary}') for (first, last), summary in zip(ranges, summaries)]
+            fields['levels'] += 1
+        summary = summarize_text(client_openai, 'Generate summary of the document\n\n', '\n\n'.join(batches[0][1]), 200)
+    return summary
 
 def generate_response_text(client_openai, retrieved_chunks, query):
     """
@@ -198,15 +485,17 @@ def generate_response_text(client_openai, retrieved_chunks, query):
     Returns:
     - str: Generated summary of the document.
     """
-    context = " ".join(retrieved_chunks)
-
-    input_text = f"{context}\n\nUser: {query}\nAI:"
-
     prompt_text = """"Use the following pieces of context to answer the question at the end.
        If you don't know the answer, respond with {please elaborate your question; it seems unrelated to the context}
        In many documents heading is mentioned on the top of the page please refer to the heading while finding the
        relevant context."
        """
+    with span('build_context', chunks_retrieved=len(retrieved_chunks)) as fields:
+        context, _, context_stats = build_context(retrieved_chunks, reserved_tokens=estimate_tokens(prompt_text + query))
+        fields.update(context_stats)
+
+    input_text = f"{context}\n\nUser: {query}\nAI:"
+
     response = client_openai.chat.completions.create(
         model="gpt-4-turbo",
         messages=[
@@ -224,7 +513,7 @@ def generate_response_text(client_openai, retrieved_chunks, query):
     #return response
     return response.choices[0].message.content
 
-def generate_response(client_openai, retrieved_chunks, query, image_paths):
+def generate_response(client_openai, retrieved_chunks, query, image_paths, stream=False):
     """
     Generate a response based on retrieved chunks, query, and image paths using OpenAI API.
 
@@ -232,24 +521,29 @@ def generate_response(client_openai, retrieved_chunks, query, image_paths):
     - client_openai (OpenAI Client): Instance of OpenAI client.
     - retrieved_chunks (list): List of retrieved text chunks.
     - query (str): Query used to retrieve chunks.
-    - image_paths (list): List of paths to images related to the retrieved chunks.
+    - image_paths (list): Paths to the images of the retrieved chunks, or callables
+      returning them (see context_builder.build_context()).
+    - stream (bool, optional): Return a generator of text fragments as they are produced
+      instead of the complete response. Defaults to False.
 
 
     Returns:
-    - str: Generated response combining text and images.
+    - str or generator: Generated response combining text and images.
     """
-    #context = " ".join(retrieved_chunks)
-
-    input_text = f"User: {query}\nAI:"
-
     prompt_text = """"Use the following pieces of context to answer the question at the end.
        If you don't know the answer, respond with {please elaborate your question; it seems unrelated to the context}
        In many documents heading is mentioned on the top of the page please refer to the heading while finding the
        relevant context."
        """
 
-    # Encode all images and create image content entries
-    image_contents = [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(image_path)}"}} for image_path in image_paths]
+    # Keep the prompt within the token and image budgets; the span logs its estimated size
+    with span('build_context', chunks_retrieved=len(retrieved_chunks), images_retrieved=len(image_paths)) as fields:
+        context, image_urls, context_stats = build_context(retrieved_chunks, image_paths,
+                                                           reserved_tokens=estimate_tokens(prompt_text + query))
+        fields.update(context_stats)
+    image_contents = [{"type": "image_url", "image_url": {"url": url}} for url in image_urls]
+
+    input_text = f"{context}\n\nUser: {query}\nAI:"
 
     # Combine text and images into messages
     messages = [
@@ -262,14 +556,36 @@ def generate_response(client_openai, retrieved_chunks, query, image_paths):
         }
     ]
 
-    response = client_openai.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        temperature=0.4,
-        max_tokens=200,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-    )
+    # For a streamed response this times until the answer starts; stream_response_text() times the rest
+    with span('generate', stream=stream, prompt_tokens_estimate=context_stats['tokens']):
+        response = client_openai.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.4,
+            max_tokens=200,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stream=stream,
+            # The final chunk then carries token usage for the metrics
+            **({'stream_options': {'include_usage': True}} if stream else {})
+        )
+    if stream:
+        return stream_response_text(response)
     #return response
     return response.choices[0].message.content
+
+def stream_response_text(response):
+    """
+    Yield the text fragments of a streamed chat completion.
+
+    Args:
+    - response (Stream): Streamed chat completion returned by the OpenAI client.
+
+    Returns:
+    - generator: Text fragments in the order they are received.
+    """
+    with span('stream'):
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
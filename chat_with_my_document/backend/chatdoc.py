@@ -1,15 +1,62 @@
-import openai
-import chromadb
-from flask import Flask, request, Response
-from chat_doc_f import get_text, get_images, save_images, create_embeddings, create_all_embeddings, create_collection, retrieve_chunk, generate_summary, encode_image, generate_response
-
 import os
+import sys
+
+# Modules shared with the extraction app live in the repository's common/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'common'))
+
+from flask import Flask, request, Response, jsonify, stream_with_context
+import time
+import logging
+import threading
+import pymupdf
+from chat_doc_f import get_text, create_embeddings, index_chunks, chunk_rows, retrieve_chunk, retrieve_lexical, lexical_results, chunk_bbox, generate_summary, generate_response
+from doc_cache import DocumentCache
+from clients import VECTOR_STORE, init_clients, get_openai_client, openai_configured, get_chroma_client, get_embedder
+from jobs import JobManager
+from page_extraction import iter_pages, document_key
+from page_render import RenderCache
+from chunking import chunk_page
+from documents import DocumentRegistry, collection_name, valid_doc_id
+from query_cache import TTLCache, normalize_query
+from lexical_index import LexicalIndexStore, is_confident
+from context_builder import payload_cache
+from openai_scheduler import scheduler, request_priority, PRIORITY_BULK
+from metrics import JsonFormatter, render_metrics, span, stage_breakdown, start_request, request_id
 
 app = Flask(__name__)
 UPLOAD_FOLDER = 'uploads'
 PDF_FOLDER = os.path.join(UPLOAD_FOLDER, 'pdf_file')
 PDF_IMAGES_FOLDER = os.path.join(UPLOAD_FOLDER, 'pdf_images')
 CHROMA_EMBEDDINGS_FOLDER = os.path.join(UPLOAD_FOLDER, 'chroma_embeddings')
+NUMPY_VECTORS_FOLDER = os.path.join(UPLOAD_FOLDER, 'numpy_vectors')
+DOC_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'doc_cache')
+LEXICAL_INDEX_FOLDER = os.path.join(UPLOAD_FOLDER, 'lexical_index')
+DOC_CACHE_MAX_BYTES = int(os.environ.get('DOC_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+# Documents summarized at the same time; each summary also runs its own concurrent requests
+SUMMARY_JOB_WORKERS = int(os.environ.get('SUMMARY_JOB_WORKERS', 1))
+DOCUMENT_REGISTRY_PATH = os.path.join(UPLOAD_FOLDER, 'documents.json')
+QUERY_TOP_K = int(os.environ.get('QUERY_TOP_K', 3))
+# Largest number of chunks a query may ask for with 'k'; larger values are capped
+QUERY_MAX_K = int(os.environ.get('QUERY_MAX_K', 20))
+# Documents unused for this long are removed from the index, with their files
+DOCUMENT_TTL_SECONDS = int(os.environ.get('DOCUMENT_TTL_SECONDS', 7 * 24 * 3600))
+DOCUMENT_SWEEP_INTERVAL = int(os.environ.get('DOCUMENT_SWEEP_INTERVAL', 600))
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 4096))
+QUERY_CACHE_TTL = int(os.environ.get('QUERY_CACHE_TTL', 24 * 3600))
+ANSWER_CACHE_SIZE = int(os.environ.get('ANSWER_CACHE_SIZE', 1024))
+ANSWER_CACHE_TTL = int(os.environ.get('ANSWER_CACHE_TTL', 3600))
+# Stage breakdowns of recent requests, fetched by the frontend's debug view
+TIMINGS_CACHE_SIZE = int(os.environ.get('TIMINGS_CACHE_SIZE', 1024))
+# 'json' for one JSON object per log line, 'text' for plain lines
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+log_handler = logging.StreamHandler()
+if LOG_FORMAT == 'json':
+    log_handler.setFormatter(JsonFormatter())
+logging.basicConfig(level=LOG_LEVEL, handlers=[log_handler])
+logger = logging.getLogger(__name__)
 
 # Create directories if they do not exist
 os.makedirs(PDF_FOLDER, exist_ok=True)
@@ -21,6 +68,219 @@ app.config['PDF_FOLDER'] = PDF_FOLDER
 app.config['PDF_IMAGES_FOLDER'] = PDF_IMAGES_FOLDER
 app.config['CHROMA_EMBEDDINGS_FOLDER'] = CHROMA_EMBEDDINGS_FOLDER
 
+# Shared, long-lived clients; fails fast at startup if the vector store cannot be opened
+_, _, embedder = init_clients(NUMPY_VECTORS_FOLDER if VECTOR_STORE == 'numpy' else CHROMA_EMBEDDINGS_FOLDER)
+
+# Cached embeddings are only valid for the provider that produced them
+doc_cache = DocumentCache(os.path.join(DOC_CACHE_FOLDER, embedder.name), DOC_CACHE_MAX_BYTES)
+jobs = JobManager(UPLOAD_WORKERS)
+# Summaries are generated after the upload job, so uploads never wait on them
+summary_jobs = JobManager(SUMMARY_JOB_WORKERS)
+summary_job_ids = {}
+summary_lock = threading.Lock()
+# Pages are rendered lazily, only when a query retrieves them
+render_cache = RenderCache(PDF_IMAGES_FOLDER)
+documents = DocumentRegistry(DOCUMENT_REGISTRY_PATH)
+# BM25 index of each collection, searched before (and sometimes instead of) the vectors
+lexical_indexes = LexicalIndexStore(LEXICAL_INDEX_FOLDER)
+# Exact query text -> embedding, and (documents, normalized query, retrieved chunks) -> answer
+embedding_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+answer_cache = TTLCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+request_timings = TTLCache(TIMINGS_CACHE_SIZE, 3600)
+
+UPLOAD_STAGES = ['extract', 'index']
+SUMMARY_STAGES = ['summarize']
+
+
+def release_document_files(doc_key):
+    """
+    Delete the stored PDF and cached renders of a document once no document ID uses it.
+
+    Args:
+    - doc_key (str): Content hash of the PDF.
+    """
+    if any(entry['doc_key'] == doc_key for entry in documents.all().values()):
+        return
+    render_cache.drop(doc_key)
+    try:
+        os.remove(os.path.join(app.config['PDF_FOLDER'], f'{doc_key}.pdf'))
+    except OSError:
+        pass
+
+
+def invalidate_answers(doc_id):
+    """
+    Drop cached answers that were built from a document.
+
+    Args:
+    - doc_id (str): Document ID.
+    """
+    answer_cache.invalidate(lambda key: doc_id in key[0])
+
+
+def remove_document(doc_id):
+    """
+    Remove a document's collection, registry entry and files.
+
+    Args:
+    - doc_id (str): Document ID.
+
+    Returns:
+    - bool: Whether the document existed.
+    """
+    entry = documents.remove(doc_id)
+    if entry is None:
+        return False
+    invalidate_answers(doc_id)
+    try:
+        get_chroma_client().delete_collection(entry['collection'])
+    except Exception:
+        logger.warning("Collection %s was already gone", entry['collection'])
+    lexical_indexes.drop(entry['collection'])
+    release_document_files(entry['doc_key'])
+    return True
+
+
+def sweep_documents():
+    """
+    Periodically remove documents that have not been used for DOCUMENT_TTL_SECONDS.
+    """
+    while True:
+        time.sleep(DOCUMENT_SWEEP_INTERVAL)
+        try:
+            for doc_id in documents.expired(DOCUMENT_TTL_SECONDS):
+                logger.info("Removing expired document %s", doc_id)
+                remove_document(doc_id)
+            documents.flush()
+        except Exception:
+            logger.exception("Document sweep failed")
+
+
+def summarize_document(job, doc_key, document_path, text_list=None):
+    """
+    Generate and cache the summary of a document, reporting progress on the job.
+
+    Args:
+    - job (Job): Job tracking the summary.
+    - doc_key (str): Content hash of the PDF.
+    - document_path (str): Path of the stored PDF.
+    - text_list (list, optional): Text of each page. Defaults to the cached or freshly
+      extracted text.
+
+    Returns:
+    - dict: The summary.
+    """
+    if text_list is None:
+        cached = doc_cache.get(doc_key)
+        text_list = cached['text_list'] if cached is not None else get_text(document_path)
+    with job.stage('summarize'):
+        summary = generate_summary(get_openai_client(), text_list,
+                                   progress=lambda fraction: job.set_progress('summarize', fraction))
+    doc_cache.put_summary(doc_key, summary)
+    return {'summary': summary}
+
+
+def start_summary(doc_key, document_path, text_list=None, retry=False):
+    """
+    Summarize a document in the background, unless it is already being summarized.
+
+    Args:
+    - doc_key (str): Content hash of the PDF.
+    - document_path (str): Path of the stored PDF.
+    - text_list (list, optional): Text of each page, if already extracted.
+    - retry (bool, optional): Start again if the last attempt failed.
+
+    Returns:
+    - Job: The job generating the summary.
+    """
+    with summary_lock:
+        job = summary_jobs.get(summary_job_ids.get(doc_key, ''))
+        if job is None or (retry and job.status == 'failed'):
+            with request_priority(PRIORITY_BULK):
+                job = summary_jobs.submit(SUMMARY_STAGES, summarize_document, doc_key, document_path, text_list)
+            summary_job_ids[doc_key] = job.id
+        return job
+
+
+def process_upload(job, document_path, doc_key, doc_id, filename):
+    """
+    Run the upload pipeline for a saved PDF, reporting per-stage progress on the job.
+
+    Args:
+    - job (Job): Job tracking this upload.
+    - document_path (str): Path of the saved PDF.
+    - doc_key (str): Content hash of the PDF.
+    - doc_id (str): Document ID the PDF is indexed under.
+    - filename (str): Name of the uploaded file.
+
+    Returns:
+    - dict: Document ID, summary (None while it is being generated), URL the summary
+      can be fetched from and stage timings of the upload.
+    """
+    client_cdb = get_chroma_client()
+    embedder = get_embedder()
+    col_name = collection_name(doc_id, embedder.name)
+    previous = documents.get(doc_id)
+
+    cached = doc_cache.get(doc_key)
+    if cached is not None:
+        # Identical bytes were processed before: make sure the collection holds this
+        # document, without any extraction or API calls.
+        job.skip('extract')
+        with job.stage('index'):
+            index_chunks(client_cdb,embedder,cached['chunks'],col_name,embeddings_list=cached['embeddings'])
+            chunks = cached['chunks']
+        text_list = cached['text_list']
+    else:
+        with job.stage('extract'):
+            # Pages are split into layout-aware chunks as they come out of the extractor
+            text_list, chunks = [], []
+            with pymupdf.open(document_path) as pdf_document:
+                page_count = pdf_document.page_count
+            with span('extract', pages=page_count) as fields:
+                for page in iter_pages(document_path, images=False, blocks=True):
+                    text_list.append(page['text'])
+                    chunks.extend(chunk_page(page['blocks'], page['page'], page['rect']))
+                    job.set_progress('extract', len(text_list) / page_count)
+                fields['chunks'] = len(chunks)
+        with job.stage('index'):
+            # Re-uploading a revised document under the same ID only embeds changed chunks
+            embeddings_list=index_chunks(client_cdb,embedder,chunks,col_name,
+                                        progress=lambda fraction: job.set_progress('index', fraction))
+        with span('doc_cache_put'):
+            doc_cache.put(doc_key, text_list, chunks, embeddings_list)
+
+    with span('lexical_index', chunks=len(chunks)):
+        ids, metadatas = chunk_rows(chunks)
+        lexical_indexes.put(col_name, ids, [chunk['text'] for chunk in chunks], metadatas)
+    documents.set(doc_id, doc_key, document_path, filename, col_name)
+    invalidate_answers(doc_id)
+    if previous is not None and previous['doc_key'] != doc_key:
+        release_document_files(previous['doc_key'])
+    summary = doc_cache.get_summary(doc_key)
+    # Offline ingestion has no model to summarize with; GET /documents/<id>/summary can
+    # still start it later
+    if summary is None and openai_configured():
+        start_summary(doc_key, document_path, text_list)
+    return {'doc_id': doc_id, 'summary': summary, 'summary_url': f'/documents/{doc_id}/summary',
+            'timings': list(stage_breakdown())}
+
+
+@app.before_request
+def begin_request():
+    # Clients may send their own ID to correlate their logs with ours
+    start_request(request.headers.get('X-Request-ID'))
+
+
+@app.after_request
+def end_request(response):
+    rid = request_id.get()
+    response.headers['X-Request-ID'] = rid
+    # Streamed responses keep adding spans to this list until the stream ends
+    request_timings.set(rid, stage_breakdown())
+    return response
+
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -29,24 +289,138 @@ def upload_file():
     if file.filename == '':
         return Response('No selected file', status=400)
     if file:
-        document_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-        file.save(document_path)
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-
-        client_openai=openai.OpenAI(api_key=openai_api_key)
-        #client_cdb = chromadb.Client()
-        client_cdb = chromadb.PersistentClient(path=app.config['CHROMA_EMBEDDINGS_FOLDER'])
-        col_name='doc1'
-        text_list=get_text(document_path)
-        images=get_images(document_path)
-        save_images(images, app.config['PDF_IMAGES_FOLDER'])
-        embeddings_list=create_all_embeddings(client_openai,text_list)
-        create_collection(client_cdb,embeddings_list,text_list,col_name)
-        summary=generate_summary(client_openai,text_list)
-        
-        return Response(summary, mimetype='text/plain')
-    
-    
+        file_bytes = file.read()
+        doc_key = document_key(file_bytes)
+        # Clients may pass their own ID to replace a revised document in place
+        doc_id = request.form.get('doc_id') or doc_key[:16]
+        if not valid_doc_id(doc_id):
+            return Response('Invalid doc_id', status=400)
+        document_path = os.path.join(app.config['PDF_FOLDER'], f'{doc_key}.pdf')
+        if not os.path.exists(document_path):
+            with open(document_path, 'wb') as f:
+                f.write(file_bytes)
+        # Ingestion requests wait behind the OpenAI requests of queries
+        with request_priority(PRIORITY_BULK):
+            job = jobs.submit(UPLOAD_STAGES, process_upload, document_path, doc_key, doc_id, file.filename)
+        return jsonify({'job_id': job.id, 'doc_id': doc_id, 'status_url': f'/jobs/{job.id}'}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return Response('Unknown job', status=404)
+    return jsonify(job.snapshot())
+
+
+@app.route('/documents', methods=['GET'])
+def list_documents():
+    return jsonify(documents.all())
+
+
+@app.route('/documents/<doc_id>/summary', methods=['GET'])
+def document_summary(doc_id):
+    document = documents.get(doc_id)
+    if document is None:
+        return Response('Unknown document', status=404)
+    summary = doc_cache.get_summary(document['doc_key'])
+    if summary is None:
+        # Summaries lost to cache eviction are generated again; failed ones only on ?retry=1
+        job = start_summary(document['doc_key'], document['path'], retry=bool(request.args.get('retry')))
+        snapshot = job.snapshot()
+        if snapshot['status'] != 'done':
+            return jsonify({'doc_id': doc_id, 'status': snapshot['status'], 'summary': None,
+                            'stages': snapshot['stages'], 'error': snapshot['error']}), 202
+        summary = snapshot['result']['summary']
+    return jsonify({'doc_id': doc_id, 'status': 'done', 'summary': summary})
+
+
+@app.route('/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    if not remove_document(doc_id):
+        return Response('Unknown document', status=404)
+    return Response(status=204)
+
+
+def lexical_index(client_cdb, col_name):
+    """
+    Args:
+    - client_cdb (ChromaDB Client): Instance of ChromaDB client.
+    - col_name (str): Name of the collection.
+
+    Returns:
+    - LexicalIndex: Lexical index of the collection, rebuilt from the collection if missing.
+    """
+    def load():
+        rows = client_cdb.get_or_create_collection(col_name).get(include=['documents', 'metadatas'])
+        return rows['ids'], rows['documents'], rows['metadatas']
+
+    return lexical_indexes.get(col_name, load)
+
+
+def retrieve_from_documents(client_cdb, embedder, selected, query, k):
+    """
+    Retrieve the k best chunks across one or more documents.
+
+    Each document's lexical index is searched first, and the hits of all documents are
+    ranked together by their normalized scores. When the hits are confident, such as for
+    an exact name or a page reference, they are used as they are and the query is never
+    embedded. Otherwise the query is embedded once, each document's collection is
+    searched with it and fused with its lexical hits, and results are merged by fused score.
+
+    Args:
+    - client_cdb (ChromaDB Client): Instance of ChromaDB client.
+    - embedder (embedding provider): Provider used to embed the query.
+    - selected (dict): Registry entries of the documents to search, keyed by document ID.
+    - query (str): Query text.
+    - k (int): Number of chunks to return.
+
+    Returns:
+    - list: (score, doc_id, chunk_id, text, metadata) tuples, best first.
+    """
+    hits = {
+        doc_id: retrieve_lexical(lexical_index(client_cdb, document['collection']), query)
+        for doc_id, document in selected.items()
+    }
+    merged = sorted(((hit, doc_id) for doc_id, doc_hits in hits.items() for hit in doc_hits),
+                    key=lambda item: -item[0]['score'])
+    if is_confident([hit for hit, _ in merged]):
+        results = lexical_results([hit for hit, _ in merged], k)
+        return list(zip(results['scores'][0], [doc_id for _, doc_id in merged[:k]], results['ids'][0],
+                        results['documents'][0], results['metadatas'][0]))
+
+    embedding_key = (embedder.name, query)
+    query_embedding = embedding_cache.get(embedding_key)
+    if query_embedding is None:
+        with span('embed_query'):
+            query_embedding = create_embeddings(embedder, query)
+        embedding_cache.set(embedding_key, query_embedding)
+    matches = []
+    for doc_id, document in selected.items():
+        match_results = retrieve_chunk(client_cdb, embedder, document['collection'], query,
+                                       k=k, query_embedding=query_embedding, lexical_hits=hits[doc_id])
+        matches.extend(zip(match_results['scores'][0], [doc_id] * len(match_results['ids'][0]),
+                           match_results['ids'][0], match_results['documents'][0], match_results['metadatas'][0]))
+    matches.sort(key=lambda match: -match[0])
+    return matches[:k]
+
+
+def crop_renderer(document, metadata):
+    """
+    Args:
+    - document (dict): Registry entry of the document.
+    - metadata (dict): Collection metadata of the chunk.
+
+    Returns:
+    - callable: Renders the chunk's region of its page and returns the image path.
+    """
+    def render():
+        with span('render', page=metadata['page']):
+            return render_cache.get_page_image(document['path'], document['doc_key'], metadata['page'],
+                                               clip=chunk_bbox(metadata))
+    return render
+
+
 @app.route('/query', methods=['POST'])
 
 def query():
@@ -54,17 +428,80 @@ def query():
     if 'query' not in data:
         return Response('No query found in the request', status=400)
     query = data['query']
-    openai_api_key = os.environ.get('OPENAI_API_KEY')
-    client_openai=openai.OpenAI(api_key=openai_api_key)
-    client_cdb = chromadb.PersistentClient(path=app.config['CHROMA_EMBEDDINGS_FOLDER'])
-    col_name='doc1'
-    match_results=retrieve_chunk(client_cdb,client_openai, col_name, query, k=1)
-    match_page_list=[int(pageno) for pageno in match_results['ids'][0]]
-    retrieved_chunks=[text for text in match_results['ids'][0]]
-    base_path = app.config['PDF_IMAGES_FOLDER']
-    image_paths = [f'{base_path}\\image_{i}.png' for i in match_page_list]
+    doc_ids = data.get('doc_ids') or ([data['doc_id']] if data.get('doc_id') else [])
+    if not doc_ids:
+        return Response('No doc_id found in the request', status=400)
+    selected = {doc_id: documents.get(doc_id) for doc_id in doc_ids}
+    missing = [doc_id for doc_id, document in selected.items() if document is None]
+    if missing:
+        return Response(f"Unknown document: {', '.join(missing)}", status=404)
+    try:
+        k = int(data.get('k', QUERY_TOP_K))
+    except (TypeError, ValueError):
+        return Response('k must be an integer', status=400)
+    k = min(max(k, 1), QUERY_MAX_K)
+    for doc_id in selected:
+        documents.touch(doc_id)
+
+    client_openai = get_openai_client()
+    client_cdb = get_chroma_client()
+    matches = retrieve_from_documents(client_cdb, get_embedder(), selected, query, k)
+    answer_key = (
+        tuple(sorted(selected)),
+        normalize_query(query),
+        tuple((doc_id, chunk_id) for _, doc_id, chunk_id, _, _ in matches),
+    )
+    cached_answer = answer_cache.get(answer_key)
+    if cached_answer is not None:
+        return Response(cached_answer, mimetype='text/plain')
+
+    retrieved_chunks=[text for _, _, _, text, _ in matches]
+    # Only the regions of the retrieved chunks are sent to the model, and only those
+    # build_context() attaches are rendered
+    image_paths = [crop_renderer(selected[doc_id], metadata) for _, doc_id, _, _, metadata in matches]
+    if data.get('stream'):
+        # Forward tokens as the model produces them using chunked transfer encoding
+        fragments = generate_response(client_openai, retrieved_chunks, query, image_paths, stream=True)
+
+        def stream_and_cache():
+            answer = []
+            for fragment in fragments:
+                answer.append(fragment)
+                yield fragment
+            answer_cache.set(answer_key, ''.join(answer))
+
+        return Response(stream_with_context(stream_and_cache()), mimetype='text/plain',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
     response = generate_response(client_openai, retrieved_chunks, query, image_paths)
+    answer_cache.set(answer_key, response)
     return Response(response, mimetype='text/plain')
 
+
+@app.route('/timings/<rid>', methods=['GET'])
+def timings(rid):
+    breakdown = request_timings.get(rid)
+    if breakdown is None:
+        return Response('Unknown request', status=404)
+    return jsonify({'request_id': rid, 'stages': breakdown})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'embeddings': embedding_cache.stats(), 'answers': answer_cache.stats(),
+                    'image_payloads': payload_cache.stats()})
+
+
+@app.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+
+threading.Thread(target=sweep_documents, name='document-sweeper', daemon=True).start()
+
 if __name__ == '__main__':
     app.run(debug=True,use_reloader=False)
\ No newline at end of file
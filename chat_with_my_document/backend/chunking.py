@@ -0,0 +1,89 @@
+import os
+import statistics
+
+# Target chunk length and overlap between consecutive chunks, in characters.
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 1500))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', 200))
+# A short block whose font is this much larger than the page's body text starts a section.
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 200
+
+
+def _union(bboxes):
+    return (
+        min(bbox[0] for bbox in bboxes),
+        min(bbox[1] for bbox in bboxes),
+        max(bbox[2] for bbox in bboxes),
+        max(bbox[3] for bbox in bboxes),
+    )
+
+
+def _is_heading(block, body_size):
+    return block['size'] >= body_size * HEADING_SIZE_RATIO and len(block['text']) <= HEADING_MAX_CHARS
+
+
+def _split_block(block, chunk_size, overlap):
+    # Blocks longer than a chunk are cut into overlapping character windows that share
+    # the block's bounding box.
+    text = block['text']
+    step = max(chunk_size - overlap, 1)
+    return [dict(block, text=text[start:start + chunk_size]) for start in range(0, len(text) - overlap, step)] or [block]
+
+
+def chunk_page(blocks, page_num, page_rect=None, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Split the text blocks of a page into chunks that follow its layout.
+
+    A heading (a short block set noticeably larger than the page's body text) always
+    starts a new chunk. Otherwise blocks are packed up to chunk_size characters; when a
+    chunk is full, its trailing blocks totalling at most overlap characters are repeated
+    at the start of the next chunk. A page without text blocks, such as a scan, gives a
+    single chunk with empty text covering the whole page, so it can still be retrieved
+    and sent as an image.
+
+    Args:
+    - blocks (list): Text blocks of the page as returned by page_extraction.page_blocks().
+    - page_num (int): Zero-based page number.
+    - page_rect (tuple, optional): (x0, y0, x1, y1) of the page, used as the bounding box
+      of the whole-page chunk. Without it that chunk has no bounding box.
+    - chunk_size (int, optional): Target chunk length in characters.
+    - overlap (int, optional): Overlap between consecutive chunks in characters.
+
+    Returns:
+    - list: One dict per chunk with 'text', 'page' and 'bbox' (x0, y0, x1, y1) covering
+      the blocks it was built from.
+    """
+    if not blocks:
+        return [{'text': '', 'page': page_num, 'bbox': tuple(page_rect) if page_rect else None}]
+    body_size = statistics.median(block['size'] for block in blocks)
+    pieces = []
+    for block in blocks:
+        pieces.extend(_split_block(block, chunk_size, overlap) if len(block['text']) > chunk_size else [block])
+
+    chunks = []
+    current = []
+
+    def flush():
+        if current:
+            chunks.append({
+                'text': '\n'.join(block['text'] for block in current),
+                'page': page_num,
+                'bbox': _union([block['bbox'] for block in current]),
+            })
+
+    for block in pieces:
+        length = sum(len(piece['text']) for piece in current)
+        if current and _is_heading(block, body_size):
+            flush()
+            current = []
+        elif current and length + len(block['text']) > chunk_size:
+            flush()
+            carried = []
+            for previous in reversed(current):
+                if sum(len(piece['text']) for piece in carried) + len(previous['text']) > overlap:
+                    break
+                carried.insert(0, previous)
+            current = carried
+        current.append(block)
+    flush()
+    return chunks
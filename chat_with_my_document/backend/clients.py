@@ -0,0 +1,184 @@
+import os
+import logging
+import threading
+import openai
+import chromadb
+from embeddings import EMBEDDING_PROVIDER, make_embedding_provider
+from metrics import MeteredTransport, httpx
+from openai_scheduler import ScheduledTransport
+from vector_store import NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Size of the HTTP connection pool shared by all OpenAI requests of the process.
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+# 'chroma' for the persistent ChromaDB store, or 'numpy' for memory-mapped float32
+# matrices searched exactly, which open and answer faster for single-document collections
+VECTOR_STORE = os.environ.get('VECTOR_STORE', 'chroma').lower()
+
+_lock = threading.Lock()
+_initialized = False
+_api_key = None
+_client_openai = None
+_client_cdb = None
+_embedder = None
+
+
+class CachedChromaClient:
+    """
+    Thread-safe wrapper around a ChromaDB client that caches collection handles.
+
+    get_or_create_collection returns the same handle for a name for the lifetime of the
+    process, so the collection lookup and segment loading only happen once. All other
+    attributes are delegated to the wrapped client.
+    """
+
+    def __init__(self, client_cdb):
+        """
+        Args:
+        - client_cdb (ChromaDB Client): Client to wrap.
+        """
+        self._client = client_cdb
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get_or_create_collection(self, name, **kwargs):
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = self._client.get_or_create_collection(name, **kwargs)
+                    self._collections[name] = collection
+        return collection
+
+    def delete_collection(self, name):
+        with self._lock:
+            self._collections.pop(name, None)
+            self._client.delete_collection(name)
+
+    def warm(self):
+        """
+        Open every existing collection and load its vector index into memory.
+
+        Returns:
+        - int: Number of collections warmed.
+        """
+        names = [getattr(collection, 'name', collection) for collection in self._client.list_collections()]
+        for name in names:
+            collection = self.get_or_create_collection(name)
+            sample = collection.peek(1)
+            if len(sample['ids']):
+                # A one-result query forces the HNSW segment to be loaded now rather than
+                # on the first user query.
+                collection.query(query_embeddings=[sample['embeddings'][0]], n_results=1, include=[])
+        return len(names)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _create_openai_client():
+    # Calls go through the process-wide rate-limit scheduler, which also retries them;
+    # the metered transport records latency, bytes and tokens of every attempt
+    http_client = openai.DefaultHttpxClient(
+        transport=ScheduledTransport(
+            MeteredTransport(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                )
+            )
+        )
+    )
+    return openai.OpenAI(
+        api_key=_api_key or os.environ.get('OPENAI_API_KEY'),
+        http_client=http_client,
+        max_retries=0
+    )
+
+
+def init_clients(chroma_path, api_key=None):
+    """
+    Create the process-wide embedding provider and vector store client (selected by
+    VECTOR_STORE), and check that the store opens. The OpenAI client is only created
+    here if the embedding provider uses it; otherwise on first use, so offline
+    ingestion runs without an API key.
+
+    Args:
+    - chroma_path (str): Directory of the persistent vector store.
+    - api_key (str, optional): OpenAI API key. Defaults to the OPENAI_API_KEY variable.
+
+    Returns:
+    - tuple: (OpenAI client or None, CachedChromaClient or NumpyVectorStore, embedding provider).
+
+    Raises:
+    - RuntimeError: If the vector store cannot be opened or read.
+    """
+    global _initialized, _api_key, _client_openai, _client_cdb, _embedder
+    with _lock:
+        _initialized = True
+        _api_key = api_key or _api_key
+        if _embedder is None:
+            if EMBEDDING_PROVIDER == 'openai' and _client_openai is None:
+                _client_openai = _create_openai_client()
+            _embedder = make_embedding_provider(_client_openai)
+        if _client_cdb is None:
+            try:
+                if VECTOR_STORE == 'numpy':
+                    client_cdb = NumpyVectorStore(chroma_path)
+                else:
+                    client_cdb = CachedChromaClient(chromadb.PersistentClient(path=chroma_path))
+                client_cdb.heartbeat()
+                warmed = client_cdb.warm()
+            except Exception as e:
+                raise RuntimeError(f'Failed to open the {VECTOR_STORE} vector store at {chroma_path}: {e}') from e
+            logger.info("Opened %s vector store at %s, warmed %d collections", VECTOR_STORE, chroma_path, warmed)
+            _client_cdb = client_cdb
+    return _client_openai, _client_cdb, _embedder
+
+
+def get_openai_client():
+    """
+    Returns:
+    - OpenAI Client: Shared OpenAI client, created on first use after init_clients().
+
+    Raises:
+    - OpenAIError: If no API key is configured.
+    """
+    global _client_openai
+    if _client_openai is None:
+        with _lock:
+            if not _initialized:
+                raise RuntimeError('init_clients() has not been called')
+            if _client_openai is None:
+                _client_openai = _create_openai_client()
+    return _client_openai
+
+
+def openai_configured():
+    """
+    Returns:
+    - bool: Whether an OpenAI client exists or can be created with a configured API key.
+    """
+    return _client_openai is not None or bool(_api_key or os.environ.get('OPENAI_API_KEY'))
+
+
+def get_chroma_client():
+    """
+    Returns:
+    - CachedChromaClient or NumpyVectorStore: Shared vector store client created by init_clients().
+    """
+    if _client_cdb is None:
+        raise RuntimeError('init_clients() has not been called')
+    return _client_cdb
+
+
+def get_embedder():
+    """
+    Returns:
+    - provider: Shared embedding provider created by init_clients().
+    """
+    if _embedder is None:
+        raise RuntimeError('init_clients() has not been called')
+    return _embedder
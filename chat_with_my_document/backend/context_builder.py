@@ -0,0 +1,238 @@
+import os
+import math
+import base64
+import logging
+import threading
+import mimetypes
+from collections import OrderedDict
+import pymupdf
+
+logger = logging.getLogger(__name__)
+
+# Budgets of the context sent with a single question, images included
+CONTEXT_MAX_TOKENS = int(os.environ.get('CONTEXT_MAX_TOKENS', 6000))
+CONTEXT_MAX_IMAGE_BYTES = int(os.environ.get('CONTEXT_MAX_IMAGE_BYTES', 2 * 1024 ** 2))
+# 'auto' attaches the crops of chunks whose text is likely to lose information (tables,
+# figures, scans), 'all' attaches every crop and 'none' sends text only.
+CONTEXT_IMAGES = os.environ.get('CONTEXT_IMAGES', 'auto').lower()
+PAYLOAD_CACHE_MAX_BYTES = int(os.environ.get('PAYLOAD_CACHE_MAX_BYTES', 64 * 1024 ** 2))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+
+# The model fits images within 2048x2048 and then scales the short side down to 768
+# pixels, so anything larger only costs upload bytes. Each 512 pixel tile then costs
+# 170 tokens on top of a base of 85.
+IMAGE_MAX_LONG_SIDE = 2048
+IMAGE_MAX_SHORT_SIDE = 768
+IMAGE_TILE_SIZE = 512
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+
+# Chunks shorter than this, or with this share of digits, are probably figures or tables
+SPARSE_TEXT_CHARS = 200
+DIGIT_RATIO = 0.2
+# A chunk cut to fit the budget is dropped instead if less than this much of it would remain
+MIN_TRUNCATED_CHARS = 200
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a text (about 4 characters per token).
+
+    Args:
+    - text (str): Text to estimate.
+
+    Returns:
+    - int: Estimated token count.
+    """
+    return len(text) // 4 + 1
+
+
+def scaled_size(width, height):
+    """
+    Args:
+    - width (int): Image width in pixels.
+    - height (int): Image height in pixels.
+
+    Returns:
+    - tuple: (width, height) the model actually looks at.
+    """
+    scale = min(1.0, IMAGE_MAX_LONG_SIDE / max(width, height), IMAGE_MAX_SHORT_SIDE / min(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def image_tokens(width, height):
+    """
+    Args:
+    - width (int): Width of the image as sent, in pixels.
+    - height (int): Height of the image as sent, in pixels.
+
+    Returns:
+    - int: Tokens the image is billed as.
+    """
+    width, height = scaled_size(width, height)
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
+def needs_image(text):
+    """
+    Args:
+    - text (str): Extracted text of a chunk.
+
+    Returns:
+    - bool: Whether the chunk looks like a table, figure or scan, whose layout the text
+      does not carry.
+    """
+    stripped = ''.join(text.split())
+    if len(stripped) < SPARSE_TEXT_CHARS:
+        return True
+    return sum(char.isdigit() for char in stripped) / len(stripped) >= DIGIT_RATIO
+
+
+def encode_payload(image_path):
+    """
+    Downscale an image to the size the model uses and encode it as a data URL.
+
+    Args:
+    - image_path (str): Path to the image file.
+
+    Returns:
+    - tuple: (data URL, width, height) of the image as sent.
+    """
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    mime_type = mimetypes.guess_type(image_path)[0] or 'image/jpeg'
+    try:
+        pix = pymupdf.Pixmap(image_path)
+    except Exception:
+        # Formats MuPDF cannot read, such as WebP, are sent as they are and budgeted at
+        # the largest size the model uses
+        return f'data:{mime_type};base64,{base64.b64encode(image_bytes).decode("utf-8")}', \
+            IMAGE_MAX_SHORT_SIDE, IMAGE_MAX_LONG_SIDE
+    width, height = scaled_size(pix.width, pix.height)
+    if (width, height) != (pix.width, pix.height):
+        if pix.alpha:
+            pix = pymupdf.Pixmap(pix, 0)
+        image_bytes = pymupdf.Pixmap(pix, width, height, None).tobytes('jpeg', jpg_quality=IMAGE_QUALITY)
+        mime_type = 'image/jpeg'
+    return f'data:{mime_type};base64,{base64.b64encode(image_bytes).decode("utf-8")}', width, height
+
+
+class PayloadCache:
+    """
+    Thread-safe in-memory LRU of encoded image payloads, bounded by their total size.
+
+    Entries are keyed by path and modification time, so a re-rendered file is encoded again.
+    """
+
+    def __init__(self, max_bytes=PAYLOAD_CACHE_MAX_BYTES):
+        """
+        Args:
+        - max_bytes (int, optional): Maximum total length of the cached data URLs.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, image_path):
+        """
+        Args:
+        - image_path (str): Path to the image file.
+
+        Returns:
+        - tuple: encode_payload() of the image.
+        """
+        key = (image_path, os.stat(image_path).st_mtime_ns)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+        payload = encode_payload(image_path)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = payload
+                self._size += len(payload[0])
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[0])
+        return payload
+
+    def stats(self):
+        """
+        Returns:
+        - dict: Number of entries, their total size, hits and misses.
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'hits': self.hits, 'misses': self.misses}
+
+
+payload_cache = PayloadCache()
+
+
+def build_context(chunks, image_paths=(), reserved_tokens=0, max_tokens=CONTEXT_MAX_TOKENS,
+                  max_image_bytes=CONTEXT_MAX_IMAGE_BYTES, images=CONTEXT_IMAGES):
+    """
+    Assemble the context of a question within a token and image-byte budget.
+
+    Chunks are taken in rank order. Each one contributes its text, cut short if it is the
+    one that reaches the token budget, and its page crop when the images policy asks
+    for it and the crop still fits both budgets.
+
+    Args:
+    - chunks (list): Retrieved text chunks, best first.
+    - image_paths (list, optional): Crop of each chunk, in the same order, as a path or as
+      a callable returning the path; callables are only called for attached crops.
+    - reserved_tokens (int, optional): Tokens already used by the prompt and question.
+    - max_tokens (int, optional): Token budget of the whole prompt, images included.
+    - max_image_bytes (int, optional): Budget of the encoded images.
+    - images (str, optional): 'auto', 'all' or 'none'.
+
+    Returns:
+    - tuple: (context text, image data URLs, stats dict with 'tokens', 'image_bytes',
+      'chunks', 'images', 'dropped_chunks' and 'dropped_images').
+    """
+    tokens = reserved_tokens
+    texts, urls = [], []
+    image_bytes = dropped_chunks = dropped_images = 0
+    for i, text in enumerate(chunks):
+        text_tokens = estimate_tokens(text)
+        if tokens + text_tokens > max_tokens:
+            keep_chars = (max_tokens - tokens) * 4
+            # The estimate of the cut text can still be over, so cut until it fits
+            while keep_chars >= MIN_TRUNCATED_CHARS and tokens + estimate_tokens(text[:keep_chars]) > max_tokens:
+                keep_chars -= 4
+            if keep_chars < MIN_TRUNCATED_CHARS:
+                dropped_chunks += 1
+                continue
+            text = text[:keep_chars]
+            text_tokens = estimate_tokens(text)
+        texts.append(text)
+        tokens += text_tokens
+
+        if i >= len(image_paths) or images == 'none' or (images == 'auto' and not needs_image(text)):
+            continue
+        image_path = image_paths[i]() if callable(image_paths[i]) else image_paths[i]
+        url, width, height = payload_cache.get(image_path)
+        cost = image_tokens(width, height)
+        if tokens + cost > max_tokens or image_bytes + len(url) > max_image_bytes:
+            dropped_images += 1
+            continue
+        urls.append(url)
+        tokens += cost
+        image_bytes += len(url)
+
+    stats = {
+        'tokens': tokens,
+        'image_bytes': image_bytes,
+        'chunks': len(texts),
+        'images': len(urls),
+        'dropped_chunks': dropped_chunks,
+        'dropped_images': dropped_images,
+    }
+    return '\n\n'.join(texts), urls, stats
@@ -0,0 +1,174 @@
+import os
+import json
+import shutil
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentCache:
+    """
+    Persistent, content-addressed cache of processed PDF documents.
+
+    Each entry is a directory named after the SHA-256 of the PDF holding the extracted
+    page text, chunks and chunk embeddings, and the summary once it has been generated
+    (rendered pages live in the RenderCache).
+    Entries are evicted in least-recently-used order once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        """
+        Args:
+        - root (str): Directory where cache entries are stored.
+        - max_bytes (int): Maximum total size of the cache on disk.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        # Rebuild the LRU order and entry sizes from previous runs; writes keep them
+        # up to date afterwards, so eviction never walks the cache again
+        entries = [entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.startswith('.')]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._sizes[entry.name] = _dir_size(entry.path)
+        self._total = sum(self._sizes.values())
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """
+        Look up a processed document and mark it as recently used.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+
+        Returns:
+        - dict or None: 'text_list', 'chunks' and 'embeddings' of the cached document, or
+          None on a miss.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(os.path.join(path, 'text.json')) as f:
+                text_list = json.load(f)
+            with open(os.path.join(path, 'chunks.json')) as f:
+                chunks = json.load(f)
+            with open(os.path.join(path, 'embeddings.json')) as f:
+                embeddings_list = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+            try:
+                # The directory mtime doubles as the last-used timestamp when the cache is reopened
+                os.utime(path)
+            except OSError:
+                pass
+        return {
+            'text_list': text_list,
+            'chunks': chunks,
+            'embeddings': embeddings_list,
+        }
+
+    def put(self, key, text_list, chunks, embeddings_list):
+        """
+        Store a processed document, then evict old entries if the cache is over its cap.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - text_list (list): Text extracted from each page.
+        - chunks (list): Chunks the document was indexed with.
+        - embeddings_list (list): Embedding of each chunk.
+
+        Returns:
+        - None
+        """
+        # Write into a temporary directory and rename it so readers never see a partial entry
+        tmp_path = os.path.join(self.root, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(tmp_path)
+        with open(os.path.join(tmp_path, 'text.json'), 'w') as f:
+            json.dump(text_list, f)
+        with open(os.path.join(tmp_path, 'chunks.json'), 'w') as f:
+            json.dump(chunks, f)
+        with open(os.path.join(tmp_path, 'embeddings.json'), 'w') as f:
+            json.dump(embeddings_list, f)
+
+        with self._lock:
+            path = self._entry_path(key)
+            if os.path.exists(path):
+                # The entry may already hold a summary; add the processed pages next to it
+                for name in os.listdir(tmp_path):
+                    os.replace(os.path.join(tmp_path, name), os.path.join(path, name))
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            else:
+                os.rename(tmp_path, path)
+            self._update(key)
+
+    def get_summary(self, key):
+        """
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+
+        Returns:
+        - str or None: Summary of the document, or None if it has not been generated.
+        """
+        try:
+            with open(os.path.join(self._entry_path(key), 'summary.txt')) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_summary(self, key, summary):
+        """
+        Store the summary of a document, next to its processed pages if they are cached.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - summary (str): Summary of the document.
+
+        Returns:
+        - None
+        """
+        path = os.path.join(self._entry_path(key), 'summary.txt')
+        with self._lock:
+            os.makedirs(self._entry_path(key), exist_ok=True)
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(summary)
+            os.replace(tmp_path, path)
+            self._update(key)
+
+    def _update(self, key):
+        # Called with the lock held after writing an entry, which holds a few files only
+        size = _dir_size(self._entry_path(key))
+        self._total += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._sizes.move_to_end(key)
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        for name in list(self._sizes):
+            if self._total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            size = self._sizes.pop(name)
+            shutil.rmtree(self._entry_path(name), ignore_errors=True)
+            self._total -= size
+            logger.info("Evicted cached document %s (%d bytes)", name, size)
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import threading
+
+# Document IDs become part of a ChromaDB collection name, which must start and end with
+# an alphanumeric character.
+DOC_ID_PATTERN = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,46}[A-Za-z0-9])?$')
+
+
+def valid_doc_id(doc_id):
+    """
+    Args:
+    - doc_id (str): Document ID supplied by a client.
+
+    Returns:
+    - bool: Whether the ID can be used to name a collection.
+    """
+    return isinstance(doc_id, str) and bool(DOC_ID_PATTERN.match(doc_id))
+
+
+def collection_name(doc_id, namespace):
+    """
+    Args:
+    - doc_id (str): Document ID.
+    - namespace (str): Name of the embedding provider; vectors from different providers
+      cannot share a collection.
+
+    Returns:
+    - str: Name of the ChromaDB collection holding the document.
+    """
+    return f'{namespace}-{doc_id}'
+
+
+class DocumentRegistry:
+    """
+    JSON-backed registry of the indexed documents.
+
+    Maps a document ID to the content hash, stored path and collection of its PDF, and
+    tracks when each document was last used so abandoned documents can be expired.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+        - path (str): Path of the JSON file backing the registry.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, doc_id):
+        """
+        Args:
+        - doc_id (str): Document ID.
+
+        Returns:
+        - dict or None: 'doc_key', 'path', 'filename', 'collection', 'created' and
+          'last_access' of the document, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            return dict(entry) if entry else None
+
+    def all(self):
+        """
+        Returns:
+        - dict: Copy of every entry, keyed by document ID.
+        """
+        with self._lock:
+            return {doc_id: dict(entry) for doc_id, entry in self._entries.items()}
+
+    def set(self, doc_id, doc_key, document_path, filename, collection):
+        """
+        Record the document indexed under a document ID.
+
+        Args:
+        - doc_id (str): Document ID.
+        - doc_key (str): Content hash of the PDF.
+        - document_path (str): Path of the stored PDF.
+        - filename (str): Name of the uploaded file.
+        - collection (str): Name of the collection holding the document.
+
+        Returns:
+        - None
+        """
+        now = time.time()
+        with self._lock:
+            self._entries[doc_id] = {
+                'doc_key': doc_key,
+                'path': document_path,
+                'filename': filename,
+                'collection': collection,
+                'created': self._entries.get(doc_id, {}).get('created', now),
+                'last_access': now,
+            }
+            self._save()
+
+    def touch(self, doc_id):
+        """
+        Mark a document as used now. The change is persisted by the next write.
+
+        Args:
+        - doc_id (str): Document ID.
+        """
+        with self._lock:
+            if doc_id in self._entries:
+                self._entries[doc_id]['last_access'] = time.time()
+
+    def remove(self, doc_id):
+        """
+        Args:
+        - doc_id (str): Document ID.
+
+        Returns:
+        - dict or None: The removed entry.
+        """
+        with self._lock:
+            entry = self._entries.pop(doc_id, None)
+            self._save()
+            return entry
+
+    def expired(self, ttl):
+        """
+        Args:
+        - ttl (float): Seconds a document may stay unused.
+
+        Returns:
+        - list: IDs of the documents unused for longer than ttl.
+        """
+        cutoff = time.time() - ttl
+        with self._lock:
+            return [doc_id for doc_id, entry in self._entries.items() if entry['last_access'] < cutoff]
+
+    def flush(self):
+        """
+        Persist in-memory access times.
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,127 @@
+import os
+import re
+import zlib
+import numpy as np
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# 'openai' or 'hashing' (local, offline)
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'openai').lower()
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', 512))
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+class OpenAIEmbeddingProvider:
+    """
+    Embedding provider backed by the OpenAI embeddings API.
+    """
+
+    def __init__(self, client_openai, model=EMBEDDING_MODEL):
+        """
+        Args:
+        - client_openai (OpenAI Client): Instance of OpenAI client.
+        - model (str, optional): Embedding model name.
+        """
+        self.client_openai = client_openai
+        self.model = model
+        self.name = 'openai'
+
+    def embed(self, texts):
+        """
+        Embed a batch of texts with a single API request.
+
+        Args:
+        - texts (list): Texts to embed.
+
+        Returns:
+        - list: One embedding (list of floats) per text, in input order.
+        """
+        # The API rejects empty strings, so blank texts are sent as a single space.
+        response = self.client_openai.embeddings.create(
+            input=[text if text.strip() else ' ' for text in texts],
+            model=self.model
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class HashingEmbeddingProvider:
+    """
+    Deterministic, offline embedding provider using the hashing trick.
+
+    Word unigrams and bigrams are hashed with CRC32 into dim signed buckets, weighted by
+    log term frequency and L2-normalized. The same text always gives the same vector, on
+    any machine, without network access.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        """
+        Args:
+        - dim (int, optional): Dimension of the vectors.
+        """
+        self.dim = dim
+        self.name = f'hashing{dim}'
+
+    def _features(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        return tokens + [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+
+    def embed(self, texts):
+        """
+        Embed a batch of texts.
+
+        Args:
+        - texts (list): Texts to embed.
+
+        Returns:
+        - list: One embedding (list of floats) per text, in input order.
+        """
+        rows, hashes = [], []
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            rows.extend([row] * len(features))
+            hashes.extend(zlib.crc32(feature.encode('utf-8')) for feature in features)
+        rows = np.asarray(rows, dtype=np.int64)
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        # Low bits pick the bucket, the top bit picks the sign to reduce collision bias
+        buckets = (hashes % self.dim).astype(np.int64)
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+
+        counts = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(counts, (rows, buckets), signs)
+        vectors = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+        return vectors.tolist()
+
+
+def as_provider(embedder):
+    """
+    Wrap an OpenAI client as an embedding provider; providers are returned unchanged.
+
+    Args:
+    - embedder (OpenAI Client or provider): Object to use for embeddings.
+
+    Returns:
+    - provider: Object with an embed(texts) method and a name.
+    """
+    if hasattr(embedder, 'embed'):
+        return embedder
+    return OpenAIEmbeddingProvider(embedder)
+
+
+def make_embedding_provider(client_openai, provider=EMBEDDING_PROVIDER):
+    """
+    Build the embedding provider selected by configuration.
+
+    Args:
+    - client_openai (OpenAI Client): Instance of OpenAI client, used by the 'openai' provider.
+    - provider (str, optional): 'openai' or 'hashing'. Defaults to EMBEDDING_PROVIDER.
+
+    Returns:
+    - provider: Embedding provider.
+    """
+    if provider == 'openai':
+        return OpenAIEmbeddingProvider(client_openai)
+    if provider == 'hashing':
+        return HashingEmbeddingProvider()
+    raise ValueError(f'Unknown embedding provider: {provider}')
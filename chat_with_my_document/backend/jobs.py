@@ -0,0 +1,163 @@
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    State of a background job and of each of its pipeline stages.
+
+    Stages move from 'pending' to 'running' to 'done' (or 'failed'); progress is a
+    fraction between 0 and 1. The job itself is 'queued', 'running', 'done' or 'failed'.
+    """
+
+    def __init__(self, stages):
+        """
+        Args:
+        - stages (list): Names of the pipeline stages, in the order they run.
+        """
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.stages = {
+            name: {'status': 'pending', 'progress': 0.0, 'seconds': None}
+            for name in stages
+        }
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that marks a stage as running, then done or failed.
+
+        Args:
+        - name (str): Name of the stage.
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, {'status': 'pending', 'progress': 0.0, 'seconds': None})
+            stage['status'] = 'running'
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                stage['status'] = 'failed'
+                stage['seconds'] = time.perf_counter() - started
+            raise
+        with self._lock:
+            stage['status'] = 'done'
+            stage['progress'] = 1.0
+            stage['seconds'] = time.perf_counter() - started
+
+    def set_progress(self, name, progress):
+        """
+        Update the progress of a running stage.
+
+        Args:
+        - name (str): Name of the stage.
+        - progress (float): Completed fraction between 0 and 1.
+        """
+        with self._lock:
+            self.stages[name]['progress'] = min(max(progress, 0.0), 1.0)
+
+    def skip(self, *names):
+        """
+        Mark stages that are not needed for this job as skipped.
+
+        Args:
+        - names (str): Names of the stages.
+        """
+        with self._lock:
+            for name in names:
+                self.stages[name]['status'] = 'skipped'
+
+    def snapshot(self):
+        """
+        Returns:
+        - dict: JSON-serializable view of the job and its stages.
+        """
+        with self._lock:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'created': self.created,
+                'finished': self.finished,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'result': self.result,
+                'error': self.error,
+            }
+
+
+class JobManager:
+    """
+    Runs jobs on a local thread pool and keeps their state for status polling.
+
+    Finished jobs are forgotten after ttl seconds.
+    """
+
+    def __init__(self, max_workers, ttl=3600):
+        """
+        Args:
+        - max_workers (int): Number of jobs run concurrently.
+        - ttl (int, optional): Seconds a finished job stays queryable. Defaults to one hour.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+
+    def submit(self, stages, fn, *args, **kwargs):
+        """
+        Queue a job. fn is called as fn(job, *args, **kwargs) and its return value becomes
+        the job result.
+
+        Args:
+        - stages (list): Names of the pipeline stages of the job.
+        - fn (callable): Function running the pipeline.
+
+        Returns:
+        - Job: The queued job.
+        """
+        job = Job(stages)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        # The job runs in a copy of the submitter's context, keeping its request ID for logs
+        self._executor.submit(contextvars.copy_context().run, self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """
+        Args:
+        - job_id (str): ID of the job.
+
+        Returns:
+        - Job or None: The job, or None if it is unknown or expired.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.error = str(e)
+            job.status = 'failed'
+        job.finished = time.time()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
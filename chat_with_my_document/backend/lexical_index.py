@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Constant of reciprocal rank fusion; larger values flatten the weight of the top ranks
+RRF_K = int(os.environ.get('RRF_K', 60))
+# The best lexical hit must score this many times the runner-up to skip the embedding call
+LEXICAL_CONFIDENCE_RATIO = float(os.environ.get('LEXICAL_CONFIDENCE_RATIO', 1.5))
+# It must also match at least this many query terms; one matching word is too weak a signal
+LEXICAL_MIN_TERMS = int(os.environ.get('LEXICAL_MIN_TERMS', 2))
+
+# Numbers keep their separators so '1,000' and '1000' become the same term
+TOKEN_PATTERN = re.compile(r'\d[\d,]*(?:\.\d+)?|[^\W_]+')
+PAGE_PATTERN = re.compile(r'\bpage\s+(\d+)\b', re.IGNORECASE)
+STOPWORDS = frozenset((
+    'a', 'about', 'all', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'did', 'do', 'does', 'document',
+    'for', 'from', 'give', 'has', 'have', 'how', 'i', 'in', 'is', 'it', 'its', 'list', 'me', 'mentioned', 'of',
+    'on', 'or', 'please', 'show', 'tell', 'that', 'the', 'their', 'there', 'this', 'to', 'was', 'were', 'what',
+    'when', 'where', 'which', 'who', 'whom', 'why', 'with',
+))
+
+
+def tokenize(text):
+    """
+    Args:
+    - text (str): Text to split.
+
+    Returns:
+    - list: Lower-cased terms, with thousands separators removed from numbers.
+    """
+    return [token.replace(',', '') for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+def parse_query(query):
+    """
+    Args:
+    - query (str): Question text.
+
+    Returns:
+    - tuple: (distinct search terms without stopwords, zero-based page number the query
+      refers to, or None).
+    """
+    match = PAGE_PATTERN.search(query)
+    page_num = int(match.group(1)) - 1 if match and int(match.group(1)) > 0 else None
+    if match:
+        query = query[:match.start()] + query[match.end():]
+    terms = [term for term in tokenize(query) if term not in STOPWORDS]
+    return list(dict.fromkeys(terms)), page_num
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over the chunks of one collection.
+    """
+
+    def __init__(self, ids, texts, metadatas):
+        """
+        Args:
+        - ids (list): Collection IDs of the chunks.
+        - texts (list): Text of each chunk.
+        - metadatas (list): Collection metadata of each chunk, with its 'page'.
+        """
+        self.ids = list(ids)
+        self.texts = list(texts)
+        self.metadatas = list(metadatas)
+        self._postings = defaultdict(list)
+        self._lengths = []
+        for row, text in enumerate(self.texts):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self._postings[term].append((row, frequency))
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k):
+        """
+        Rank chunks against a query with BM25.
+
+        Scores are divided by the highest score the query can reach in this index, so
+        hits of different indexes can be compared. A query naming a page ('page 12') only
+        searches the chunks of that page, and returns them even if none of the other
+        terms match.
+
+        Args:
+        - query (str): Question text.
+        - k (int): Maximum number of hits.
+
+        Returns:
+        - list: Hits, best first, as dicts with 'id', 'text', 'metadata', 'score'
+          (between 0 and 1), 'matched' (number of query terms found in the chunk),
+          'coverage' (share of the query terms found in the chunk) and 'page_match'
+          (whether the query named the chunk's page).
+        """
+        terms, page_num = parse_query(query)
+        rows = None
+        if page_num is not None:
+            rows = {row for row, metadata in enumerate(self.metadatas) if metadata.get('page') == page_num}
+        scores = defaultdict(float)
+        matched = Counter()
+        # A term adds at most idf * (k1 + 1), however often it occurs
+        max_score = 0.0
+        for term in terms:
+            postings = self._postings.get(term, ())
+            idf = math.log(1 + (len(self.ids) - len(postings) + 0.5) / (len(postings) + 0.5))
+            max_score += idf * (BM25_K1 + 1)
+            for row, frequency in postings:
+                if rows is not None and row not in rows:
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[row] / self._avg_length
+                scores[row] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+                matched[row] += 1
+        for row in rows or ():
+            scores.setdefault(row, 0.0)
+        ranked = sorted(scores, key=lambda row: (-scores[row], row))[:k]
+        return [{
+            'id': self.ids[row],
+            'text': self.texts[row],
+            'metadata': self.metadatas[row],
+            'score': scores[row] / max_score if max_score else 0.0,
+            'matched': matched[row],
+            'coverage': matched[row] / len(terms) if terms else 0.0,
+            'page_match': rows is not None,
+        } for row in ranked]
+
+    def to_dict(self):
+        """
+        Returns:
+        - dict: 'ids', 'texts' and 'metadatas' the index can be rebuilt from.
+        """
+        return {'ids': self.ids, 'texts': self.texts, 'metadatas': self.metadatas}
+
+
+def is_confident(hits):
+    """
+    Decide whether lexical hits answer a query well enough to skip the vector search.
+
+    That is the case when the query names a page that exists, or when the best hit
+    contains every query term, at least LEXICAL_MIN_TERMS of them, and clearly outscores
+    the runner-up. A page reference alone is enough: any query that names an existing
+    page skips the vector search, whatever else it asks.
+
+    Args:
+    - hits (list): Hits from LexicalIndex.search(), best first; may span several indexes.
+
+    Returns:
+    - bool: Whether the hits can be used on their own.
+    """
+    if not hits:
+        return False
+    top = hits[0]
+    if top['page_match']:
+        return True
+    if top['coverage'] < 1 or top['matched'] < LEXICAL_MIN_TERMS or top['score'] <= 0:
+        return False
+    runner_up = hits[1]['score'] if len(hits) > 1 else 0.0
+    return top['score'] >= LEXICAL_CONFIDENCE_RATIO * runner_up
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Args:
+    - rankings (list): Lists of IDs, each ordered best first.
+    - k (int, optional): Rank offset of the fusion.
+
+    Returns:
+    - dict: Fused score of every ID; higher is better.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, row_id in enumerate(ranking):
+            fused[row_id] += 1.0 / (k + rank + 1)
+    return dict(fused)
+
+
+class LexicalIndexStore:
+    """
+    Lexical indexes of the collections, kept in memory and persisted as JSON so they
+    survive restarts.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+        - root (str): Directory where the indexes are stored.
+        """
+        self.root = root
+        self._indexes = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, col_name):
+        return os.path.join(self.root, f'{col_name}.json')
+
+    def get(self, col_name, load=None):
+        """
+        Args:
+        - col_name (str): Name of the collection.
+        - load (callable, optional): Called with no arguments to rebuild a missing index;
+          returns (ids, texts, metadatas).
+
+        Returns:
+        - LexicalIndex or None: The index, or None if it is missing and cannot be loaded.
+        """
+        index = self._indexes.get(col_name)
+        if index is not None:
+            return index
+        try:
+            with open(self._path(col_name)) as f:
+                rows = json.load(f)
+            index = LexicalIndex(rows['ids'], rows['texts'], rows['metadatas'])
+        except (OSError, ValueError, KeyError):
+            if load is None:
+                return None
+            # Collections indexed before lexical indexes existed are rebuilt from the store
+            logger.info("Rebuilding lexical index of %s", col_name)
+            index = self.put(col_name, *load())
+        with self._lock:
+            return self._indexes.setdefault(col_name, index)
+
+    def put(self, col_name, ids, texts, metadatas):
+        """
+        Build, store and return the index of a collection, replacing any previous one.
+
+        Args:
+        - col_name (str): Name of the collection.
+        - ids (list): Collection IDs of the chunks.
+        - texts (list): Text of each chunk.
+        - metadatas (list): Collection metadata of each chunk.
+
+        Returns:
+        - LexicalIndex: The new index.
+        """
+        index = LexicalIndex(ids, texts, metadatas)
+        tmp_path = f'{self._path(col_name)}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index.to_dict(), f)
+        with self._lock:
+            os.replace(tmp_path, self._path(col_name))
+            self._indexes[col_name] = index
+        return index
+
+    def drop(self, col_name):
+        """
+        Args:
+        - col_name (str): Name of the collection.
+        """
+        with self._lock:
+            self._indexes.pop(col_name, None)
+            try:
+                os.remove(self._path(col_name))
+            except OSError:
+                pass
@@ -0,0 +1,265 @@
+import re
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# The OpenAI SDK is built on httpx2 (on httpx before it), and the metered transport has
+# to come from the same library as the client
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache lookup to a long upload stage
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Size buckets for tokens and bytes of a single OpenAI call
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# ID of the HTTP request or job the current code runs for, and the spans timed under it
+request_id = contextvars.ContextVar('request_id', default=None)
+_spans = contextvars.ContextVar('spans', default=None)
+
+USAGE_PATTERN = re.compile(rb'"(prompt_tokens|completion_tokens)"\s*:\s*(\d+)')
+MODEL_PATTERN = re.compile(rb'"model"\s*:\s*"([^"]+)"')
+# Bytes kept from the end of a response body to find its token usage
+USAGE_TAIL_BYTES = 4096
+
+
+class Histogram:
+    """
+    Prometheus histogram with labels, rendered in the text exposition format.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=SECONDS_BUCKETS):
+        """
+        Args:
+        - name (str): Metric name.
+        - help_text (str): Description shown in the HELP line.
+        - label_names (tuple): Names of the labels, in order.
+        - buckets (tuple, optional): Upper bounds of the buckets, ascending.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """
+        Args:
+        - value (float): Observed value.
+        - labels (str): Label values, in the order of label_names.
+        """
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        """
+        Returns:
+        - str: HELP, TYPE and sample lines of the histogram.
+        """
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+                prefix = label_text + ',' if label_text else ''
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{label_text}}} {series["count"]}')
+        return '\n'.join(lines)
+
+
+STAGE_SECONDS = Histogram('pdfqa_stage_seconds', 'Wall time of a pipeline stage.', ('stage',))
+OPENAI_SECONDS = Histogram('pdfqa_openai_request_seconds', 'Wall time of an OpenAI API call, until its body is read.',
+                           ('endpoint', 'model', 'status'))
+OPENAI_TOKENS = Histogram('pdfqa_openai_tokens', 'Tokens billed for an OpenAI API call.',
+                          ('endpoint', 'model', 'kind'), SIZE_BUCKETS)
+OPENAI_BYTES = Histogram('pdfqa_openai_bytes', 'Bytes sent to or received from the OpenAI API in a call.',
+                         ('endpoint', 'direction'), SIZE_BUCKETS)
+METRICS = [STAGE_SECONDS, OPENAI_SECONDS, OPENAI_TOKENS, OPENAI_BYTES]
+
+
+def render_metrics():
+    """
+    Returns:
+    - str: Every metric in the Prometheus text exposition format.
+    """
+    return '\n'.join(metric.render() for metric in METRICS) + '\n'
+
+
+def start_request(rid=None):
+    """
+    Bind a request ID to the current context and start collecting its spans.
+
+    Args:
+    - rid (str, optional): ID to use, such as one sent by the client. Defaults to a new ID.
+
+    Returns:
+    - str: The request ID.
+    """
+    rid = rid or uuid.uuid4().hex[:16]
+    request_id.set(rid)
+    _spans.set([])
+    return rid
+
+
+def stage_breakdown():
+    """
+    Returns:
+    - list: {'stage', 'seconds'} of every span finished under the current request, in
+      order. This is the live list: spans finished later are appended to it.
+    """
+    spans = _spans.get()
+    return spans if spans is not None else []
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Context manager timing a pipeline stage.
+
+    The duration is added to the stage histogram and to the current request's
+    breakdown, and logged with the request ID and any extra fields.
+
+    Args:
+    - stage (str): Name of the stage.
+    - fields: Extra values to log, such as item counts.
+    """
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield fields
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append({'stage': stage, 'seconds': round(seconds, 4)})
+        logger.info('span', extra={'fields': {'stage': stage, 'seconds': round(seconds, 4), 'status': status, **fields}})
+
+
+def run_in_context(fn, *args, **kwargs):
+    """
+    Bind fn to a copy of the caller's context, so spans and log lines of a worker thread
+    keep the request ID. Take one copy per task: a context cannot run in two threads.
+
+    Args:
+    - fn (callable): Function to run.
+
+    Returns:
+    - callable: No-argument function running fn(*args, **kwargs).
+    """
+    context = contextvars.copy_context()
+    return lambda: context.run(fn, *args, **kwargs)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line, with the current request ID and
+    any fields passed as extra={'fields': {...}}.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': request_id.get(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class MeteredStream(httpx.SyncByteStream):
+    """
+    Response body wrapper that counts bytes and records the call's metrics once the body
+    has been read and closed.
+    """
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self.num_bytes = 0
+        self.tail = b''
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self.num_bytes += len(chunk)
+            self.tail = (self.tail + chunk)[-USAGE_TAIL_BYTES:]
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._on_close(self)
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    """
+    HTTP transport that records latency, bytes and token usage of every OpenAI call.
+
+    Token counts are read from the 'usage' object near the end of the response body,
+    which covers JSON responses and streamed responses sent with include_usage.
+    """
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        endpoint = request.url.path.rsplit('/v1/', 1)[-1]
+        try:
+            request_bytes = request.content
+        except httpx.RequestNotRead:
+            request_bytes = b''
+        match = MODEL_PATTERN.search(request_bytes[:512]) or MODEL_PATTERN.search(request_bytes[-512:])
+        model = match.group(1).decode('utf-8', 'replace') if match else ''
+        response = super().handle_request(request)
+
+        def record(stream):
+            seconds = time.perf_counter() - started
+            usage = {key.decode(): int(value) for key, value in USAGE_PATTERN.findall(stream.tail)}
+            OPENAI_SECONDS.observe(seconds, endpoint, model, str(response.status_code))
+            OPENAI_BYTES.observe(len(request_bytes), endpoint, 'sent')
+            OPENAI_BYTES.observe(stream.num_bytes, endpoint, 'received')
+            for kind, tokens in usage.items():
+                OPENAI_TOKENS.observe(tokens, endpoint, model, kind.split('_')[0])
+            logger.info('openai_call', extra={'fields': {
+                'endpoint': endpoint,
+                'model': model,
+                'status': response.status_code,
+                'seconds': round(seconds, 4),
+                'bytes_sent': len(request_bytes),
+                'bytes_received': stream.num_bytes,
+                **usage,
+            }})
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=MeteredStream(response.stream, record),
+            extensions=response.extensions,
+        )
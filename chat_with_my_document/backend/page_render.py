@@ -0,0 +1,156 @@
+import os
+import io
+import logging
+import threading
+from collections import OrderedDict
+import pymupdf
+
+logger = logging.getLogger(__name__)
+
+RENDER_DPI = int(os.environ.get('RENDER_DPI', 150))
+# One of 'jpeg', 'webp' or 'png'; webp needs Pillow.
+RENDER_FORMAT = os.environ.get('RENDER_FORMAT', 'jpeg').lower()
+RENDER_QUALITY = int(os.environ.get('RENDER_QUALITY', 85))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+# Margin in points added around a clip region so cropped text is not cut at the edges.
+CLIP_MARGIN = 6
+
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp', 'png': 'png'}
+
+
+def render_page(document_path, page_num, dpi=RENDER_DPI, image_format=RENDER_FORMAT, quality=RENDER_QUALITY, clip=None):
+    """
+    Render a single PDF page, or a region of it, to an image.
+
+    Args:
+    - document_path (str): Path to the PDF document.
+    - page_num (int): Zero-based page number.
+    - dpi (int, optional): Render resolution.
+    - image_format (str, optional): 'jpeg', 'webp' or 'png'.
+    - quality (int, optional): Quality setting for lossy formats (1-100).
+    - clip (tuple, optional): Region (x0, y0, x1, y1) in page coordinates to render.
+      Defaults to the whole page.
+
+    Returns:
+    - bytes: Encoded image.
+    """
+    if image_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f'Unsupported render format: {image_format}')
+    with pymupdf.open(document_path) as pdf_document:
+        page = pdf_document.load_page(page_num)
+        if clip is not None:
+            clip = (pymupdf.Rect(clip) + (-CLIP_MARGIN, -CLIP_MARGIN, CLIP_MARGIN, CLIP_MARGIN)) & page.rect
+        pix = page.get_pixmap(dpi=dpi, clip=clip)
+    if image_format == 'jpeg':
+        return pix.tobytes('jpeg', jpg_quality=quality)
+    if image_format == 'png':
+        return pix.tobytes('png')
+    # PyMuPDF cannot write WebP itself
+    from PIL import Image
+    mode = 'RGBA' if pix.alpha else 'RGB'
+    buffer = io.BytesIO()
+    Image.frombytes(mode, (pix.width, pix.height), pix.samples).save(buffer, 'WEBP', quality=quality)
+    return buffer.getvalue()
+
+
+class RenderCache:
+    """
+    Disk cache of rendered PDF pages and page regions, keyed by document, page, region
+    and render settings.
+
+    Pages are rendered on first request only; files are evicted in least-recently-used
+    order once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes=RENDER_CACHE_MAX_BYTES, dpi=RENDER_DPI,
+                 image_format=RENDER_FORMAT, quality=RENDER_QUALITY):
+        """
+        Args:
+        - root (str): Directory where rendered pages are stored.
+        - max_bytes (int, optional): Maximum total size of the cache on disk.
+        - dpi (int, optional): Render resolution.
+        - image_format (str, optional): 'jpeg', 'webp' or 'png'.
+        - quality (int, optional): Quality setting for lossy formats.
+        """
+        if image_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f'Unsupported render format: {image_format}')
+        self.root = root
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self.image_format = image_format
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        # Rebuild the LRU order from the files left by previous runs
+        files = [entry for entry in os.scandir(root) if entry.is_file()]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self._sizes[entry.name] = entry.stat().st_size
+
+    def _file_name(self, doc_key, page_num, clip):
+        extension = FORMAT_EXTENSIONS[self.image_format]
+        region = '' if clip is None else '-c' + '_'.join(str(round(value)) for value in clip)
+        return f'{doc_key}-p{page_num}{region}-{self.dpi}dpi-q{self.quality}.{extension}'
+
+    def get_page_image(self, document_path, doc_key, page_num, clip=None):
+        """
+        Return the path of a rendered page, rendering it if it is not cached yet.
+
+        Args:
+        - document_path (str): Path to the PDF document.
+        - doc_key (str): Content hash of the document.
+        - page_num (int): Zero-based page number.
+        - clip (tuple, optional): Region (x0, y0, x1, y1) of the page to render.
+
+        Returns:
+        - str: Path to the rendered image.
+        """
+        name = self._file_name(doc_key, page_num, clip)
+        path = os.path.join(self.root, name)
+        with self._lock:
+            if name in self._sizes and os.path.exists(path):
+                self._sizes.move_to_end(name)
+                os.utime(path)
+                return path
+
+        image_bytes = render_page(document_path, page_num, self.dpi, self.image_format, self.quality, clip)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as image_file:
+            image_file.write(image_bytes)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._sizes[name] = len(image_bytes)
+            self._sizes.move_to_end(name)
+            self._evict(keep=name)
+        return path
+
+    def _evict(self, keep):
+        total = sum(self._sizes.values())
+        for name in list(self._sizes):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self._sizes.pop(name)
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass
+            logger.debug("Evicted rendered page %s", name)
+
+    def drop(self, doc_key):
+        """
+        Remove every cached render of a document.
+
+        Args:
+        - doc_key (str): Content hash of the document.
+        """
+        with self._lock:
+            for name in [name for name in self._sizes if name.startswith(f'{doc_key}-')]:
+                del self._sizes[name]
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass
@@ -0,0 +1,102 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def normalize_query(query):
+    """
+    Normalize a question so trivially different phrasings share a cache entry.
+
+    Args:
+    - query (str): Question text.
+
+    Returns:
+    - str: Lower-cased query with collapsed whitespace and no trailing punctuation.
+    """
+    return re.sub(r'\s+', ' ', query).strip().rstrip('?!. ').lower()
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with a time-to-live and least-recently-used eviction.
+
+    Keeps hit and miss counters for monitoring.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """
+        Args:
+        - maxsize (int): Maximum number of entries.
+        - ttl (float): Seconds an entry stays valid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Args:
+        - key (hashable): Cache key.
+        - default (optional): Value returned on a miss.
+
+        Returns:
+        - The cached value, or default if it is missing or expired.
+        """
+        with self._lock:
+            value, expires = self._entries.get(key, (_MISSING, 0))
+            if value is _MISSING or expires < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Args:
+        - key (hashable): Cache key.
+        - value: Value to cache.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """
+        Drop every entry whose key matches a predicate.
+
+        Args:
+        - predicate (callable): Called with each key; entries for which it returns True
+          are removed.
+
+        Returns:
+        - int: Number of entries removed.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: Number of entries, hits, misses and hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import numpy as np
+
+# Name of the vectors file of collections written before files were versioned
+VECTORS_FILE = 'vectors.f32'
+ROWS_FILE = 'rows.json'
+# Writes truncate and remove vectors files while readers may still map them, which only
+# POSIX allows; elsewhere (Windows) the vectors are read into memory instead
+MEMORY_MAP = os.name == 'posix'
+
+
+def _write_json(path, payload):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+class _Snapshot:
+    """
+    Immutable view of a collection: row data plus the memory-mapped vectors and their
+    squared norms. Queries read a snapshot without locking; writes swap in a new one.
+    """
+
+    def __init__(self, ids, documents, metadatas, vectors, vectors_file):
+        self.vectors_file = vectors_file
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.vectors = vectors
+        self.norms = np.einsum('ij,ij->i', vectors, vectors) if len(ids) else np.empty(0, dtype=np.float32)
+        self.positions = {row_id: i for i, row_id in enumerate(ids)}
+
+
+class VectorCollection:
+    """
+    Collection of a NumpyVectorStore, answering the subset of the ChromaDB collection
+    API the backend uses.
+
+    Embeddings are stored as a raw float32 matrix and memory-mapped (see MEMORY_MAP);
+    IDs, documents, metadata and the name of the matrix file are stored as JSON next to
+    it. Replacing that JSON file is the commit point of every write: rows appended to the
+    matrix by an interrupted write are ignored, and a rewrite goes to a new matrix file
+    that only becomes current once the JSON names it. Distances are squared L2, like
+    ChromaDB's default.
+    """
+
+    def __init__(self, root, name):
+        """
+        Args:
+        - root (str): Directory of the collection.
+        - name (str): Name of the collection.
+        """
+        self.name = name
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._snapshot = self._load()
+        # Matrix files of rewrites interrupted before their commit
+        for name in os.listdir(root):
+            if name != self._snapshot.vectors_file and (name.startswith('vectors') or name.endswith('.tmp')):
+                os.remove(os.path.join(root, name))
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.root, ROWS_FILE)) as f:
+                rows = json.load(f)
+        except FileNotFoundError:
+            rows = {'ids': [], 'documents': [], 'metadatas': [], 'dim': 0}
+        count, dim = len(rows['ids']), rows['dim']
+        vectors_file = rows.get('vectors', VECTORS_FILE)
+        vectors_path = os.path.join(self.root, vectors_file)
+        if count and MEMORY_MAP:
+            vectors = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(count, dim))
+        elif count:
+            vectors = np.fromfile(vectors_path, dtype=np.float32, count=count * dim).reshape(count, dim)
+        else:
+            vectors = np.empty((0, dim), dtype=np.float32)
+        return _Snapshot(rows['ids'], rows['documents'], rows['metadatas'], vectors, vectors_file)
+
+    def _commit(self, ids, documents, metadatas, dim, vectors_file):
+        _write_json(os.path.join(self.root, ROWS_FILE),
+                    {'ids': ids, 'documents': documents, 'metadatas': metadatas, 'dim': dim, 'vectors': vectors_file})
+        self._snapshot = self._load()
+
+    def _rewrite(self, ids, documents, metadatas, vectors):
+        previous = self._snapshot.vectors_file
+        vectors_file = f'vectors-{uuid.uuid4().hex}.f32'
+        np.ascontiguousarray(vectors, dtype=np.float32).tofile(os.path.join(self.root, vectors_file))
+        self._commit(ids, documents, metadatas, vectors.shape[1] if len(ids) else 0, vectors_file)
+        # Queries still reading the previous snapshot keep their mapping of the removed file
+        try:
+            os.remove(os.path.join(self.root, previous))
+        except OSError:
+            pass
+
+    def count(self):
+        return len(self._snapshot.ids)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        """
+        Add rows, replacing those whose ID already exists.
+
+        Args:
+        - ids (list): Row IDs.
+        - embeddings (list): Embedding of each row.
+        - documents (list, optional): Text of each row.
+        - metadatas (list, optional): Metadata of each row.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            current = self._snapshot
+            if current.ids and embeddings.shape[1] != current.vectors.shape[1]:
+                raise ValueError(f'Embedding dimension {embeddings.shape[1]} does not match '
+                                 f'the collection dimension {current.vectors.shape[1]}')
+            if any(row_id in current.positions for row_id in ids) or len(set(ids)) != len(ids):
+                # Updates rewrite the whole matrix
+                merged = dict(zip(current.ids, zip(current.documents, current.metadatas, current.vectors)))
+                merged.update(zip(ids, zip(documents, metadatas, embeddings)))
+                rows = list(merged.items())
+                self._rewrite([row_id for row_id, _ in rows], [row[0] for _, row in rows],
+                              [row[1] for _, row in rows], np.array([row[2] for _, row in rows], dtype=np.float32))
+                return
+            # New rows are appended to the matrix and committed by the rows file
+            with open(os.path.join(self.root, current.vectors_file), 'r+b' if current.ids else 'wb') as f:
+                f.seek(len(current.ids) * embeddings.shape[1] * 4)
+                f.truncate()
+                f.write(np.ascontiguousarray(embeddings).tobytes())
+            self._commit(current.ids + list(ids), current.documents + documents,
+                         current.metadatas + metadatas, embeddings.shape[1], current.vectors_file)
+
+    def delete(self, ids):
+        """
+        Args:
+        - ids (list): IDs of the rows to delete; unknown IDs are ignored.
+        """
+        with self._lock:
+            current = self._snapshot
+            doomed = set(ids)
+            keep = [i for i, row_id in enumerate(current.ids) if row_id not in doomed]
+            if len(keep) == len(current.ids):
+                return
+            self._rewrite([current.ids[i] for i in keep], [current.documents[i] for i in keep],
+                          [current.metadatas[i] for i in keep], current.vectors[keep])
+
+    def _rows(self, snapshot, positions, include):
+        result = {'ids': [snapshot.ids[i] for i in positions]}
+        if 'documents' in include:
+            result['documents'] = [snapshot.documents[i] for i in positions]
+        if 'metadatas' in include:
+            result['metadatas'] = [snapshot.metadatas[i] for i in positions]
+        if 'embeddings' in include:
+            result['embeddings'] = np.array(snapshot.vectors[positions])
+        return result
+
+    def get(self, ids=None, limit=None, offset=0, include=('documents', 'metadatas')):
+        """
+        Args:
+        - ids (list, optional): IDs of the rows to return. Defaults to all rows.
+        - limit (int, optional): Maximum number of rows to return.
+        - offset (int, optional): Number of rows to skip.
+        - include (list, optional): Any of 'documents', 'metadatas' and 'embeddings'.
+
+        Returns:
+        - dict: 'ids' and the included fields, one entry per row.
+        """
+        snapshot = self._snapshot
+        if ids is None:
+            positions = list(range(len(snapshot.ids)))
+        else:
+            positions = [snapshot.positions[row_id] for row_id in ids if row_id in snapshot.positions]
+        end = None if limit is None else offset + limit
+        return self._rows(snapshot, positions[offset:end], include)
+
+    def peek(self, limit=10):
+        return self.get(limit=limit, include=['documents', 'metadatas', 'embeddings'])
+
+    def query(self, query_embeddings, n_results=10, include=('documents', 'metadatas', 'distances')):
+        """
+        Find the nearest rows of one or several query embeddings with a single matrix product.
+
+        Args:
+        - query_embeddings (list): One embedding, or a list of embeddings.
+        - n_results (int, optional): Number of rows to return per query.
+        - include (list, optional): Any of 'documents', 'metadatas', 'distances' and 'embeddings'.
+
+        Returns:
+        - dict: 'ids' and the included fields, one list per query, nearest first.
+        """
+        snapshot = self._snapshot
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[np.newaxis]
+        result = {'ids': []}
+        for field in include:
+            result[field] = []
+        k = min(n_results, len(snapshot.ids))
+        if k == 0:
+            for field in result:
+                result[field] = [[] for _ in queries]
+            return result
+        if queries.shape[1] != snapshot.vectors.shape[1]:
+            raise ValueError(f'Query dimension {queries.shape[1]} does not match '
+                             f'the collection dimension {snapshot.vectors.shape[1]}')
+        # Squared L2 distance; the query's own norm does not change the ranking, so it is
+        # only added back to the returned distances
+        partial = snapshot.norms[np.newaxis] - 2 * (queries @ snapshot.vectors.T)
+        nearest = np.argpartition(partial, k - 1, axis=1)[:, :k]
+        for row, candidates in zip(partial, nearest):
+            positions = candidates[np.argsort(row[candidates], kind='stable')].tolist()
+            rows = self._rows(snapshot, positions, include)
+            for field, values in rows.items():
+                result[field].append(values)
+        if 'distances' in include:
+            query_norms = np.einsum('ij,ij->i', queries, queries)
+            result['distances'] = [
+                [max(0.0, float(partial[q, snapshot.positions[row_id]] + query_norms[q])) for row_id in row_ids]
+                for q, row_ids in enumerate(result['ids'])
+            ]
+        return result
+
+
+class NumpyVectorStore:
+    """
+    Vector store keeping each collection as a memory-mapped float32 matrix, a lighter
+    stand-in for the ChromaDB client for collections of a few thousand rows, where an
+    exact search is a single matrix-vector product.
+
+    Collection handles are cached for the lifetime of the process, like CachedChromaClient.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+        - path (str): Directory of the store; each collection is a subdirectory.
+        """
+        self.path = path
+        self._collections = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def heartbeat(self):
+        """
+        Returns:
+        - int: Current time in nanoseconds, after checking the store directory is writable.
+        """
+        if not os.access(self.path, os.W_OK):
+            raise OSError(f'{self.path} is not writable')
+        return time.time_ns()
+
+    def list_collections(self):
+        """
+        Returns:
+        - list: Names of the collections.
+        """
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
+
+    def get_or_create_collection(self, name, **kwargs):
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = VectorCollection(os.path.join(self.path, name), name)
+                    self._collections[name] = collection
+        return collection
+
+    def delete_collection(self, name):
+        with self._lock:
+            self._collections.pop(name, None)
+            root = os.path.join(self.path, name)
+            if not os.path.isdir(root):
+                raise ValueError(f'Collection {name} does not exist')
+            shutil.rmtree(root)
+
+    def warm(self):
+        """
+        Open and memory-map every existing collection.
+
+        Returns:
+        - int: Number of collections warmed.
+        """
+        names = self.list_collections()
+        for name in names:
+            self.get_or_create_collection(name)
+        return len(names)
+
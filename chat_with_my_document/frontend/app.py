@@ -1,3 +1,5 @@
+import time
+import uuid
 import logging
 import requests
 import streamlit as st
@@ -6,6 +8,9 @@ import streamlit as st
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
+# Seconds between upload job status checks
+POLL_INTERVAL = 1.0
+
 # Set page title
 st.title("💬 PDF QA")
 
@@ -16,6 +21,12 @@ if 'file_uploaded' not in st.session_state:
 if 'summary' not in st.session_state:
     st.session_state['summary'] = ''
 
+if 'doc_id' not in st.session_state:
+    st.session_state['doc_id'] = None
+
+if 'timings' not in st.session_state:
+    st.session_state['timings'] = {}
+
 # Create a file uploader in the sidebar
 st.sidebar.title("Upload a PDF file")
 uploaded_file = st.sidebar.file_uploader(
@@ -23,21 +34,59 @@ uploaded_file = st.sidebar.file_uploader(
 )
 
 if uploaded_file is not None and not st.session_state['file_uploaded']:
-    # Send the file to the API's '/upload' endpoint
-    with st.spinner('Processing the uploaded PDF file...'):
-        files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-        try:
-            response = requests.post('http://localhost:5000/upload', files=files)
-            if response.status_code == 200:
+    # Send the file to the API's '/upload' endpoint, then poll the job until it finishes
+    files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+    try:
+        response = requests.post('http://localhost:5000/upload', files=files)
+        if response.status_code == 202:
+            status_url = 'http://localhost:5000' + response.json()['status_url']
+            progress_bar = st.progress(0.0, text='Processing the uploaded PDF file...')
+            while True:
+                job = requests.get(status_url).json()
+                stages = job['stages']
+                done = sum(stage['progress'] if stage['status'] == 'running' else stage['status'] in ('done', 'skipped')
+                           for stage in stages.values())
+                running = [name for name, stage in stages.items() if stage['status'] == 'running']
+                progress_bar.progress(done / len(stages), text=f"Processing: {', '.join(running) or job['status']}")
+                if job['status'] in ('done', 'failed'):
+                    break
+                time.sleep(POLL_INTERVAL)
+            progress_bar.empty()
+            if job['status'] == 'done':
                 st.session_state['file_uploaded'] = True
-                st.session_state['summary'] = response.text
+                st.session_state['doc_id'] = job['result']['doc_id']
+                # The summary is generated in the background when it is not cached yet
+                st.session_state['summary'] = job['result']['summary'] or ''
+                st.session_state['timings']['upload'] = {
+                    'stages': {name: stage['seconds'] for name, stage in job['stages'].items()},
+                    'spans': job['result'].get('timings', []),
+                }
                 st.success('File uploaded and processed successfully.')
-                st.write('Summary of the document:')
-                st.write(st.session_state['summary'])
             else:
-                st.error(f'Failed to upload and process the file. Error {response.status_code}: {response.text}')
-        except Exception as e:
-            st.error(f'Failed to connect to the backend: {e}')
+                st.error(f"Failed to process the file: {job['error']}")
+        else:
+            st.error(f'Failed to upload and process the file. Error {response.status_code}: {response.text}')
+    except Exception as e:
+        st.error(f'Failed to connect to the backend: {e}')
+
+# Fetch the summary once the backend has it; questions can be asked in the meantime
+if st.session_state['file_uploaded'] and not st.session_state['summary']:
+    try:
+        response = requests.get(f"http://localhost:5000/documents/{st.session_state['doc_id']}/summary")
+        if response.status_code == 200:
+            st.session_state['summary'] = response.json()['summary']
+        elif response.status_code == 202 and response.json()['status'] == 'failed':
+            st.sidebar.warning(f"The summary could not be generated: {response.json()['error']}")
+    except Exception as e:
+        logger.warning(f"Failed to fetch the summary: {e}")
+
+if st.session_state['file_uploaded']:
+    with st.sidebar.expander('Summary of the document', expanded=True):
+        if st.session_state['summary']:
+            st.write(st.session_state['summary'])
+        else:
+            st.write('The summary is being generated; it will appear here when it is ready.')
+            st.button('Refresh')
 
 # Create a chat interface
 message = st.chat_message("assistant")
@@ -52,20 +101,38 @@ if prompt:
         logger.info(f"User message received: {prompt}")
         message.write(prompt)
         message = st.chat_message("assistant")
-        message.write("Thinking...")
+        placeholder = message.empty()
+        placeholder.write("Thinking...")
 
-        # Send the query to the API's '/query' endpoint
+        # Send the query to the API's '/query' endpoint and stream the answer
         logger.info("Sending query to backend")
-        json_payload = {'query': prompt}
+        json_payload = {'query': prompt, 'doc_id': st.session_state['doc_id'], 'stream': True}
+        request_id = uuid.uuid4().hex[:16]
         try:
-            response = requests.post('http://localhost:5000/query', json=json_payload)
+            response = requests.post('http://localhost:5000/query', json=json_payload, stream=True,
+                                     headers={'X-Request-ID': request_id})
             if response.status_code == 200:
-                answer = response.text
-                logger.info("Showing response from backend")
-                message.write(answer)
+                logger.info("Streaming response from backend")
+                answer = ''
+                for fragment in response.iter_content(chunk_size=None, decode_unicode=True):
+                    answer += fragment
+                    placeholder.write(answer)
+                timings = requests.get(f'http://localhost:5000/timings/{request_id}')
+                if timings.status_code == 200:
+                    st.session_state['timings']['query'] = timings.json()
             else:
                 st.error(f'Failed to get response from the backend. Error {response.status_code}: {response.text}')
         except Exception as e:
             st.error(f'Failed to connect to the backend: {e}')
     else:
         st.error('Please upload a PDF file first.')
+
+# Stage breakdown reported by the backend for the last upload and query
+if st.session_state['timings']:
+    with st.sidebar.expander('Debug: backend stage timings'):
+        if 'upload' in st.session_state['timings']:
+            st.write('Upload')
+            st.json(st.session_state['timings']['upload'])
+        if 'query' in st.session_state['timings']:
+            st.write('Last query')
+            st.json(st.session_state['timings']['query'])
@@ -0,0 +1,380 @@
+import os
+import re
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+import openai
+
+# The OpenAI SDK is built on httpx2 (on httpx before it), and transports have to come
+# from the same library as the client
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Account limits to stay within until rate-limit headers report the real ones; 0 disables a budget
+OPENAI_RPM = int(os.environ.get('OPENAI_RPM', 3000))
+OPENAI_TPM = int(os.environ.get('OPENAI_TPM', 1000000))
+# Upper bound of the requests in flight; the actual limit adapts between 1 and this
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', 16))
+OPENAI_RETRIES = int(os.environ.get('OPENAI_RETRIES', 5))
+# Retry delays are drawn uniformly up to base * 2^attempt, capped at the maximum
+OPENAI_RETRY_BASE = float(os.environ.get('OPENAI_RETRY_BASE', 0.5))
+OPENAI_RETRY_MAX = float(os.environ.get('OPENAI_RETRY_MAX', 30.0))
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+# Share of a rate limit left below which concurrency shrinks, and above which it may grow
+LOW_HEADROOM = 0.1
+HIGH_HEADROOM = 0.5
+# Images are billed by size in tiles, not by their encoded bytes; budget a fixed amount each
+IMAGE_TOKENS = 1000
+
+DATA_URL_PATTERN = re.compile(rb'data:image/[\w.+-]+;base64,[A-Za-z0-9+/=]+')
+MAX_TOKENS_PATTERN = re.compile(rb'"max_(?:completion_)?tokens"\s*:\s*(\d+)')
+
+# Priority of the OpenAI requests made from the current context
+priority = contextvars.ContextVar('openai_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def request_priority(level):
+    """
+    Context manager running the OpenAI requests made inside it at a priority. Worker
+    threads inherit it when they run in a copy of the context.
+
+    Args:
+    - level (int): PRIORITY_INTERACTIVE or PRIORITY_BULK.
+    """
+    token = priority.set(level)
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+def estimate_request_tokens(content):
+    """
+    Args:
+    - content (bytes): JSON body of an OpenAI request.
+
+    Returns:
+    - int: Estimated tokens the request counts against the tokens-per-minute limit,
+      including its completion budget.
+    """
+    images = len(DATA_URL_PATTERN.findall(content))
+    text_bytes = len(content) - sum(len(url) for url in DATA_URL_PATTERN.findall(content))
+    match = MAX_TOKENS_PATTERN.search(content)
+    return text_bytes // 4 + 1 + images * IMAGE_TOKENS + (int(match.group(1)) if match else 0)
+
+
+def retry_after(headers):
+    """
+    Args:
+    - headers (Headers or None): Headers of a rejected response.
+
+    Returns:
+    - float or None: Seconds the server asked to wait, if it did.
+    """
+    if headers is None:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+
+def _header_number(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Budget refilled continuously at a rate per minute, holding at most one minute's worth.
+    Not thread-safe; the scheduler guards it.
+    """
+
+    def __init__(self, rate_per_minute):
+        """
+        Args:
+        - rate_per_minute (float): Refill rate and capacity; 0 disables the budget.
+        """
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """
+        Args:
+        - amount (float): Units wanted; amounts above the capacity count as the capacity.
+        - now (float): Current time.monotonic().
+
+        Returns:
+        - float: Seconds until the amount is available.
+        """
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) * 60 / self.capacity)
+
+    def take(self, amount, now):
+        if self.capacity <= 0:
+            return
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit, remaining, now):
+        """
+        Align the bucket with the limit and remaining budget reported by the server.
+
+        Args:
+        - limit (float or None): Limit per minute reported by the server.
+        - remaining (float or None): Budget the server reports as left.
+        - now (float): Current time.monotonic().
+        """
+        if limit:
+            self._refill(now)
+            if self.capacity <= 0:
+                # A budget disabled by configuration starts full once the server reports it
+                self.level = limit
+            self.capacity = limit
+        if remaining is not None and self.capacity > 0:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+
+
+class OpenAIScheduler:
+    """
+    Admission control shared by every OpenAI request of the process.
+
+    A request waits until it is the highest-priority (then oldest) waiting request, a
+    concurrency slot is free, and the requests- and tokens-per-minute buckets hold its
+    cost. The buckets follow the x-ratelimit headers of every response. Concurrency is
+    adapted additive-increase / multiplicative-decrease: it halves on a 429, shrinks when
+    the headers report little headroom left and grows slowly while there is plenty.
+    A slot is held until the response headers arrive, so a streamed answer frees it
+    when it starts.
+    """
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 retries=OPENAI_RETRIES, retry_base=OPENAI_RETRY_BASE, retry_max=OPENAI_RETRY_MAX):
+        """
+        Args:
+        - rpm (int, optional): Requests per minute to stay within; 0 disables the budget.
+        - tpm (int, optional): Tokens per minute to stay within; 0 disables the budget.
+        - max_concurrency (int, optional): Upper bound of the requests in flight.
+        - retries (int, optional): Retries of a failed request after the first attempt.
+        - retry_base (float, optional): Base of the exponential retry delay, in seconds.
+        - retry_max (float, optional): Cap of the retry delay, in seconds.
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(self.max_concurrency)
+        self.retries = retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.counters = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'wait_seconds': 0.0}
+        self._in_flight = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens, level=None):
+        """
+        Wait until a request may be sent, and reserve its budget.
+
+        Args:
+        - tokens (int): Estimated tokens of the request.
+        - level (int, optional): Priority. Defaults to the priority of the current context.
+
+        Returns:
+        - float: Seconds waited.
+        """
+        ticket = (priority.get() if level is None else level, next(self._sequence))
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._waiting[0] == ticket and self._in_flight < int(self.concurrency):
+                        wait = max(self._paused_until - now, self.requests.wait_time(1, now),
+                                   self.tokens.wait_time(tokens, now))
+                        if wait <= 0:
+                            break
+                    self._cond.wait(wait)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            self._in_flight += 1
+            self.counters['requests'] += 1
+            self.counters['wait_seconds'] += now - started
+            # The next waiting request may be admissible as well
+            self._cond.notify_all()
+        return now - started
+
+    def release(self, headers=None, status=None):
+        """
+        Free the slot of a request and adapt to its response.
+
+        Args:
+        - headers (Headers, optional): Response headers; None if the request failed
+          without a response.
+        - status (int, optional): Response status code.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if headers is not None:
+                self._adapt(headers, status)
+            self._cond.notify_all()
+
+    def _adapt(self, headers, status):
+        now = time.monotonic()
+        headroom = []
+        for bucket, kind in ((self.requests, 'requests'), (self.tokens, 'tokens')):
+            limit = _header_number(headers, f'x-ratelimit-limit-{kind}')
+            remaining = _header_number(headers, f'x-ratelimit-remaining-{kind}')
+            bucket.sync(limit, remaining, now)
+            if limit and remaining is not None:
+                headroom.append(remaining / limit)
+        previous = int(self.concurrency)
+        if status == 429:
+            self.counters['rate_limited'] += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+            # Everyone waits out the server's requested delay, not just the rejected request
+            self._paused_until = max(self._paused_until, now + (retry_after(headers) or 0))
+        elif headroom and min(headroom) < LOW_HEADROOM:
+            self.concurrency = max(1.0, self.concurrency * 0.75)
+        elif not headroom or min(headroom) > HIGH_HEADROOM:
+            self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+        if int(self.concurrency) != previous:
+            logger.info("OpenAI concurrency limit %d -> %d", previous, int(self.concurrency))
+
+    def retry_delay(self, attempt, headers=None):
+        """
+        Args:
+        - attempt (int): Zero-based attempt that failed.
+        - headers (Headers, optional): Headers of the failed response.
+
+        Returns:
+        - float: Seconds to wait before the next attempt: full jitter over the
+          exponential backoff, but at least what the server asked for.
+        """
+        with self._cond:
+            self.counters['retries'] += 1
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        return max(delay, retry_after(headers) or 0.0)
+
+    def stats(self):
+        """
+        Returns:
+        - dict: Current concurrency limit, requests in flight and waiting, per-minute
+          budgets and counters.
+        """
+        with self._cond:
+            return {
+                'concurrency': int(self.concurrency),
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                'rpm': self.requests.capacity,
+                'tpm': self.tokens.capacity,
+                **self.counters,
+            }
+
+
+# The scheduler every OpenAI client of the process shares
+scheduler = OpenAIScheduler()
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """
+    HTTP transport sending every request through an OpenAIScheduler, retrying rate-limited,
+    server and connection errors with jittered exponential backoff.
+    """
+
+    def __init__(self, transport, openai_scheduler=None):
+        """
+        Args:
+        - transport (BaseTransport): Transport the requests are sent with.
+        - openai_scheduler (OpenAIScheduler, optional): Defaults to the process-wide scheduler.
+        """
+        self._transport = transport
+        self.scheduler = openai_scheduler or scheduler
+
+    def handle_request(self, request):
+        try:
+            tokens = estimate_request_tokens(request.content)
+        except httpx.RequestNotRead:
+            tokens = 1
+        level = priority.get()
+        for attempt in range(self.scheduler.retries + 1):
+            self.scheduler.acquire(tokens, level)
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TransportError as e:
+                self.scheduler.release()
+                if attempt == self.scheduler.retries:
+                    raise
+                delay = self.scheduler.retry_delay(attempt)
+                logger.warning("OpenAI request to %s failed (%s), retrying in %.2fs", request.url.path, e, delay)
+                time.sleep(delay)
+                continue
+            self.scheduler.release(response.headers, response.status_code)
+            if response.status_code not in RETRY_STATUSES or attempt == self.scheduler.retries:
+                return response
+            # Read the error body so the connection goes back to the pool
+            response.read()
+            response.close()
+            delay = self.scheduler.retry_delay(attempt, response.headers)
+            logger.warning("OpenAI request to %s returned %d, retrying in %.2fs", request.url.path,
+                           response.status_code, delay)
+            time.sleep(delay)
+
+    def close(self):
+        self._transport.close()
+
+
+def scheduled_http_client(transport=None, openai_scheduler=None):
+    """
+    Build an HTTP client for openai.OpenAI(http_client=...) that goes through the
+    scheduler. Create the OpenAI client with max_retries=0: the scheduler retries.
+
+    Args:
+    - transport (BaseTransport, optional): Transport the requests are sent with.
+      Defaults to a plain HTTP transport.
+    - openai_scheduler (OpenAIScheduler, optional): Defaults to the process-wide scheduler.
+
+    Returns:
+    - DefaultHttpxClient: The HTTP client.
+    """
+    return openai.DefaultHttpxClient(
+        transport=ScheduledTransport(transport or httpx.HTTPTransport(), openai_scheduler)
+    )
@@ -0,0 +1,204 @@
+import os
+import sys
+import hashlib
+import types
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf
+
+# Documents with at least this many pages are split across a process pool.
+PARALLEL_MIN_PAGES = int(os.environ.get('PARALLEL_MIN_PAGES', 64))
+# Number of consecutive pages handled by one pool task.
+PAGES_PER_TASK = int(os.environ.get('PAGES_PER_TASK', 8))
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', os.cpu_count() or 1))
+# Pools never fork: the apps start them from processes that already run threads (Flask
+# jobs, the Streamlit server, batch_extract's LLM workers), and a forked child can
+# inherit a lock held by one of them.
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_worker_document = None
+_main_lock = threading.Lock()
+
+
+class WorkerPool(ProcessPoolExecutor):
+    """
+    Process pool whose workers do not import the application's __main__ module.
+
+    spawn and forkserver children normally import __main__ again, which would run a
+    second Flask app or Streamlit script in every worker. Workers are started while
+    __main__ is replaced by an empty module, so they only import the modules of the
+    functions they run; those functions must not be defined in the script itself.
+    """
+
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        """
+        Args:
+        - max_workers (int, optional): Number of worker processes. Defaults to the CPU count.
+        - initializer (callable, optional): Function run once in every worker.
+        - initargs (tuple, optional): Arguments of the initializer.
+        """
+        context = multiprocessing.get_context(POOL_START_METHOD)
+        if POOL_START_METHOD == 'forkserver':
+            # Workers forked from the server find PyMuPDF already imported
+            context.set_forkserver_preload([__name__])
+        super().__init__(max_workers=max_workers, mp_context=context, initializer=initializer, initargs=initargs)
+
+    def submit(self, fn, /, *args, **kwargs):
+        # Workers are started on demand by submit()
+        with _main_lock:
+            main_module = sys.modules['__main__']
+            sys.modules['__main__'] = types.ModuleType('__main__')
+            try:
+                return super().submit(fn, *args, **kwargs)
+            finally:
+                sys.modules['__main__'] = main_module
+
+
+def document_key(pdf_bytes):
+    """
+    Compute the cache key of a PDF document.
+
+    Args:
+    - pdf_bytes (bytes): Raw bytes of the PDF file.
+
+    Returns:
+    - str: SHA-256 hex digest of the file.
+    """
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def open_document(source):
+    """
+    Open a PDF document from a path or from raw bytes.
+
+    Args:
+    - source (str or bytes): Path to the PDF or its contents.
+
+    Returns:
+    - pymupdf.Document: Opened document.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return pymupdf.open(stream=source, filetype="pdf")
+    return pymupdf.open(source)
+
+
+def page_blocks(page):
+    """
+    Extract the text blocks of a page with their position and font size.
+
+    Args:
+    - page (pymupdf.Page): Page to extract.
+
+    Returns:
+    - list: One dict per text block with 'bbox' (x0, y0, x1, y1), 'text' and the largest
+      font 'size' used in the block, in reading order.
+    """
+    blocks = []
+    for block in page.get_text("dict")["blocks"]:
+        if block.get("type") != 0:
+            continue
+        lines, size = [], 0.0
+        for line in block["lines"]:
+            lines.append("".join(span["text"] for span in line["spans"]))
+            size = max([size] + [span["size"] for span in line["spans"]])
+        text = "\n".join(lines).strip()
+        if text:
+            blocks.append({'bbox': tuple(block["bbox"]), 'text': text, 'size': size})
+    return blocks
+
+
+def extract_page(page, text=True, images=True, image_format="png", dpi=None, blocks=False):
+    """
+    Extract the text, rendered image and text blocks of a single page.
+
+    Args:
+    - page (pymupdf.Page): Page to extract.
+    - text (bool, optional): Extract the page text. Defaults to True.
+    - images (bool, optional): Render the page to an image. Defaults to True.
+    - image_format (str, optional): Output format passed to Pixmap.tobytes. Defaults to "png".
+    - dpi (int, optional): Render resolution. Defaults to PyMuPDF's 72 dpi.
+    - blocks (bool, optional): Extract text blocks with page_blocks(). Defaults to False.
+
+    Returns:
+    - dict: 'page' number, 'rect' (x0, y0, x1, y1) of the page, 'text' (str or None),
+      'image' (bytes or None) and 'blocks' (list or None).
+    """
+    return {
+        'page': page.number,
+        'rect': tuple(page.rect),
+        'text': page.get_text() if text else None,
+        'image': page.get_pixmap(dpi=dpi).tobytes(image_format) if images else None,
+        'blocks': page_blocks(page) if blocks else None,
+    }
+
+
+def _init_worker(source):
+    global _worker_document
+    _worker_document = open_document(source)
+
+
+def _extract_range(page_range, options):
+    start, stop = page_range
+    return [extract_page(_worker_document.load_page(i), **options) for i in range(start, stop)]
+
+
+def iter_pages(source, text=True, images=True, image_format="png", dpi=None, workers=None, blocks=False):
+    """
+    Extract every page of a PDF in a single pass, yielding results page by page.
+
+    Small documents are processed in this process. Documents of PARALLEL_MIN_PAGES pages
+    or more are split into ranges of PAGES_PER_TASK pages spread over a process pool whose
+    workers open the document once each. Pages are always yielded in order, as soon as
+    their range is finished, so consumers can start before the last page is done.
+
+    Args:
+    - source (str or bytes): Path to the PDF or its contents.
+    - text (bool, optional): Extract page text. Defaults to True.
+    - images (bool, optional): Render page images. Defaults to True.
+    - image_format (str, optional): Output format of rendered images. Defaults to "png".
+    - dpi (int, optional): Render resolution. Defaults to PyMuPDF's 72 dpi.
+    - workers (int, optional): Size of the process pool. Defaults to EXTRACTION_WORKERS.
+    - blocks (bool, optional): Extract text blocks. Defaults to False.
+
+    Returns:
+    - generator: One dict per page as returned by extract_page().
+    """
+    options = {'text': text, 'images': images, 'image_format': image_format, 'dpi': dpi, 'blocks': blocks}
+    workers = workers or EXTRACTION_WORKERS
+    pdf_document = open_document(source)
+    try:
+        page_count = len(pdf_document)
+        if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+            for page_num in range(page_count):
+                yield extract_page(pdf_document.load_page(page_num), **options)
+            return
+    finally:
+        pdf_document.close()
+
+    page_ranges = [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    with WorkerPool(min(workers, len(page_ranges)), _init_worker, (source,)) as executor:
+        for pages in executor.map(_extract_range, page_ranges, [options] * len(page_ranges)):
+            yield from pages
+
+
+def extract_pages(source, text=True, images=True, image_format="png", dpi=None, workers=None):
+    """
+    Extract the text and rendered image of every page of a PDF in a single pass.
+
+    Args:
+    - source (str or bytes): Path to the PDF or its contents.
+    - text (bool, optional): Extract page text. Defaults to True.
+    - images (bool, optional): Render page images. Defaults to True.
+    - image_format (str, optional): Output format of rendered images. Defaults to "png".
+    - dpi (int, optional): Render resolution. Defaults to PyMuPDF's 72 dpi.
+    - workers (int, optional): Size of the process pool. Defaults to EXTRACTION_WORKERS.
+
+    Returns:
+    - tuple: (list of page texts, list of page image bytes).
+    """
+    text_list, images_list = [], []
+    for page in iter_pages(source, text, images, image_format, dpi, workers):
+        text_list.append(page['text'])
+        images_list.append(page['image'])
+    return text_list, images_list
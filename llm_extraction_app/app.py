@@ -1,10 +1,22 @@
-import streamlit as st
 import os
+import sys
+
+# Modules shared with the chat backend live in the repository's common/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+
+import streamlit as st
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from io import BytesIO
-from pdf_processing import get_text, get_images, process_pdf_with_gpt, load_openai_client
+from pdf_processing import (get_page_texts, get_page_scores, render_page_image, process_pdf_with_gpt,
+                            retry_failed_pages, load_openai_client, THUMBNAIL_DPI, FULL_RES_DPI)
+from page_filter import candidate_pages, skipped_pages
+from page_extraction import document_key
 load_dotenv()
 
+# Rendered pages kept per session
+PAGE_IMAGE_CACHE_SIZE = int(os.getenv('PAGE_IMAGE_CACHE_SIZE', 6))
+
 # Streamlit configuration
 st.set_page_config(layout="wide")
 
@@ -13,6 +25,43 @@ if 'current_dataset' not in st.session_state:
     st.session_state.current_dataset = 0
 if 'datasets' not in st.session_state:
     st.session_state.datasets = []
+# Content hash of each uploaded file, so reruns do not hash the PDF again
+if 'doc_keys' not in st.session_state:
+    st.session_state.doc_keys = {}
+# Small LRU of rendered pages: (doc_key, page, dpi) -> future of the PNG bytes
+if 'page_images' not in st.session_state:
+    st.session_state.page_images = OrderedDict()
+
+
+# Renders the next dataset's page in the background while the current one is reviewed
+@st.cache_resource
+def get_render_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='render')
+
+
+def page_image(doc_key, pdf_bytes, page_num, dpi):
+    """
+    Get a rendered page from the session's LRU, starting the render on a miss.
+
+    Args:
+    - doc_key (str): Content hash of the PDF.
+    - pdf_bytes (bytes): Contents of the PDF.
+    - page_num (int): Zero-based page number.
+    - dpi (int): Render resolution.
+
+    Returns:
+    - Future: Resolves to the PNG bytes of the page.
+    """
+    cache = st.session_state.page_images
+    key = (doc_key, page_num, dpi)
+    if key in cache and not (cache[key].done() and cache[key].exception()):
+        cache.move_to_end(key)
+        return cache[key]
+    cache[key] = get_render_executor().submit(render_page_image, doc_key, pdf_bytes, page_num, dpi)
+    while len(cache) > PAGE_IMAGE_CACHE_SIZE:
+        cache.popitem(last=False)
+    return cache[key]
+
 
 # Create a file uploader in the sidebar
 st.sidebar.title("Upload a PDF file")
@@ -22,18 +71,37 @@ if uploaded_file:
     # Read the uploaded file once and reuse the content
     file_contents = uploaded_file.read()
 
-    # Cache the processing of images and text
-    images = get_images(BytesIO(file_contents))
-    text_l = get_text(BytesIO(file_contents))
-    
-    # Combine the extracted text from all pages
-    text = '\n'.join([f'page {i}: {txt}' for i, txt in enumerate(text_l)])
+    # Pages and extraction results are cached on disk by the PDF's content hash
+    file_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    if file_id not in st.session_state.doc_keys:
+        st.session_state.doc_keys[file_id] = document_key(file_contents)
+    doc_key = st.session_state.doc_keys[file_id]
+    # Only the text is extracted up front; pages are rendered when they are looked at
+    text_l = get_page_texts(doc_key, file_contents)
     
-    # OpenAI API call
+    # Report which pages the local pre-filter keeps away from the model
+    scores = get_page_scores(doc_key, text_l)
+    candidates = set(candidate_pages(scores))
+    skipped = skipped_pages(text_l, candidates)
+    with st.sidebar.expander(f"Pre-filter: {len(skipped)} of {len(text_l)} pages skipped"
+                             f" ({len(skipped) / max(len(text_l), 1):.0%})"):
+        if skipped:
+            st.caption(f"Not sent to the model: pages {', '.join(str(page) for page in skipped)}")
+        st.dataframe([{'page': i, 'sent': i in candidates, **score} for i, score in enumerate(scores)],
+                     hide_index=True)
+
+    # OpenAI API calls, one per candidate page window
     openai_api_key = os.getenv('OPENAI_API_KEY')
     client_openai = load_openai_client(openai_api_key)
-    datasets = process_pdf_with_gpt(client_openai, text)
-    
+    datasets, failed_pages = process_pdf_with_gpt(client_openai, doc_key, text_l)
+
+    # Pages that failed are retried on their own, without re-running the whole document
+    if failed_pages:
+        st.sidebar.warning(f"Extraction failed for pages {', '.join(str(page) for page in failed_pages)}")
+        if st.sidebar.button("Retry Failed Pages"):
+            retry_failed_pages(client_openai, doc_key, text_l)
+            st.rerun()
+
     # Save datasets to session state
     st.session_state.datasets = datasets
 
@@ -58,10 +126,19 @@ if uploaded_file:
         current_dataset = st.session_state.datasets[st.session_state.current_dataset]
         data = current_dataset['data']
         
-        # Optional: View images only when needed
+        # Preview the current dataset's page, and prefetch the next dataset's page
+        page_num = int(current_dataset['page'])
+        st.sidebar.image(page_image(doc_key, file_contents, page_num, THUMBNAIL_DPI).result(),
+                         caption=f"Page {page_num + 1}", use_column_width=True)
+        if st.session_state.current_dataset < MAX_DATASETS - 1:
+            next_page = int(st.session_state.datasets[st.session_state.current_dataset + 1]['page'])
+            page_image(doc_key, file_contents, next_page, THUMBNAIL_DPI)
+
+        # Full resolution only when needed
         if st.sidebar.button("View Images for Current Dataset"):
-            image = images[st.session_state.current_dataset]
-            st.image(image, caption=f"Image for Dataset {st.session_state.current_dataset + 1}", use_column_width=True)
+            image = page_image(doc_key, file_contents, page_num, FULL_RES_DPI).result()
+            st.image(image, caption=f"Image for Dataset {st.session_state.current_dataset + 1} (page {page_num + 1})",
+                     use_column_width=True)
 
         # Layout for donor group information
         group_index = st.radio("Select Donor Group", range(len(data)), format_func=lambda x: f"Group {x + 1}")
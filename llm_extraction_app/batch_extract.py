@@ -0,0 +1,198 @@
+"""
+Extract donation data from many PDFs without the Streamlit UI.
+
+PDFs are parsed on a process pool and extracted on a separate, concurrency-limited
+thread pool of LLM workers. One JSON line per PDF is appended to the output as soon as
+it is done, so an interrupted run can be restarted with the same command. PDFs that
+failed are processed again, PDFs with failed pages only have those pages retried, and
+the last line of a PDF is its current result.
+
+    python batch_extract.py reports/ --output donations.jsonl
+    python batch_extract.py manifest.txt --output donations.jsonl --llm-concurrency 16
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules shared with the chat backend live in the repository's common/ directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+
+from dotenv import load_dotenv
+import openai
+from page_extraction import WorkerPool
+from batch_worker import parse_pdf
+from pdf_processing import process_pdf_with_gpt, retry_failed_pages
+from openai_scheduler import scheduled_http_client, request_priority, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+
+def list_pdfs(source):
+    """
+    Args:
+    - source (str): Directory searched recursively for PDFs, or manifest file listing one
+      PDF path per line (relative paths are relative to the manifest; blank lines and
+      lines starting with '#' are ignored).
+
+    Returns:
+    - list: Paths of the PDFs, in a stable order.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(dirpath, filename)
+            for dirpath, _, filenames in os.walk(source)
+            for filename in filenames
+            if filename.lower().endswith('.pdf')
+        )
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+def previous_results(output_path):
+    """
+    Args:
+    - output_path (str): JSONL output of previous runs.
+
+    Returns:
+    - dict: Last result line of every PDF, keyed by path.
+    """
+    results = {}
+    try:
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; that PDF is processed again
+                    continue
+                results[result['path']] = result
+    except OSError:
+        pass
+    return results
+
+
+def is_complete(result):
+    """
+    Args:
+    - result (dict): Result line of a PDF.
+
+    Returns:
+    - bool: Whether the PDF was extracted without errors or failed pages.
+    """
+    return 'error' not in result and not result.get('failed_pages')
+
+
+def run_batch(paths, output_path, client_openai, parse_workers, llm_concurrency, page_concurrency, retry=()):
+    """
+    Parse and extract every PDF, appending one JSON line per PDF to the output.
+
+    Args:
+    - paths (list): Paths of the PDFs to process.
+    - output_path (str): JSONL file the results are appended to.
+    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - parse_workers (int): Number of parsing processes.
+    - llm_concurrency (int): Number of PDFs extracted at the same time.
+    - page_concurrency (int): Requests in flight per PDF; at most
+      llm_concurrency * page_concurrency requests run at once.
+    - retry (collection, optional): Paths processed before; their cached extraction is
+      reused and only its failed pages are extracted again.
+
+    Returns:
+    - dict: Number of PDFs that succeeded and failed, and 'incomplete', the paths whose
+      result still has failed pages.
+    """
+    counts = {'done': 0, 'failed': 0, 'incomplete': []}
+    write_lock = threading.Lock()
+    # Bounds the PDFs parsed but not yet extracted, so parsed text does not pile up in memory
+    in_flight = threading.BoundedSemaphore(llm_concurrency * 2)
+
+    def write(result):
+        with write_lock:
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            counts['failed' if 'error' in result else 'done'] += 1
+            if result.get('failed_pages'):
+                counts['incomplete'].append(result['path'])
+            logger.info("%d/%d %s", counts['done'] + counts['failed'], len(paths), result['path'])
+
+    def extract(path, started, parse_future):
+        with request_priority(PRIORITY_BULK):
+            extract_pdf(path, started, parse_future)
+
+    def extract_pdf(path, started, parse_future):
+        try:
+            doc_key, text_list, skipped = parse_future.result()
+            extract_text = retry_failed_pages if path in retry else process_pdf_with_gpt
+            datasets, failed_pages = extract_text(client_openai, doc_key, text_list, max_workers=page_concurrency)
+            write({
+                'path': path,
+                'doc_key': doc_key,
+                'pages': len(text_list),
+                'skipped_pages': skipped,
+                'datasets': datasets,
+                'failed_pages': failed_pages,
+                'seconds': round(time.perf_counter() - started, 3),
+            })
+        except Exception as e:
+            logger.exception("Failed to process %s", path)
+            write({'path': path, 'error': str(e)})
+        finally:
+            in_flight.release()
+
+    with open(output_path, 'a') as output, \
+            WorkerPool(parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix='llm') as llm_pool:
+        for path in paths:
+            in_flight.acquire()
+            started = time.perf_counter()
+            parse_future = parse_pool.submit(parse_pdf, path)
+            parse_future.add_done_callback(
+                lambda future, path=path, started=started: llm_pool.submit(extract, path, started, future)
+            )
+        # Wait for the last PDFs to be extracted
+        for _ in range(llm_concurrency * 2):
+            in_flight.acquire()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract donation data from a directory or manifest of PDFs.')
+    parser.add_argument('source', help='directory of PDFs, or file listing one PDF path per line')
+    parser.add_argument('--output', default='donations.jsonl', help='JSONL file results are appended to')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--llm-concurrency', type=int, default=8, help='PDFs extracted at the same time')
+    parser.add_argument('--page-concurrency', type=int, default=1, help='requests in flight per PDF')
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    paths = list_pdfs(args.source)
+    previous = previous_results(args.output)
+    pending = [path for path in paths if path not in previous or not is_complete(previous[path])]
+    retry = {path for path in pending if path in previous}
+    logger.info("%d PDFs found, %d already done, %d to process, %d of them again", len(paths),
+                len(paths) - len(pending), len(pending), len(retry))
+    if not pending:
+        return 0
+
+    # Requests share the rate-limit scheduler, which also does the retries
+    client_openai = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=scheduled_http_client(),
+                                  max_retries=0)
+    counts = run_batch(pending, args.output, client_openai, args.parse_workers, args.llm_concurrency,
+                       args.page_concurrency, retry)
+    logger.info("Finished: %d done, %d failed", counts['done'], counts['failed'])
+    if counts['incomplete']:
+        # Running the same command again retries these pages
+        logger.warning("%d PDFs have failed pages: %s", len(counts['incomplete']), ', '.join(counts['incomplete']))
+    return 1 if counts['failed'] or counts['incomplete'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
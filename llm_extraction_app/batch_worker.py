@@ -0,0 +1,25 @@
+"""
+Work done in batch_extract.py's parsing processes. It lives outside the script because
+pool workers only import the modules of the functions they run, never the script itself.
+"""
+from page_extraction import extract_pages, document_key
+from page_filter import score_pages, candidate_pages, skipped_pages
+
+
+def parse_pdf(path):
+    """
+    Read a PDF and extract the text of its pages.
+
+    Args:
+    - path (str): Path of the PDF.
+
+    Returns:
+    - tuple: (content hash of the PDF, text of each page, page numbers the pre-filter
+      keeps away from the model).
+    """
+    with open(path, 'rb') as f:
+        pdf_bytes = f.read()
+    # The pool already parallelizes across files, so each file is parsed serially
+    text_list, _ = extract_pages(pdf_bytes, images=False, workers=1)
+    skipped = skipped_pages(text_list, candidate_pages(score_pages(text_list)))
+    return document_key(pdf_bytes), text_list, skipped
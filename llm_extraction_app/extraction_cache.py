@@ -0,0 +1,200 @@
+import os
+import json
+import shutil
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """
+    Persistent, content-addressed cache of the extraction app's work on a PDF.
+
+    Each entry is a directory named after the SHA-256 of the PDF. It holds the page text
+    and the pages rendered so far under 'pages/', and one extraction result per prompt
+    version and model, so changing either never serves stale answers.
+    Entries are evicted in least-recently-used order once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root, max_bytes):
+        """
+        Args:
+        - root (str): Directory where cache entries are stored.
+        - max_bytes (int): Maximum total size of the cache on disk.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        os.makedirs(root, exist_ok=True)
+        # Rebuild the LRU order and entry sizes from previous runs; writes keep them
+        # up to date afterwards, so eviction never walks the cache again
+        entries = [entry for entry in os.scandir(root) if entry.is_dir() and not entry.name.startswith('.')]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self._sizes[entry.name] = _dir_size(entry.path)
+        self._total = sum(self._sizes.values())
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def _extraction_path(self, key, variant):
+        return os.path.join(self._entry_path(key), f'extraction-{variant}.json')
+
+    def _pages_path(self, key):
+        return os.path.join(self._entry_path(key), 'pages')
+
+    def _touch(self, key):
+        # The directory mtime doubles as the last-used timestamp when the cache is reopened.
+        # Under the lock so a concurrent write cannot evict the entry in between.
+        with self._lock:
+            if key not in self._sizes:
+                return
+            self._sizes.move_to_end(key)
+            try:
+                os.utime(self._entry_path(key))
+            except OSError:
+                # Removed outside the cache; the next write recreates it
+                pass
+
+    def _write(self, key, path, data, mode='w'):
+        # Write to a temporary file and rename it so readers never see a partial file
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, mode) as f:
+                f.write(data)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            added = os.path.getsize(tmp_path) - replaced
+            os.replace(tmp_path, path)
+            self._sizes[key] = self._sizes.get(key, 0) + added
+            self._sizes.move_to_end(key)
+            self._total += added
+            self._evict(keep=key)
+
+    def get_text(self, key):
+        """
+        Look up the extracted page text of a document and mark it as recently used.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+
+        Returns:
+        - list or None: Text of each page, or None on a miss.
+        """
+        try:
+            with open(os.path.join(self._pages_path(key), 'text.json')) as f:
+                text_list = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(key)
+        return text_list
+
+    def put_text(self, key, text_list):
+        """
+        Store the extracted page text of a document, then evict old entries if the cache
+        is over its cap.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - text_list (list): Text of each page.
+
+        Returns:
+        - None
+        """
+        self._write(key, os.path.join(self._pages_path(key), 'text.json'), json.dumps(text_list))
+
+    def get_page_image(self, key, page_num, dpi):
+        """
+        Look up a rendered page and mark its document as recently used.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - page_num (int): Zero-based page number.
+        - dpi (int): Resolution the page was rendered at.
+
+        Returns:
+        - bytes or None: PNG of the page, or None on a miss.
+        """
+        try:
+            with open(os.path.join(self._pages_path(key), f'{page_num}-{dpi}dpi.png'), 'rb') as f:
+                image_bytes = f.read()
+        except OSError:
+            return None
+        self._touch(key)
+        return image_bytes
+
+    def put_page_image(self, key, page_num, dpi, image_bytes):
+        """
+        Store a rendered page.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - page_num (int): Zero-based page number.
+        - dpi (int): Resolution the page was rendered at.
+        - image_bytes (bytes): PNG of the page.
+
+        Returns:
+        - None
+        """
+        self._write(key, os.path.join(self._pages_path(key), f'{page_num}-{dpi}dpi.png'), image_bytes, 'wb')
+
+    def get_extraction(self, key, variant):
+        """
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - variant (str): Prompt version and model the extraction was made with.
+
+        Returns:
+        - tuple or None: (datasets, page numbers that failed), or None on a miss.
+        """
+        try:
+            with open(self._extraction_path(key, variant)) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(key)
+        return result['datasets'], result['failed_pages']
+
+    def put_extraction(self, key, variant, datasets, failed_pages):
+        """
+        Store, or replace, the extraction result of a document.
+
+        Args:
+        - key (str): Document key from page_extraction.document_key().
+        - variant (str): Prompt version and model the extraction was made with.
+        - datasets (list): Extracted datasets in the [{data, page}] shape.
+        - failed_pages (list): Page numbers whose extraction failed.
+
+        Returns:
+        - None
+        """
+        result = {'datasets': datasets, 'failed_pages': failed_pages}
+        self._write(key, self._extraction_path(key, variant), json.dumps(result))
+
+    def _evict(self, keep=None):
+        for name in list(self._sizes):
+            if self._total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            size = self._sizes.pop(name)
+            shutil.rmtree(self._entry_path(name), ignore_errors=True)
+            self._total -= size
+            logger.info("Evicted cached document %s (%d bytes)", name, size)
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
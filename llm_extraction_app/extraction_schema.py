@@ -0,0 +1,244 @@
+import re
+import ast
+import json
+
+AMOUNT_PATTERN = re.compile(r'\d[\d,]*(?:\.\d+)?')
+# A Markdown code fence around the whole answer, such as ```json ... ```
+FENCE_PATTERN = re.compile(r'^\s*```[\w-]*[ \t]*\n?(.*?)\n?```\s*$', re.DOTALL)
+
+
+def parse_amount(value):
+    """
+    Args:
+    - value (str, int, float or None): Amount as written by the model, e.g. '$1,000'.
+
+    Returns:
+    - str: Whole amount as digits, or '' when there is none.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(int(value))
+    match = AMOUNT_PATTERN.search(str(value or ''))
+    return str(int(float(match.group(0).replace(',', '')))) if match else ''
+
+
+class DonorGroup:
+    """
+    One donor group of a page: the donors listed under a gift level, the level's amount
+    range and the gift type. This is the structure app.py edits.
+    """
+
+    def __init__(self, donor_names, min_amount='', max_amount='', gift_type=''):
+        """
+        Args:
+        - donor_names (list): Names of the donors in the group.
+        - min_amount (str, optional): Lower bound of the gift level, as digits.
+        - max_amount (str, optional): Upper bound of the gift level, as digits.
+        - gift_type (str, optional): Type of gift, such as 'Annual'.
+        """
+        self.donor_names = donor_names
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.gift_type = gift_type
+
+    @classmethod
+    def from_dict(cls, raw):
+        """
+        Validate and normalize a group produced by the model.
+
+        Args:
+        - raw (dict): Group with 'donor_names_group', 'amount_donated_by_group' and
+          'gift_type'.
+
+        Returns:
+        - DonorGroup: The normalized group.
+
+        Raises:
+        - ValueError: If the group has no donor names.
+        """
+        if not isinstance(raw, dict):
+            raise ValueError('donor group is not an object')
+        names = raw.get('donor_names_group')
+        if isinstance(names, str):
+            names = [names]
+        if not isinstance(names, list):
+            raise ValueError('donor_names_group is not a list')
+        names = [str(name).strip() for name in names if str(name).strip()]
+        if not names:
+            raise ValueError('donor group has no donor names')
+        amounts = raw.get('amount_donated_by_group') or []
+        if not isinstance(amounts, list):
+            amounts = [amounts]
+        amounts = [parse_amount(amount) for amount in amounts[:2]] + [''] * (2 - len(amounts[:2]))
+        return cls(names, amounts[0], amounts[1], str(raw.get('gift_type') or '').strip())
+
+    def to_dict(self):
+        """
+        Returns:
+        - dict: The group in the shape app.py consumes.
+        """
+        return {
+            'donor_names_group': self.donor_names,
+            'amount_donated_by_group': [self.min_amount, self.max_amount],
+            'gift_type': self.gift_type,
+        }
+
+
+def parse_groups(raw_groups):
+    """
+    Args:
+    - raw_groups (list): Groups produced by the model.
+
+    Returns:
+    - list: Valid groups as dicts; invalid groups are left out.
+    """
+    groups = []
+    for raw in raw_groups if isinstance(raw_groups, list) else []:
+        try:
+            groups.append(DonorGroup.from_dict(raw).to_dict())
+        except ValueError:
+            continue
+    return groups
+
+
+def page_of(item, window):
+    """
+    Args:
+    - item (dict): Dataset produced by the model.
+    - window (list): Page numbers sent in the request.
+
+    Returns:
+    - int: Page of the dataset. The model numbers pages inconsistently, so anything
+      outside the window belongs to its first page.
+    """
+    try:
+        page_num = int(item.get('page'))
+    except (TypeError, ValueError):
+        page_num = None
+    return page_num if len(window) > 1 and page_num in window else window[0]
+
+
+def validate_datasets(result, window):
+    """
+    Bring a parsed model answer into the [{data, page}] shape, one entry per page.
+
+    Args:
+    - result (list or dict): Parsed JSON answer for a window.
+    - window (list): Page numbers sent in the request.
+
+    Returns:
+    - list: Datasets with valid groups and their 'page' as a string, leaving out pages
+      without data.
+    """
+    items = result if isinstance(result, list) else [result]
+    datasets = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        groups = parse_groups(item.get('data'))
+        if groups:
+            datasets.append({'data': groups, 'page': str(page_of(item, window))})
+    return datasets
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    # The prompt's example uses Python-style quotes, which the model sometimes copies
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def strip_fences(text):
+    """
+    Args:
+    - text (str): Model output.
+
+    Returns:
+    - str: The output without a Markdown code fence around it.
+    """
+    match = FENCE_PATTERN.match(text)
+    return match.group(1) if match else text
+
+
+def parse_answer(text):
+    """
+    Parse a complete model answer as JSON, or as the Python literal style of the prompt's
+    example, ignoring a code fence around it.
+
+    Args:
+    - text (str): Model output.
+
+    Returns:
+    - list, dict or None: The parsed answer, or None if it does not parse as a whole.
+    """
+    parsed = _loads(strip_fences(text).strip())
+    return parsed if isinstance(parsed, (list, dict)) else None
+
+
+def find_objects(text):
+    """
+    Find every balanced {...} in a possibly truncated JSON text that parses on its own.
+
+    Args:
+    - text (str): Model output.
+
+    Returns:
+    - list: (start, end, parsed dict) tuples, in order of their closing brace.
+    """
+    objects, starts = [], []
+    in_string, quote, escaped = False, '', False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                in_string = False
+        elif char in '"\'':
+            in_string, quote = True, char
+        elif char == '{':
+            starts.append(i)
+        elif char == '}' and starts:
+            start = starts.pop()
+            parsed = _loads(text[start:i + 1])
+            if isinstance(parsed, dict):
+                objects.append((start, i + 1, parsed))
+    return objects
+
+
+def salvage_datasets(text, window):
+    """
+    Recover what is complete from a truncated or malformed answer.
+
+    Complete page datasets are kept as they are. Complete groups of the page the answer
+    was cut off in are kept as that page's partial data, which is assumed to be the
+    window page after the last complete dataset.
+
+    Args:
+    - text (str): Model output.
+    - window (list): Page numbers sent in the request.
+
+    Returns:
+    - tuple: (complete datasets, page numbers not yet fully extracted, salvaged groups
+      of the first of those pages).
+    """
+    objects = find_objects(text)
+    dataset_spans = [(start, end) for start, end, obj in objects if 'data' in obj]
+    datasets = validate_datasets([obj for _, _, obj in objects if 'data' in obj], window)
+    partial_groups = parse_groups([
+        obj for start, end, obj in objects
+        if 'donor_names_group' in obj
+        and not any(data_start <= start and end <= data_end for data_start, data_end in dataset_spans)
+    ])
+    if len(window) == 1:
+        # The datasets of a single page are all that page's
+        partial_groups = [group for dataset in datasets for group in dataset['data']] + partial_groups
+        return [], window, partial_groups
+    done = [int(dataset['page']) for dataset in datasets]
+    remaining = [page_num for page_num in window if not done or page_num > max(done)]
+    return datasets, remaining, partial_groups
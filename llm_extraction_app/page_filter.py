@@ -0,0 +1,107 @@
+import os
+import re
+
+# Pages scoring below this are not sent to the model; 0 sends every page
+PREFILTER_THRESHOLD = float(os.environ.get('PREFILTER_THRESHOLD', 2.0))
+# Pages on each side of a candidate page that are sent too, since donor lists run across
+# pages and a continuation page may have no gift levels or amounts of its own
+PREFILTER_NEIGHBORS = int(os.environ.get('PREFILTER_NEIGHBORS', 1))
+# Part of the cache key of extraction results; bump it when the scoring changes
+FILTER_VERSION = 2
+
+CURRENCY_PATTERN = re.compile(r'[$€£]\s?\d[\d,.]*')
+# Gift level headings: "$1,000 - $4,999", "$500 to $999", "$100,000 and above", "Up to $999"
+RANGE_PATTERN = re.compile(
+    r'[$€£]\s?\d[\d,.]*\s*(?:-|–|—|to)\s*[$€£]?\s?\d[\d,.]*'
+    r'|[$€£]\s?\d[\d,.]*\+?\s*(?:and|or)\s+(?:above|more|over|up)'
+    r'|(?:up to|under|less than)\s+[$€£]\s?\d[\d,.]*',
+    re.IGNORECASE
+)
+# Capitalized or upper-case personal or organization names: "Jane Smith", "John Q. Public",
+# "Mr. and Mrs. Lee", "JOHN AND MARY SMITH"
+NAME_WORD = r"[A-Z](?:[a-z'’-]+|[A-Z'’-]+)"
+NAME_PATTERN = re.compile(rf"\b{NAME_WORD}(?:\s+(?:[A-Z]\.|{NAME_WORD}|and|&)){{1,3}}")
+WORD_PATTERN = re.compile(r'\w+')
+GIFT_KEYWORDS = re.compile(
+    r'\b(?:donors?|gifts?|giving|contribut\w*|anonymous|foundation|benefactors?|patrons?|sponsors?|'
+    r'honor roll|in (?:honor|memory) of|circle|society|annual fund|pledges?|endowment)\b',
+    re.IGNORECASE
+)
+
+
+def score_page(text):
+    """
+    Score how likely a page is to list donors, from its text alone.
+
+    Gift level ranges weigh the most, then the share of words that belong to names, then
+    currency amounts and gift keywords. Each signal is capped so a long page cannot win
+    on a single one.
+
+    Args:
+    - text (str): Text of the page.
+
+    Returns:
+    - dict: 'score' and the counts it was computed from ('ranges', 'amounts',
+      'name_ratio', 'keywords').
+    """
+    words = len(WORD_PATTERN.findall(text))
+    ranges = len(RANGE_PATTERN.findall(text))
+    amounts = len(CURRENCY_PATTERN.findall(text))
+    name_words = sum(len(WORD_PATTERN.findall(name)) for name in NAME_PATTERN.findall(text))
+    name_ratio = name_words / words if words else 0.0
+    keywords = len(GIFT_KEYWORDS.findall(text))
+    score = 2.0 * min(ranges, 2) + 0.5 * min(amounts, 4) + 4.0 * name_ratio + 0.5 * min(keywords, 4)
+    return {
+        'score': round(score, 2),
+        'ranges': ranges,
+        'amounts': amounts,
+        'name_ratio': round(name_ratio, 2),
+        'keywords': keywords,
+    }
+
+
+def score_pages(text_list):
+    """
+    Args:
+    - text_list (list): Text of each page.
+
+    Returns:
+    - list: score_page() of each page.
+    """
+    return [score_page(text) for text in text_list]
+
+
+def candidate_pages(scores, threshold=PREFILTER_THRESHOLD, pages=None, neighbors=PREFILTER_NEIGHBORS):
+    """
+    Args:
+    - scores (list): score_page() of each page.
+    - threshold (float, optional): Minimum score of a candidate page; 0 keeps every page.
+    - pages (list, optional): Only consider these page numbers. Defaults to every page.
+    - neighbors (int, optional): Pages kept on each side of a page scoring above the threshold.
+
+    Returns:
+    - list: Page numbers worth sending to the model, in page order.
+    """
+    wanted = range(len(scores)) if pages is None else sorted(set(pages))
+    if threshold <= 0:
+        return list(wanted)
+    kept = set()
+    for page_num, score in enumerate(scores):
+        if score['score'] >= threshold:
+            kept.update(range(page_num - neighbors, page_num + neighbors + 1))
+    return [page_num for page_num in wanted if page_num in kept]
+
+
+def skipped_pages(text_list, candidates, pages=None):
+    """
+    Args:
+    - text_list (list): Text of each page.
+    - candidates (list): candidate_pages() of the document.
+    - pages (list, optional): Only consider these page numbers. Defaults to every page.
+
+    Returns:
+    - list: Page numbers with text that are not sent to the model, in page order.
+    """
+    wanted = range(len(text_list)) if pages is None else sorted(set(pages))
+    candidates = set(candidates)
+    return [page_num for page_num in wanted if page_num not in candidates and text_list[page_num].strip()]
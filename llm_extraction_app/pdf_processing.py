@@ -1,47 +1,42 @@
+import os
+import time
+import json
+import hashlib
+import logging
+import contextvars
 import streamlit as st
-import fitz
 import openai
-import json
-
+from concurrent.futures import ThreadPoolExecutor
+from page_extraction import extract_pages, extract_page, open_document
+from extraction_cache import ExtractionCache
+from page_filter import PREFILTER_THRESHOLD, PREFILTER_NEIGHBORS, FILTER_VERSION, score_pages, candidate_pages, skipped_pages
+from extraction_schema import validate_datasets, salvage_datasets, parse_answer
+from openai_scheduler import scheduled_http_client
 
-# Cache the PDF text extraction to avoid reprocessing
-@st.cache_data
-def get_text(pdf_stream):
-    all_pages_text = []
-    pdf_document = fitz.open(stream=pdf_stream, filetype="pdf")
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        text = page.get_text()
-        all_pages_text.append(text)
-        
-    pdf_document.close()
-    return all_pages_text
-
-# Cache the PDF image extraction to avoid reprocessing
-@st.cache_data
-def get_images(pdf_stream):
-    pdf_document = fitz.open(stream=pdf_stream, filetype="pdf")
-    images = []
-    
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        pix = page.get_pixmap()
-        image_bytes = pix.tobytes("png")
-        images.append(image_bytes)
-        
-    pdf_document.close()
-    return images
+logger = logging.getLogger(__name__)
 
-# Cache the OpenAI client initialization to avoid re-initialization
-@st.cache_resource
-def load_openai_client(api_key):
-    return openai.OpenAI(api_key=api_key)
+EXTRACTION_MODEL = os.environ.get('EXTRACTION_MODEL', 'gpt-4')
+# Pages sent to the model per request, and requests in flight at once
+PAGES_PER_WINDOW = int(os.environ.get('PAGES_PER_WINDOW', 1))
+EXTRACTION_CONCURRENCY = int(os.environ.get('EXTRACTION_CONCURRENCY', 4))
+# Completion budget of a request; doubled up to the limit when an answer is truncated
+EXTRACTION_MAX_TOKENS = int(os.environ.get('EXTRACTION_MAX_TOKENS', 1000))
+EXTRACTION_MAX_TOKENS_LIMIT = int(os.environ.get('EXTRACTION_MAX_TOKENS_LIMIT', 4000))
+EXTRACTION_RETRIES = int(os.environ.get('EXTRACTION_RETRIES', 2))
+# Follow-up requests chained after a truncated answer before the rest is reported as failed
+EXTRACTION_MAX_FOLLOW_UPS = int(os.environ.get('EXTRACTION_MAX_FOLLOW_UPS', 3))
+RETRY_BACKOFF = float(os.environ.get('RETRY_BACKOFF', 1.0))
+# Extracted pages and results survive restarts in this directory, up to the size limit
+EXTRACTION_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', '.extraction_cache')
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 1024 ** 3))
+# Documents whose page text is also kept in memory
+PAGES_MEMORY_ENTRIES = int(os.environ.get('PAGES_MEMORY_ENTRIES', 4))
+# Resolution of the page previews, and of a page shown at full resolution
+THUMBNAIL_DPI = int(os.environ.get('THUMBNAIL_DPI', 40))
+FULL_RES_DPI = int(os.environ.get('FULL_RES_DPI', 150))
 
-# Cache the GPT-4 response to avoid redundant API calls
-@st.cache_data
-def process_pdf_with_gpt(_client_openai, text):
-    prompt_text='''Extract the following donation information into a JSON format with the structure:
+# Appended to the text of each page window
+PROMPT_TEXT = '''Extract the following donation information into a JSON format with the structure:
     {
     "data": [
         {
@@ -93,17 +88,290 @@ def process_pdf_with_gpt(_client_openai, text):
 
         }
     ]'''
+# Appended, with the last group already extracted, when asking for the rest of a page
+CONTINUE_TEXT = '''
+    The answer for this page was cut off. Return the same JSON structure containing only the
+    donor groups that come after this group, which was the last one extracted:
+    '''
+# Cached results are only reused for the prompt, model and page filter that produced them
+PROMPT_VERSION = hashlib.sha256((PROMPT_TEXT + CONTINUE_TEXT).encode('utf-8')).hexdigest()[:12]
+EXTRACTION_VARIANT = f'{PROMPT_VERSION}-{EXTRACTION_MODEL}-f{FILTER_VERSION}.{PREFILTER_THRESHOLD:g}.{PREFILTER_NEIGHBORS}'
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_BYTES)
+
+
+# Keep the page text of recent documents in memory, keyed by content hash only, so a
+# rerun neither hashes the PDF bytes nor reads the disk cache; the PDF is only parsed on a
+# miss. Pages are not rendered here; render_page_image() renders them one at a time.
+@st.cache_resource(max_entries=PAGES_MEMORY_ENTRIES)
+def get_page_texts(doc_key, _pdf_bytes):
+    cached = extraction_cache.get_text(doc_key)
+    if cached is not None:
+        return cached
+    text_list = extract_pages(_pdf_bytes, images=False)[0]
+    extraction_cache.put_text(doc_key, text_list)
+    return text_list
+
+# Local relevance score of each page, shown in the app next to the extraction results
+@st.cache_resource(max_entries=PAGES_MEMORY_ENTRIES)
+def get_page_scores(doc_key, _text_list):
+    return score_pages(_text_list)
+
+def render_page_image(doc_key, pdf_bytes, page_num, dpi=THUMBNAIL_DPI):
+    """
+    Render a single page to PNG, reusing the render cached on disk.
+
+    Args:
+    - doc_key (str): Content hash of the PDF, from page_extraction.document_key().
+    - pdf_bytes (bytes): Contents of the PDF.
+    - page_num (int): Zero-based page number.
+    - dpi (int, optional): Render resolution. Defaults to THUMBNAIL_DPI.
+
+    Returns:
+    - bytes: PNG of the page.
+    """
+    image_bytes = extraction_cache.get_page_image(doc_key, page_num, dpi)
+    if image_bytes is None:
+        with open_document(pdf_bytes) as pdf_document:
+            image_bytes = extract_page(pdf_document.load_page(page_num), text=False, dpi=dpi)['image']
+        extraction_cache.put_page_image(doc_key, page_num, dpi, image_bytes)
+    return image_bytes
+
+# Cache the OpenAI client initialization to avoid re-initialization
+@st.cache_resource
+def load_openai_client(api_key):
+    # Requests share the process-wide rate-limit scheduler, which also does the retries
+    return openai.OpenAI(api_key=api_key, http_client=scheduled_http_client(), max_retries=0)
+
+
+def page_windows(text_list, pages_per_window=PAGES_PER_WINDOW, pages=None):
+    """
+    Group pages into consecutive windows, one model request each. Blank pages are left out.
+
+    Args:
+    - text_list (list): Text of each page.
+    - pages_per_window (int, optional): Maximum number of pages per window.
+    - pages (list, optional): Only include these page numbers. Defaults to every page.
+
+    Returns:
+    - list: Lists of page numbers, in page order.
+    """
+    wanted = range(len(text_list)) if pages is None else sorted(set(pages))
+    windows = []
+    for page_num in wanted:
+        if not text_list[page_num].strip():
+            continue
+        if windows and len(windows[-1]) < pages_per_window and windows[-1][-1] == page_num - 1:
+            windows[-1].append(page_num)
+        else:
+            windows.append([page_num])
+    return windows
+
+
+def with_known_groups(datasets, page_num, known_groups):
+    """
+    Args:
+    - datasets (list): Datasets extracted for a single page.
+    - page_num (int): The page.
+    - known_groups (list): Groups of the page extracted by earlier requests.
+
+    Returns:
+    - list: One dataset holding the known groups followed by the new ones.
+    """
+    groups = list(known_groups)
+    groups.extend(group for dataset in datasets for group in dataset['data'] if group not in groups)
+    return [{'data': groups, 'page': str(page_num)}] if groups else []
+
+
+def extract_window(client_openai, text_list, window, max_tokens=EXTRACTION_MAX_TOKENS, retries=EXTRACTION_RETRIES,
+                   known_groups=None, depth=0):
+    """
+    Extract the donation data of a window of pages with one request.
+
+    An answer that does not parse as a whole is not thrown away: complete datasets and
+    groups are salvaged. If the answer was cut off by the token limit, follow-up requests
+    only ask for the pages after them, or for the rest of the page the answer was cut
+    off in, up to EXTRACTION_MAX_FOLLOW_UPS deep. Otherwise the pages the salvaged data
+    does not cover are reported as failed. Failed requests are retried for this window
+    only.
+
+    Args:
+    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - text_list (list): Text of each page.
+    - window (list): Page numbers to extract.
+    - max_tokens (int, optional): Completion budget of the first attempt.
+    - retries (int, optional): Number of retries after the first attempt.
+    - known_groups (list, optional): Groups of a single-page window already extracted;
+      the model is asked for the groups after the last of them.
+    - depth (int, optional): Number of follow-up requests this one is chained after.
+
+    Returns:
+    - tuple: (datasets of the window in the [{data, page}] shape, page numbers that
+      could not be fully extracted).
+    """
+    known_groups = known_groups or []
+    content = '\n'.join(f'page {page_num}: {text_list[page_num]}' for page_num in window) + PROMPT_TEXT
+    if known_groups:
+        content += CONTINUE_TEXT + json.dumps(known_groups[-1])
+    for attempt in range(retries + 1):
+        try:
+            response = client_openai.chat.completions.create(
+                model=EXTRACTION_MODEL,
+                messages=[
+                    {"role": "user", "content": content}
+                ],
+                temperature=0,
+                max_tokens=max_tokens,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0
+            )
+        except openai.OpenAIError as e:
+            logger.warning("Extraction of pages %s failed (attempt %d): %s", window, attempt + 1, e)
+            if attempt < retries:
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+            continue
+        choice = response.choices[0]
+        answer = choice.message.content or ''
+        truncated = choice.finish_reason == 'length'
+        parsed = None if truncated else parse_answer(answer)
+        if parsed is not None:
+            datasets = validate_datasets(parsed, window)
+            return (with_known_groups(datasets, window[0], known_groups) if known_groups else datasets), []
+
+        datasets, remaining, partial_groups = salvage_datasets(answer, window)
+        if len(window) == 1:
+            partial_groups = [group for group in partial_groups if group not in known_groups]
+        if truncated:
+            max_tokens = min(max_tokens * 2, EXTRACTION_MAX_TOKENS_LIMIT)
+        if not datasets and not partial_groups:
+            logger.warning("Extraction of pages %s failed (attempt %d): %s", window, attempt + 1,
+                           'answer truncated' if truncated else 'no valid JSON in answer')
+            continue
+
+        if partial_groups and remaining and len(window) == 1:
+            partial_datasets = with_known_groups([{'data': partial_groups}], window[0], known_groups)
+        elif partial_groups and remaining:
+            partial_datasets = [{'data': partial_groups, 'page': str(remaining[0])}]
+        else:
+            partial_datasets = []
+        if not truncated or depth >= EXTRACTION_MAX_FOLLOW_UPS:
+            # Asking again would not get a better answer: keep what parsed and report the rest
+            logger.warning("Salvaged %d datasets and %d groups from pages %s; pages %s are incomplete (%s)",
+                           len(datasets), len(partial_groups), window, remaining,
+                           'too many follow-ups' if truncated else 'no valid JSON in answer')
+            return datasets + partial_datasets, remaining
+
+        # Keep what is complete and only ask again for what is missing
+        logger.info("Salvaged %d datasets and %d groups from pages %s, following up on pages %s",
+                    len(datasets), len(partial_groups), window, remaining)
+        failed_pages = []
+        if partial_groups and remaining:
+            page_datasets, page_failed = extract_window(client_openai, text_list, remaining[:1], max_tokens, retries,
+                                                        known_groups=known_groups + partial_groups, depth=depth + 1)
+            datasets.extend(page_datasets)
+            failed_pages.extend(page_failed)
+            remaining = remaining[1:]
+        if remaining:
+            rest_datasets, rest_failed = extract_window(client_openai, text_list, remaining, max_tokens, retries,
+                                                        depth=depth + 1)
+            datasets.extend(rest_datasets)
+            failed_pages.extend(rest_failed)
+        return datasets, failed_pages
+
+    logger.error("Giving up on pages %s", window)
+    # Groups salvaged by earlier requests are kept, with the page reported as failed
+    return with_known_groups([], window[0], known_groups), window
+
+
+def extract_donations(client_openai, text_list, pages=None, pages_per_window=PAGES_PER_WINDOW,
+                      max_workers=EXTRACTION_CONCURRENCY, threshold=PREFILTER_THRESHOLD):
+    """
+    Extract donation data page window by page window, with bounded concurrency.
+
+    Pages are first scored locally (see page_filter.py) and only candidate pages, and
+    their neighbours, are sent to the model. The pages left out are logged.
+
+    Args:
+    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - text_list (list): Text of each page.
+    - pages (list, optional): Only extract these page numbers. Defaults to every page.
+    - pages_per_window (int, optional): Maximum number of pages per request.
+    - max_workers (int, optional): Maximum number of requests in flight.
+    - threshold (float, optional): Minimum page score sent to the model; 0 sends every page.
+
+    Returns:
+    - tuple: (datasets in the [{data, page}] shape ordered by page, list of the page
+      numbers whose extraction failed after retries).
+    """
+    scores = score_pages(text_list)
+    candidates = candidate_pages(scores, threshold, pages)
+    considered = len(text_list) if pages is None else len(set(pages))
+    logger.info("Pre-filter sends %d of %d pages to the model", len(candidates), considered)
+    skipped = skipped_pages(text_list, candidates, pages)
+    if skipped:
+        logger.info("Pre-filter skipped pages %s", skipped)
+    windows = page_windows(text_list, pages_per_window, candidates)
+    datasets, failed_pages = [], []
+    if not windows:
+        return datasets, failed_pages
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # Each request runs in a copy of the caller's context, keeping its scheduler priority
+        futures = [executor.submit(contextvars.copy_context().run, extract_window, client_openai, text_list, window)
+                   for window in windows]
+        for window, future in zip(windows, futures):
+            try:
+                window_datasets, window_failed = future.result()
+            except Exception:
+                logger.exception("Giving up on pages %s", window)
+                window_datasets, window_failed = [], window
+            datasets.extend(window_datasets)
+            failed_pages.extend(window_failed)
+    return sorted(datasets, key=lambda dataset: int(dataset['page'])), failed_pages
+
+
+def process_pdf_with_gpt(client_openai, doc_key, text_list, max_workers=EXTRACTION_CONCURRENCY):
+    """
+    Extract donation data from every page of a document, reusing the result cached on
+    disk for the same PDF, prompt version and model.
+
+    Args:
+    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - doc_key (str): Content hash of the PDF, from page_extraction.document_key().
+    - text_list (list): Text of each page.
+    - max_workers (int, optional): Maximum number of requests in flight.
+
+    Returns:
+    - tuple: (datasets in the [{data, page}] shape, page numbers that failed).
+    """
+    cached = extraction_cache.get_extraction(doc_key, EXTRACTION_VARIANT)
+    if cached is not None:
+        return cached
+    datasets, failed_pages = extract_donations(client_openai, text_list, max_workers=max_workers)
+    extraction_cache.put_extraction(doc_key, EXTRACTION_VARIANT, datasets, failed_pages)
+    return datasets, failed_pages
+
+
+def retry_failed_pages(client_openai, doc_key, text_list, max_workers=EXTRACTION_CONCURRENCY):
+    """
+    Extract again only the pages whose extraction failed, and update the cached result.
 
+    Args:
+    - client_openai (OpenAI Client): Instance of OpenAI client.
+    - doc_key (str): Content hash of the PDF, from page_extraction.document_key().
+    - text_list (list): Text of each page.
+    - max_workers (int, optional): Maximum number of requests in flight.
 
-    response = _client_openai.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "user", "content": text + prompt_text}
-        ],
-        temperature=0,
-        max_tokens=1000,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0
-    )
-    return json.loads(response.choices[0].message.content)
+    Returns:
+    - tuple: (datasets in the [{data, page}] shape, page numbers that still failed).
+    """
+    datasets, failed_pages = process_pdf_with_gpt(client_openai, doc_key, text_list, max_workers=max_workers)
+    if not failed_pages:
+        return datasets, failed_pages
+    retried, still_failed = extract_donations(client_openai, text_list, pages=failed_pages, max_workers=max_workers)
+    # Partial data kept for a page is replaced once the page has been extracted in full
+    replaced = {str(page_num) for page_num in failed_pages if page_num not in still_failed}
+    datasets = [dataset for dataset in datasets if dataset['page'] not in replaced]
+    datasets = sorted(datasets + retried, key=lambda dataset: int(dataset['page']))
+    extraction_cache.put_extraction(doc_key, EXTRACTION_VARIANT, datasets, still_failed)
+    return datasets, still_failed
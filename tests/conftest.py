@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import functools
+import threading
+
+import openai
+import pytest
+# Mock transports must come from the HTTP library the OpenAI SDK is built on
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The apps are run from their own directories and import their modules by name
+for path in ('common', 'llm_extraction_app', os.path.join('chat_with_my_document', 'backend')):
+    sys.path.insert(0, os.path.join(REPO_DIR, path))
+
+ANSWER = 'The foundation received 25,000 from John and Mary Smith.'
+
+
+class FakeOpenAIServer:
+    """
+    Answers the OpenAI API requests of a real client locally, and records them.
+
+    Chat completions return ANSWER, streamed as one event per word when asked to;
+    embeddings return a fixed vector per input.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        endpoint = request.url.path.rsplit('/', 1)[-1]
+        self.requests.append((endpoint, body))
+        usage = {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}
+        if endpoint == 'embeddings':
+            inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+            return httpx.Response(200, json={
+                'object': 'list', 'model': body['model'], 'usage': usage,
+                'data': [{'object': 'embedding', 'index': i, 'embedding': [0.5] * 8} for i in range(len(inputs))],
+            })
+        completion = {'id': 'chatcmpl-test', 'created': 0, 'model': body['model']}
+        if not body.get('stream'):
+            return httpx.Response(200, json=dict(completion, object='chat.completion', usage=usage, choices=[{
+                'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': ANSWER},
+            }]))
+        words = ANSWER.split(' ')
+        events = [dict(completion, object='chat.completion.chunk', choices=[{
+            'index': 0, 'finish_reason': None, 'delta': {'content': word if i == 0 else ' ' + word},
+        }]) for i, word in enumerate(words)]
+        events.append(dict(completion, object='chat.completion.chunk', choices=[], usage=usage))
+        content = ''.join(f'data: {json.dumps(event)}\n\n' for event in events) + 'data: [DONE]\n\n'
+        return httpx.Response(200, content=content.encode(), headers={'content-type': 'text/event-stream'})
+
+    def client(self):
+        """
+        Returns:
+        - OpenAI Client: Client whose requests this server answers.
+        """
+        return openai.OpenAI(api_key='sk-test', max_retries=0,
+                             http_client=httpx.Client(transport=httpx.MockTransport(self)))
+
+
+@pytest.fixture(scope='session')
+def backend(tmp_path_factory):
+    """
+    The chat backend's chatdoc module, imported once with the numpy vector store and
+    the offline embedding provider, storing its files in a temporary directory.
+    """
+    patch = pytest.MonkeyPatch()
+    # chatdoc keeps its files under relative paths
+    patch.chdir(tmp_path_factory.mktemp('backend'))
+    import clients
+    from embeddings import make_embedding_provider
+    patch.setattr(clients, 'VECTOR_STORE', 'numpy')
+    patch.setattr(clients, 'EMBEDDING_PROVIDER', 'hashing')
+    patch.setattr(clients, 'make_embedding_provider', functools.partial(make_embedding_provider, provider='hashing'))
+    patch.setenv('OPENAI_API_KEY', 'sk-test')
+    import chatdoc
+    yield chatdoc
+    patch.undo()
+
+
+@pytest.fixture
+def openai_server(backend, monkeypatch):
+    server = FakeOpenAIServer()
+    client_openai = server.client()
+    monkeypatch.setattr(backend, 'get_openai_client', lambda: client_openai)
+    return server
+
+
+@pytest.fixture
+def report_pdf(tmp_path):
+    """
+    Path of a three-page PDF with a donor list on its second page.
+    """
+    import pymupdf
+    path = str(tmp_path / 'report.pdf')
+    with pymupdf.open() as pdf_document:
+        for text in ('Annual report of the foundation', 'John and Mary Smith gave 25,000 to the scholarship fund',
+                     'The programs reached 4,000 students this year'):
+            pdf_document.new_page().insert_text((72, 72), text)
+        pdf_document.save(path)
+    return path
+
+
+@pytest.fixture
+def upload(backend, openai_server):
+    """
+    Upload a PDF through the API and wait for its job and summary to finish.
+    """
+    client = backend.app.test_client()
+
+    def upload_file(path, doc_id=None):
+        with open(path, 'rb') as f:
+            data = {'file': (f, os.path.basename(path))}
+            if doc_id is not None:
+                data['doc_id'] = doc_id
+            response = client.post('/upload', data=data)
+        assert response.status_code == 202, response.data
+        for _ in range(1000):
+            job = client.get(response.json['status_url']).json
+            if job['status'] == 'failed':
+                return job
+            # The summary is generated after the upload; wait for it too, so it never
+            # reaches the model once the fake server is gone
+            if job['status'] == 'done':
+                summary = client.get(f"/documents/{job['result']['doc_id']}/summary")
+                if summary.status_code != 202 or summary.json['status'] == 'failed':
+                    return job
+            threading.Event().wait(0.01)
+        raise AssertionError('the upload job did not finish')
+    return upload_file
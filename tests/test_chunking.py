@@ -0,0 +1,46 @@
+import pymupdf
+
+from chunking import chunk_page
+from chat_doc_f import chunk_rows, chunk_bbox
+from context_builder import needs_image
+from lexical_index import LexicalIndex
+from page_extraction import iter_pages
+
+
+def make_pdf(path):
+    with pymupdf.open() as pdf_document:
+        pdf_document.new_page().insert_text((72, 72), 'Annual report of the foundation')
+        # A scanned page has an image but no text layer
+        pdf_document.new_page()
+        pdf_document.save(path)
+
+
+def test_page_without_text_gives_a_whole_page_chunk(tmp_path):
+    path = str(tmp_path / 'scan.pdf')
+    make_pdf(path)
+    chunks = []
+    for page in iter_pages(path, images=False, blocks=True):
+        chunks.extend(chunk_page(page['blocks'], page['page'], page['rect']))
+
+    assert [chunk['page'] for chunk in chunks] == [0, 1]
+    assert chunks[1]['text'] == '' and chunks[1]['bbox'] == (0.0, 0.0, 595.0, 842.0)
+    ids, metadatas = chunk_rows(chunks)
+    assert chunk_bbox(metadatas[1]) == chunks[1]['bbox']
+    assert needs_image(chunks[1]['text'])
+    # A question about the page reaches the chunk without any text to match
+    hits = LexicalIndex(ids, [chunk['text'] for chunk in chunks], metadatas).search('What is on page 2?', 5)
+    assert [hit['id'] for hit in hits] == [ids[1]]
+
+
+def test_blocks_are_packed_and_headings_start_chunks():
+    blocks = [
+        {'text': 'Introduction', 'size': 18.0, 'bbox': (0, 0, 100, 20)},
+        {'text': 'a' * 60, 'size': 10.0, 'bbox': (0, 20, 100, 40)},
+        {'text': 'b' * 60, 'size': 10.0, 'bbox': (0, 40, 100, 60)},
+        {'text': 'Results', 'size': 18.0, 'bbox': (0, 60, 100, 80)},
+        {'text': 'c' * 60, 'size': 10.0, 'bbox': (0, 80, 100, 100)},
+    ]
+    chunks = chunk_page(blocks, 3, chunk_size=200, overlap=0)
+    assert [chunk['text'].split('\n')[0] for chunk in chunks] == ['Introduction', 'Results']
+    assert chunks[0]['bbox'] == (0, 0, 100, 60) and chunks[1]['bbox'] == (0, 60, 100, 100)
+    assert all(chunk['page'] == 3 for chunk in chunks)
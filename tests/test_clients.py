@@ -0,0 +1,97 @@
+import functools
+import threading
+
+import pytest
+
+import clients
+from clients import CachedChromaClient
+from embeddings import make_embedding_provider, HashingEmbeddingProvider
+from vector_store import NumpyVectorStore
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients(monkeypatch):
+    # Each test starts from a process that has not created any client yet
+    for name, value in [('_initialized', False), ('_api_key', None), ('_client_openai', None),
+                        ('_client_cdb', None), ('_embedder', None), ('VECTOR_STORE', 'chroma'),
+                        ('EMBEDDING_PROVIDER', 'openai'), ('make_embedding_provider', make_embedding_provider)]:
+        monkeypatch.setattr(clients, name, value)
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+
+
+class FakeChroma:
+    def __init__(self):
+        self.created = []
+
+    def get_or_create_collection(self, name, **kwargs):
+        self.created.append(name)
+        threading.Event().wait(0.01)
+        return object()
+
+    def delete_collection(self, name):
+        pass
+
+
+def test_collection_handles_are_created_once_across_threads():
+    fake = FakeChroma()
+    cached = CachedChromaClient(fake)
+    handles = []
+    threads = [threading.Thread(target=lambda: handles.append(cached.get_or_create_collection('doc')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake.created == ['doc']
+    assert len({id(handle) for handle in handles}) == 1
+
+    cached.delete_collection('doc')
+    assert cached.get_or_create_collection('doc') is not handles[0]
+    assert fake.created == ['doc', 'doc']
+
+
+def test_clients_are_created_once_per_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(clients, 'VECTOR_STORE', 'numpy')
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(clients.init_clients(str(tmp_path))))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({tuple(map(id, result)) for result in results}) == 1
+    client_openai, client_cdb, embedder = results[0]
+    assert isinstance(client_cdb, NumpyVectorStore)
+    assert clients.get_openai_client() is client_openai
+    assert clients.get_chroma_client() is client_cdb
+    assert clients.get_embedder() is embedder and embedder.client_openai is client_openai
+    # Retries are left to the rate-limit scheduler
+    assert client_openai.max_retries == 0
+
+
+def test_offline_provider_creates_the_openai_client_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(clients, 'VECTOR_STORE', 'numpy')
+    monkeypatch.setattr(clients, 'EMBEDDING_PROVIDER', 'hashing')
+    monkeypatch.setattr(clients, 'make_embedding_provider', functools.partial(make_embedding_provider, provider='hashing'))
+    client_openai, _, embedder = clients.init_clients(str(tmp_path))
+    assert client_openai is None and isinstance(embedder, HashingEmbeddingProvider)
+    assert not clients.openai_configured()
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+    assert clients.openai_configured()
+    assert clients.get_openai_client() is clients.get_openai_client()
+
+
+def test_clients_must_be_initialized_first():
+    for getter in (clients.get_openai_client, clients.get_chroma_client, clients.get_embedder):
+        with pytest.raises(RuntimeError, match='init_clients'):
+            getter()
+
+
+def test_unusable_store_fails_at_startup(tmp_path, monkeypatch):
+    monkeypatch.setattr(clients, 'VECTOR_STORE', 'numpy')
+    monkeypatch.setenv('OPENAI_API_KEY', 'sk-test')
+    path = tmp_path / 'store'
+    path.write_text('not a directory')
+    with pytest.raises(RuntimeError, match='Failed to open the numpy vector store'):
+        clients.init_clients(str(path))
@@ -0,0 +1,60 @@
+import pymupdf
+import pytest
+
+from context_builder import build_context, needs_image, estimate_tokens, image_tokens
+
+TABLE = '2019 1,200 2020 1,450 2021 1,700'
+PROSE = 'The foundation supported local schools and libraries throughout the year. ' * 5
+
+
+@pytest.fixture
+def crop(tmp_path):
+    path = str(tmp_path / 'crop.png')
+    pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, 100, 50), 0).save(path)
+    return path
+
+
+def lazy(path, rendered):
+    def render():
+        rendered.append(path)
+        return path
+    return render
+
+
+@pytest.mark.parametrize('images, expected', [('none', 0), ('auto', 1), ('all', 2)])
+def test_only_attached_crops_are_rendered(crop, images, expected):
+    rendered = []
+    _, urls, stats = build_context([TABLE, PROSE], [lazy(crop, rendered), lazy(crop, rendered)], images=images)
+    assert len(rendered) == len(urls) == stats['images'] == expected
+
+
+def test_needs_image_flags_tables_and_short_chunks():
+    assert needs_image(TABLE)
+    assert needs_image('Figure 3')
+    assert not needs_image(PROSE)
+
+
+@pytest.mark.parametrize('max_tokens', [300, 301, 333, 1000])
+def test_context_stays_within_the_token_budget(max_tokens):
+    chunks = [PROSE * 4, PROSE * 4, PROSE * 4]
+    context, _, stats = build_context(chunks, reserved_tokens=50, max_tokens=max_tokens, images='none')
+    assert stats['tokens'] <= max_tokens
+    assert stats['tokens'] == 50 + sum(estimate_tokens(text) for text in context.split('\n\n'))
+    assert stats['chunks'] + stats['dropped_chunks'] == len(chunks)
+
+
+def test_chunks_with_too_little_room_left_are_dropped():
+    _, _, stats = build_context([PROSE * 4, PROSE * 4], max_tokens=estimate_tokens(PROSE * 4) + 10, images='none')
+    assert (stats['chunks'], stats['dropped_chunks']) == (1, 1)
+
+
+def test_images_stay_within_the_byte_and_token_budgets(crop):
+    _, urls, _ = build_context([TABLE], [crop], images='all')
+    url_bytes = len(urls[0])
+    _, urls, stats = build_context([TABLE] * 3, [crop] * 3, images='all', max_image_bytes=2 * url_bytes)
+    assert (stats['images'], stats['dropped_images'], stats['image_bytes']) == (2, 1, 2 * url_bytes)
+
+    cost = image_tokens(100, 50)
+    _, urls, stats = build_context([TABLE] * 2, [crop] * 2, images='all', max_tokens=2 * estimate_tokens(TABLE) + cost)
+    assert (stats['images'], stats['dropped_images']) == (1, 1)
+    assert stats['tokens'] <= 2 * estimate_tokens(TABLE) + cost
@@ -0,0 +1,36 @@
+import os
+
+import doc_cache
+from doc_cache import DocumentCache
+
+
+def put(cache, key):
+    cache.put(key, ['page text'] * 10, [{'text': 'chunk', 'page': 0}], [[0.5] * 10])
+
+
+def test_sizes_follow_writes(tmp_path):
+    cache = DocumentCache(str(tmp_path), 10 ** 6)
+    put(cache, 'a')
+    cache.put_summary('a', 'summary')
+    cache.put_summary('b', 'summary only')
+    assert cache._total == doc_cache._dir_size(str(tmp_path))
+    assert DocumentCache(str(tmp_path), 10 ** 6)._total == cache._total
+    assert cache.get('a')['text_list'] == ['page text'] * 10
+    assert cache.get_summary('a') == 'summary'
+
+
+def test_evicts_least_recently_used_without_walking_the_cache(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path), 10 ** 6)
+    for key in ('a', 'b', 'c'):
+        put(cache, key)
+    entry_size = cache._sizes['a']
+    cache.max_bytes = 2 * entry_size
+    assert cache.get('a') is not None
+
+    walked = []
+    monkeypatch.setattr(doc_cache, '_dir_size', lambda path: walked.append(path) or entry_size)
+    put(cache, 'd')
+    # Only the entry that was written is measured
+    assert walked == [str(tmp_path / 'd')]
+    assert sorted(name for name in os.listdir(tmp_path) if not name.startswith('.')) == ['a', 'd']
+    assert list(cache._sizes) == ['a', 'd']
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+import documents
+from documents import DocumentRegistry, collection_name, valid_doc_id
+from jobs import JobManager
+
+
+def test_registry_survives_a_restart(tmp_path, monkeypatch):
+    path = str(tmp_path / 'documents.json')
+    now = [1000.0]
+    monkeypatch.setattr(documents.time, 'time', lambda: now[0])
+    registry = DocumentRegistry(path)
+    registry.set('report', 'abc', '/pdfs/abc.pdf', 'report.pdf', collection_name('report', 'openai'))
+    registry.set('other', 'def', '/pdfs/def.pdf', 'other.pdf', collection_name('other', 'openai'))
+    now[0] = 2000.0
+    registry.touch('report')
+    registry.flush()
+
+    reopened = DocumentRegistry(path)
+    assert reopened.get('report') == {'doc_key': 'abc', 'path': '/pdfs/abc.pdf', 'filename': 'report.pdf',
+                                      'collection': 'openai-report', 'created': 1000.0, 'last_access': 2000.0}
+    assert reopened.expired(ttl=500) == ['other']
+    assert reopened.remove('other')['doc_key'] == 'def'
+    assert list(DocumentRegistry(path).all()) == ['report']
+
+
+def test_replacing_a_document_keeps_its_creation_time(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(documents.time, 'time', lambda: now[0])
+    registry = DocumentRegistry(str(tmp_path / 'documents.json'))
+    registry.set('report', 'abc', '/pdfs/abc.pdf', 'report.pdf', 'openai-report')
+    now[0] = 2000.0
+    registry.set('report', 'def', '/pdfs/def.pdf', 'report-v2.pdf', 'openai-report')
+    assert (registry.get('report')['doc_key'], registry.get('report')['created']) == ('def', 1000.0)
+
+
+def test_unreadable_registry_starts_empty(tmp_path):
+    path = tmp_path / 'documents.json'
+    path.write_text('{not json')
+    assert DocumentRegistry(str(path)).all() == {}
+
+
+@pytest.mark.parametrize('doc_id, valid', [
+    ('report', True), ('a', True), ('2024_annual-report', True),
+    ('-report', False), ('report_', False), ('../report', False), ('a' * 49, False), (None, False),
+])
+def test_doc_ids_must_make_valid_collection_names(doc_id, valid):
+    assert valid_doc_id(doc_id) is valid
+
+
+def wait(manager, job):
+    job_id = job.id
+    for _ in range(500):
+        snapshot = manager.get(job_id).snapshot()
+        if snapshot['status'] in ('done', 'failed'):
+            return snapshot
+        threading.Event().wait(0.01)
+    raise AssertionError('the job did not finish')
+
+
+def test_job_stages_progress_and_result():
+    manager = JobManager(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def pipeline(job, pages):
+        job.skip('extract')
+        with job.stage('index'):
+            job.set_progress('index', 0.5)
+            started.set()
+            release.wait(5)
+            job.set_progress('index', 7)
+        return {'pages': pages}
+
+    job = manager.submit(['extract', 'index'], pipeline, 3)
+    assert started.wait(5)
+    seen = job.snapshot()
+    release.set()
+    assert seen['status'] == 'running'
+    assert seen['stages']['extract']['status'] == 'skipped'
+    assert seen['stages']['index'] == {'status': 'running', 'progress': 0.5, 'seconds': None}
+
+    finished = wait(manager, job)
+    assert finished['status'] == 'done' and finished['result'] == {'pages': 3}
+    assert finished['stages']['index']['status'] == 'done' and finished['stages']['index']['progress'] == 1.0
+    assert finished['finished'] is not None
+
+
+def test_failed_stage_fails_the_job():
+    manager = JobManager(max_workers=1)
+
+    def pipeline(job):
+        with job.stage('extract'):
+            job.set_progress('extract', 0.25)
+            raise ValueError('not a PDF')
+
+    finished = wait(manager, manager.submit(['extract', 'index'], pipeline))
+    assert (finished['status'], finished['error'], finished['result']) == ('failed', 'not a PDF', None)
+    assert finished['stages']['extract']['status'] == 'failed'
+    assert finished['stages']['extract']['progress'] == 0.25
+    assert finished['stages']['index']['status'] == 'pending'
+
+
+def test_finished_jobs_expire():
+    manager = JobManager(max_workers=1, ttl=0)
+    first = manager.submit(['run'], lambda job: None)
+    wait(manager, first)
+    manager.submit(['run'], lambda job: None)
+    assert manager.get(first.id) is None
@@ -0,0 +1,55 @@
+import logging
+import random
+import time
+
+import pytest
+
+from chat_doc_f import make_batches, create_all_embeddings
+
+
+class FakeProvider:
+    """
+    Embeds 'text-<i>' as [i], after a random delay so batches finish out of order.
+    """
+
+    name = 'fake'
+
+    def __init__(self, failing_start=None):
+        self.failing_start = failing_start
+        self.batches = []
+
+    def embed(self, texts):
+        self.batches.append(texts)
+        time.sleep(random.uniform(0, 0.01))
+        if self.failing_start is not None and texts[0] == f'text-{self.failing_start}':
+            raise RuntimeError('rate limited')
+        return [[float(text.split('-')[1])] for text in texts]
+
+
+TEXTS = [f'text-{i}' for i in range(50)]
+
+
+def test_make_batches_keeps_input_order_within_limits():
+    texts = ['x' * 40, 'x' * 40, 'x' * 400, 'x' * 4] * 5
+    batches = make_batches(texts, max_batch_tokens=100, max_batch_size=3)
+    assert [text for _, batch in batches for text in batch] == texts
+    assert [start for start, _ in batches] == [sum(len(batch) for _, batch in batches[:i]) for i in range(len(batches))]
+    # Only a chunk larger than the budget on its own may exceed it
+    assert all(len(batch) <= 3 and (len(batch) == 1 or sum(len(text) for text in batch) // 4 <= 100)
+               for _, batch in batches)
+
+
+def test_embeddings_stay_aligned_with_their_chunks():
+    provider = FakeProvider()
+    stats = []
+    embeddings = create_all_embeddings(provider, TEXTS, max_batch_size=7, max_workers=4, stats=stats)
+    assert embeddings == [[float(i)] for i in range(len(TEXTS))]
+    assert len(provider.batches) == 8
+    assert [batch['start'] for batch in stats] == list(range(0, 50, 7))
+
+
+def test_failed_batch_is_reported_not_dropped(caplog):
+    provider = FakeProvider(failing_start=21)
+    with caplog.at_level(logging.ERROR, logger='chat_doc_f'), pytest.raises(RuntimeError, match='rate limited'):
+        create_all_embeddings(provider, TEXTS, max_batch_size=7, max_workers=4)
+    assert 'Embedding batch at 21 (7 chunks) failed' in caplog.text
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from conftest import FakeOpenAIServer
+from embeddings import OpenAIEmbeddingProvider, HashingEmbeddingProvider, as_provider, make_embedding_provider
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    provider = HashingEmbeddingProvider(dim=64)
+    first = provider.embed(['John Smith gave to the fund', 'Annual report', ''])
+    assert first == HashingEmbeddingProvider(dim=64).embed(['John Smith gave to the fund', 'Annual report', ''])
+    vectors = np.array(first)
+    assert vectors.shape == (3, 64)
+    np.testing.assert_allclose(np.linalg.norm(vectors[:2], axis=1), 1.0, rtol=1e-6)
+    # Blank text has no features and embeds as the zero vector
+    assert not vectors[2].any()
+    assert provider.name == 'hashing64'
+
+
+def test_hashing_embeddings_rank_shared_terms_higher():
+    provider = HashingEmbeddingProvider(dim=512)
+    query, related, unrelated = np.array(provider.embed(
+        ['Who gave to the scholarship fund?', 'Smith gave 25,000 to the scholarship fund', 'The gala was in spring']))
+    assert query @ related > query @ unrelated
+
+
+def test_openai_embeddings_send_one_request_without_blank_inputs():
+    server = FakeOpenAIServer()
+    provider = OpenAIEmbeddingProvider(server.client())
+    assert provider.embed(['first', '  ', 'third']) == [[0.5] * 8] * 3
+    assert [(endpoint, body['input']) for endpoint, body in server.requests] == [('embeddings', ['first', ' ', 'third'])]
+    assert server.requests[0][1]['model'] == 'text-embedding-3-small'
+
+
+def test_provider_selection():
+    client_openai = FakeOpenAIServer().client()
+    assert isinstance(make_embedding_provider(client_openai, 'openai'), OpenAIEmbeddingProvider)
+    assert isinstance(make_embedding_provider(None, 'hashing'), HashingEmbeddingProvider)
+    with pytest.raises(ValueError):
+        make_embedding_provider(None, 'word2vec')
+    # A bare OpenAI client is wrapped, providers are passed through
+    assert as_provider(client_openai).client_openai is client_openai
+    hashing = HashingEmbeddingProvider()
+    assert as_provider(hashing) is hashing
@@ -0,0 +1,61 @@
+import os
+
+import extraction_cache
+from extraction_cache import ExtractionCache
+
+
+def test_sizes_follow_writes_and_replacements(tmp_path):
+    cache = ExtractionCache(str(tmp_path), 10 ** 6)
+    cache.put_page_image('a', 0, 72, b'x' * 100)
+    cache.put_extraction('a', 'v1', [], [1])
+    cache.put_extraction('a', 'v1', [], [])
+    assert cache._total == extraction_cache._dir_size(str(tmp_path / 'a'))
+    assert ExtractionCache(str(tmp_path), 10 ** 6)._total == cache._total
+
+
+def test_evicts_least_recently_used_without_walking_the_cache(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path), 250)
+    for key in ('a', 'b'):
+        cache.put_page_image(key, 0, 72, b'x' * 100)
+    cache.put_text('a', ['page'])
+    assert cache.get_text('a') == ['page']
+
+    def walk(path):
+        raise AssertionError('the cache was walked')
+
+    monkeypatch.setattr(extraction_cache, '_dir_size', walk)
+    cache.put_page_image('c', 0, 72, b'x' * 100)
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+    assert list(cache._sizes) == ['a', 'c']
+    assert cache._total <= 250
+
+
+def test_reopened_cache_keeps_the_lru_order(tmp_path):
+    cache = ExtractionCache(str(tmp_path), 10 ** 6)
+    for key in ('a', 'b'):
+        cache.put_page_image(key, 0, 72, b'x' * 100)
+    os.utime(tmp_path / 'a', (1, 1))
+    reopened = ExtractionCache(str(tmp_path), 150)
+    assert list(reopened._sizes) == ['a', 'b']
+    reopened.put_page_image('c', 0, 72, b'x' * 10)
+    assert sorted(os.listdir(tmp_path)) == ['b', 'c']
+
+
+def test_page_image_hits_refresh_the_lru_order(tmp_path):
+    cache = ExtractionCache(str(tmp_path), 250)
+    for key in ('a', 'b'):
+        cache.put_page_image(key, 0, 72, b'x' * 100)
+    assert cache.get_page_image('a', 0, 72) == b'x' * 100
+    cache.put_page_image('c', 0, 72, b'x' * 100)
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+
+
+def test_hit_on_an_entry_removed_outside_the_cache_does_not_fail(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path), 10 ** 6)
+    cache.put_text('a', ['page'])
+
+    def removed(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(extraction_cache.os, 'utime', removed)
+    assert cache.get_text('a') == ['page']
@@ -0,0 +1,59 @@
+import json
+
+from extraction_schema import find_objects, parse_answer, salvage_datasets
+
+GROUP_A = {'donor_names_group': ['Anonymous (2)'], 'amount_donated_by_group': ['1000', '4999'], 'gift_type': 'Annual'}
+GROUP_B = {'donor_names_group': ['Family Foundation'], 'amount_donated_by_group': ['5000', ''], 'gift_type': 'Annual'}
+
+
+def test_parse_answer_strips_code_fences():
+    answer = '```json\n' + json.dumps([{'data': [GROUP_A], 'page': '0'}]) + '\n```'
+    assert parse_answer(answer) == [{'data': [GROUP_A], 'page': '0'}]
+
+
+def test_parse_answer_reads_python_quoted_answers():
+    answer = "[{'data': [{'donor_names_group': ['Anonymous'], 'amount_donated_by_group': ['10', ''], " \
+             "'gift_type': 'Annual'}], 'page': '0'}]"
+    assert parse_answer(answer)[0]['data'][0]['donor_names_group'] == ['Anonymous']
+
+
+def test_parse_answer_rejects_truncated_answers():
+    assert parse_answer(json.dumps([{'data': [GROUP_A, GROUP_B], 'page': '0'}])[:-20]) is None
+
+
+def test_find_objects_skips_braces_in_strings_and_unclosed_objects():
+    text = '{"a": "}{"}, {"b": 1}, {"c": '
+    assert [obj for _, _, obj in find_objects(text)] == [{'a': '}{'}, {'b': 1}]
+
+
+def test_find_objects_inside_code_fence():
+    text = '```json\n' + json.dumps({'data': [GROUP_A]}) + '\n```'
+    assert [obj for _, _, obj in find_objects(text)] == [GROUP_A, {'data': [GROUP_A]}]
+
+
+def test_salvage_single_page_truncated_keeps_complete_groups():
+    text = json.dumps([{'data': [GROUP_A, GROUP_B], 'page': '3'}])[:-30]
+    datasets, remaining, partial_groups = salvage_datasets(text, [3])
+    assert datasets == []
+    assert remaining == [3]
+    assert partial_groups == [GROUP_A]
+
+
+def test_salvage_single_page_fenced_keeps_every_group():
+    text = '```json\n' + json.dumps([{'data': [GROUP_A, GROUP_B], 'page': '3'}]) + '\n``'
+    assert salvage_datasets(text, [3]) == ([], [3], [GROUP_A, GROUP_B])
+
+
+def test_salvage_multi_page_truncated_follows_up_after_last_complete_page():
+    complete = {'data': [GROUP_A], 'page': '4'}
+    text = json.dumps([complete, {'data': [GROUP_B, GROUP_A], 'page': '5'}])[:-30]
+    datasets, remaining, partial_groups = salvage_datasets(text, [4, 5, 6])
+    assert datasets == [complete]
+    assert remaining == [5, 6]
+    assert partial_groups == [GROUP_B]
+
+
+def test_salvage_multi_page_without_complete_dataset():
+    text = '[{"data": [' + json.dumps(GROUP_A) + ', {"donor_names_group": ["Cut'
+    datasets, remaining, partial_groups = salvage_datasets(text, [7, 8])
+    assert (datasets, remaining, partial_groups) == ([], [7, 8], [GROUP_A])
@@ -0,0 +1,69 @@
+import uuid
+
+import pytest
+
+from chat_doc_f import index_chunks, chunk_id
+from vector_store import NumpyVectorStore
+
+
+class CountingProvider:
+    name = 'counting'
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+@pytest.fixture(params=['numpy', 'chroma'])
+def client(request, tmp_path):
+    if request.param == 'chroma':
+        return pytest.importorskip('chromadb').EphemeralClient()
+    return NumpyVectorStore(str(tmp_path))
+
+
+def chunks(*pages):
+    return [{'text': text, 'page': page, 'bbox': (0, 0, 10, 10)} for page, texts in enumerate(pages) for text in texts]
+
+
+def test_reindexing_only_embeds_changed_chunks_and_deletes_stale_rows(client):
+    col_name = f'index-{uuid.uuid4().hex}'
+    provider = CountingProvider()
+    first = chunks(['intro', 'donors'], ['programs'])
+    stats = {}
+    embeddings = index_chunks(client, provider, first, col_name, stats=stats)
+    assert stats == {'added': 3, 'skipped': 0, 'deleted': 0}
+    assert embeddings == [[5.0, 1.0], [6.0, 1.0], [8.0, 1.0]]
+
+    # Same bytes again: nothing is embedded or written
+    provider.embedded.clear()
+    assert index_chunks(client, provider, first, col_name, stats=stats) == embeddings
+    assert (provider.embedded, stats) == ([], {'added': 0, 'skipped': 3, 'deleted': 0})
+
+    # A revision changes one chunk and drops the last page
+    revised = chunks(['intro', 'donors and sponsors'])
+    embeddings = index_chunks(client, provider, revised, col_name, stats=stats)
+    assert provider.embedded == ['donors and sponsors']
+    assert stats == {'added': 1, 'skipped': 1, 'deleted': 2}
+    assert embeddings == [[5.0, 1.0], [19.0, 1.0]]
+    rows = client.get_or_create_collection(col_name).get()
+    assert sorted(rows['ids']) == sorted([chunk_id('intro', 0, 0), chunk_id('donors and sponsors', 0, 1)])
+
+
+def test_precomputed_embeddings_are_not_requested_again(client):
+    col_name = f'index-{uuid.uuid4().hex}'
+    provider = CountingProvider()
+    stored = index_chunks(client, provider, chunks(['intro'], ['programs']), col_name)
+    provider.embedded.clear()
+    # A document cache hit restores a deleted collection from its cached embeddings
+    client.delete_collection(col_name)
+    assert index_chunks(client, provider, chunks(['intro'], ['programs']), col_name, embeddings_list=stored) == stored
+    assert provider.embedded == []
+    assert client.get_or_create_collection(col_name).count() == 2
+
+
+def test_chunk_ids_depend_on_content_and_position():
+    assert chunk_id('intro', 0) == chunk_id('intro', 0, 0)
+    assert len({chunk_id('intro', 0, 0), chunk_id('intro', 1, 0), chunk_id('intro', 0, 1), chunk_id('other', 0, 0)}) == 4
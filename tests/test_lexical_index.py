@@ -0,0 +1,85 @@
+from lexical_index import LexicalIndex, is_confident, reciprocal_rank_fusion
+from chat_doc_f import retrieve_chunk
+
+TEXTS = [
+    'Annual report of the foundation and its programs',
+    'John and Mary Smith gave 25,000 to the scholarship fund',
+    'Acme Corporation sponsored the spring gala',
+    'The programs reached 4,000 students this year',
+]
+
+
+def make_index(texts=TEXTS):
+    return LexicalIndex([f'chunk-{i}' for i in range(len(texts))], texts, [{'page': i} for i in range(len(texts))])
+
+
+class FakeClient:
+    """
+    Vector store whose only collection returns a fixed ranking.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def get_or_create_collection(self, name):
+        return self
+
+    def query(self, query_embeddings, n_results):
+        ids = self.ids[:n_results]
+        return {
+            'ids': [ids],
+            'documents': [[TEXTS[int(row_id.split('-')[1])] for row_id in ids]],
+            'metadatas': [[{'page': int(row_id.split('-')[1])} for row_id in ids]],
+            'distances': [[0.1 * rank for rank in range(len(ids))]],
+        }
+
+
+class NoVectorSearch:
+    def get_or_create_collection(self, name):
+        raise AssertionError('the vector store was queried')
+
+
+def test_exact_multi_term_match_skips_the_vector_search():
+    hits = make_index().search('What did John Smith give?', 5)
+    assert hits[0]['id'] == 'chunk-1' and hits[0]['matched'] == 2
+    assert is_confident(hits)
+    results = retrieve_chunk(NoVectorSearch(), None, 'col', 'What did John Smith give?', k=2, lexical_hits=hits)
+    assert results['ids'][0][0] == 'chunk-1'
+
+
+def test_single_term_hit_is_not_confident_even_without_a_runner_up():
+    hits = make_index().search('Who sponsored anything?', 5)
+    assert [hit['id'] for hit in hits] == ['chunk-2']
+    assert not is_confident(hits)
+
+
+def test_page_reference_is_confident():
+    hits = make_index().search('Summarize page 4', 5)
+    assert [hit['id'] for hit in hits] == ['chunk-3']
+    assert is_confident(hits)
+
+
+def test_scores_are_comparable_across_indexes():
+    small = make_index()
+    large = make_index(TEXTS + [f'Donor {i} gave to the fund' for i in range(50)])
+    for index in (small, large):
+        hits = index.search('John Smith', 5)
+        assert 0 < hits[0]['score'] <= 1
+    assert abs(small.search('John Smith', 1)[0]['score'] - large.search('John Smith', 1)[0]['score']) < 0.2
+
+
+def test_reciprocal_rank_fusion_favors_ids_ranked_by_both():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['c', 'a']], k=60)
+    assert sorted(fused, key=fused.get, reverse=True) == ['a', 'c', 'b']
+    assert fused['a'] == 1 / 61 + 1 / 62
+
+
+def test_retrieve_chunk_merges_vector_and_lexical_rankings():
+    hits = make_index().search('programs', 5)
+    assert not is_confident(hits)
+    results = retrieve_chunk(FakeClient(['chunk-2', 'chunk-3', 'chunk-1']), None, 'col', 'programs', k=3,
+                             query_embedding=[0.0], lexical_hits=hits)
+    # chunk-3 is second for vectors and among the lexical hits, chunk-2 is only first for vectors
+    assert results['ids'][0][0] == 'chunk-3'
+    assert set(results['ids'][0]) == {'chunk-0', 'chunk-2', 'chunk-3'}
+    assert results['scores'][0] == sorted(results['scores'][0], reverse=True)
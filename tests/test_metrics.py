@@ -0,0 +1,84 @@
+import json
+import logging
+import threading
+
+import openai
+import pytest
+
+from conftest import FakeOpenAIServer, ANSWER
+from metrics import (Histogram, JsonFormatter, MeteredTransport, OPENAI_BYTES, OPENAI_SECONDS, OPENAI_TOKENS,
+                     STAGE_SECONDS, httpx, render_metrics, run_in_context, span, stage_breakdown, start_request)
+
+
+def count(histogram, *labels):
+    return histogram._series.get(labels, {}).get('count', 0)
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('test_seconds', 'Test latency.', ('stage',), buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 20):
+        histogram.observe(value, 'extract')
+    histogram.observe(2, 'index')
+    lines = histogram.render().split('\n')
+    assert lines[:2] == ['# HELP test_seconds Test latency.', '# TYPE test_seconds histogram']
+    # A value equal to a bound falls in that bucket; values past the last one only in +Inf
+    assert lines[2:8] == [
+        'test_seconds_bucket{stage="extract",le="0.1"} 2',
+        'test_seconds_bucket{stage="extract",le="1"} 3',
+        'test_seconds_bucket{stage="extract",le="10"} 3',
+        'test_seconds_bucket{stage="extract",le="+Inf"} 4',
+        'test_seconds_sum{stage="extract"} 20.65',
+        'test_seconds_count{stage="extract"} 4',
+    ]
+    assert 'test_seconds_bucket{stage="index",le="10"} 1' in lines
+
+
+def test_spans_are_timed_per_request_and_across_threads():
+    before = count(STAGE_SECONDS, 'test_stage')
+    start_request('req-1')
+    with span('test_stage', pages=3) as fields:
+        fields['chunks'] = 5
+    with pytest.raises(ValueError), span('test_stage'):
+        raise ValueError('failed stage')
+
+    def worker():
+        with span('test_stage'):
+            pass
+
+    thread = threading.Thread(target=run_in_context(worker))
+    thread.start()
+    thread.join()
+    assert [entry['stage'] for entry in stage_breakdown()] == ['test_stage'] * 3
+    assert count(STAGE_SECONDS, 'test_stage') == before + 3
+    assert 'pdfqa_stage_seconds_count{stage="test_stage"}' in render_metrics()
+
+
+def test_log_lines_carry_the_request_id_and_fields():
+    start_request('req-2')
+    record = logging.LogRecord('chatdoc', logging.INFO, __file__, 1, 'span', None, None)
+    record.fields = {'stage': 'extract', 'seconds': 0.5}
+    entry = json.loads(JsonFormatter().format(record))
+    assert (entry['request_id'], entry['message'], entry['stage'], entry['seconds']) == ('req-2', 'span', 'extract', 0.5)
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_metered_transport_records_openai_calls(monkeypatch, stream):
+    server = FakeOpenAIServer()
+    monkeypatch.setattr(httpx.HTTPTransport, 'handle_request', lambda self, request: server(request))
+    client = openai.OpenAI(api_key='sk-test', max_retries=0, http_client=httpx.Client(transport=MeteredTransport()))
+    labels = ('chat/completions', 'gpt-4o')
+    before = (count(OPENAI_SECONDS, *labels, '200'), count(OPENAI_TOKENS, *labels, 'prompt'),
+              count(OPENAI_TOKENS, *labels, 'completion'), count(OPENAI_BYTES, 'chat/completions', 'received'))
+
+    response = client.chat.completions.create(model='gpt-4o', messages=[{'role': 'user', 'content': 'Who gave?'}],
+                                              stream=stream, **({'stream_options': {'include_usage': True}} if stream else {}))
+    if stream:
+        assert ''.join(chunk.choices[0].delta.content for chunk in response if chunk.choices) == ANSWER
+    else:
+        assert response.choices[0].message.content == ANSWER
+
+    # Recorded once the body has been read, with the usage of the last streamed chunk
+    after = (count(OPENAI_SECONDS, *labels, '200'), count(OPENAI_TOKENS, *labels, 'prompt'),
+             count(OPENAI_TOKENS, *labels, 'completion'), count(OPENAI_BYTES, 'chat/completions', 'received'))
+    assert [b - a for a, b in zip(before, after)] == [1, 1, 1, 1]
+    assert OPENAI_TOKENS._series[(*labels, 'prompt')]['sum'] >= 10
@@ -0,0 +1,90 @@
+import time
+import threading
+
+from openai_scheduler import (TokenBucket, OpenAIScheduler, ScheduledTransport, httpx,
+                              PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(60)
+    now = bucket._updated
+    bucket.take(60, now)
+    assert bucket.wait_time(1, now) == 1.0
+    assert abs(bucket.wait_time(1, now + 0.5) - 0.5) < 1e-9
+    assert bucket.wait_time(1, now + 1) == 0.0
+    bucket.wait_time(1, now + 600)
+    assert bucket.level == 60
+
+
+def test_token_bucket_follows_server_headers():
+    bucket = TokenBucket(600)
+    now = bucket._updated
+    bucket.sync(60, 5, now)
+    assert (bucket.capacity, bucket.level) == (60, 5)
+    disabled = TokenBucket(0)
+    assert disabled.wait_time(10 ** 9, now) == 0.0
+    disabled.sync(60, 30, now)
+    assert (disabled.capacity, disabled.level) == (60, 30)
+
+
+def test_acquire_serves_interactive_before_bulk():
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, max_concurrency=1)
+    scheduler.acquire(1, PRIORITY_BULK)
+    order = []
+
+    def request(level):
+        scheduler.acquire(1, level)
+        order.append(level)
+        scheduler.release()
+
+    threads = [threading.Thread(target=request, args=(level,)) for level in (PRIORITY_BULK, PRIORITY_INTERACTIVE)]
+    for thread in threads:
+        thread.start()
+        # Queue the bulk request first
+        while scheduler.stats()['waiting'] < threads.index(thread) + 1:
+            time.sleep(0.001)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BULK]
+
+
+def test_rate_limits_halve_concurrency_and_recover():
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, max_concurrency=16)
+    for expected in (8, 4, 2, 1, 1):
+        scheduler.acquire(1)
+        scheduler.release({'retry-after-ms': '1'}, 429)
+        assert scheduler.stats()['concurrency'] == expected
+    assert scheduler.stats()['rate_limited'] == 5
+
+    plenty = {'x-ratelimit-limit-requests': '100000', 'x-ratelimit-remaining-requests': '90000'}
+    for _ in range(200):
+        scheduler.acquire(1)
+        scheduler.release(plenty, 200)
+    assert scheduler.stats()['concurrency'] == 16
+
+    scarce = {'x-ratelimit-limit-requests': '100000', 'x-ratelimit-remaining-requests': '5000'}
+    scheduler.acquire(1)
+    scheduler.release(scarce, 200)
+    assert scheduler.stats()['concurrency'] == 12
+
+
+def test_rate_limit_pauses_every_request_for_retry_after():
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, max_concurrency=4)
+    scheduler.acquire(1)
+    scheduler.release({'retry-after-ms': '200'}, 429)
+    assert scheduler.acquire(1, PRIORITY_INTERACTIVE) >= 0.15
+
+
+def test_transport_retries_rate_limited_requests():
+    statuses = [429, 429, 200]
+
+    def handler(request):
+        return httpx.Response(statuses.pop(0), headers={'retry-after-ms': '1'}, json={})
+
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, retry_base=0.001)
+    client = httpx.Client(transport=ScheduledTransport(httpx.MockTransport(handler), scheduler))
+    response = client.post('http://api.test/v1/embeddings', json={'input': ['text']})
+    assert response.status_code == 200
+    assert scheduler.stats()['retries'] == 2
+    assert scheduler.stats()['rate_limited'] == 2
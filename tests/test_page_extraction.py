@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+
+import pymupdf
+
+import page_extraction
+from page_extraction import iter_pages, extract_pages
+
+SCRIPT = """
+import sys
+sys.path.insert(0, {common!r})
+print('script imported', flush=True)
+from page_extraction import extract_pages
+
+if __name__ == '__main__':
+    text_list, _ = extract_pages({pdf!r}, images=False, workers=2)
+    print(len(text_list), text_list[0].strip(), text_list[-1].strip())
+"""
+
+
+def make_pdf(path, page_count):
+    pdf_document = pymupdf.open()
+    for page_num in range(page_count):
+        pdf_document.new_page().insert_text((72, 72), f'Page {page_num}')
+    pdf_document.save(path)
+    pdf_document.close()
+
+
+def test_pool_returns_pages_in_order(tmp_path):
+    path = str(tmp_path / 'long.pdf')
+    make_pdf(path, page_extraction.PARALLEL_MIN_PAGES + 3)
+    pages = list(iter_pages(path, images=False, workers=2))
+    assert [page['page'] for page in pages] == list(range(page_extraction.PARALLEL_MIN_PAGES + 3))
+    assert pages[-1]['text'].strip() == f'Page {page_extraction.PARALLEL_MIN_PAGES + 2}'
+    assert extract_pages(path, images=False, workers=1)[0] == [page['text'] for page in pages]
+
+
+def test_pool_workers_do_not_import_the_script(tmp_path):
+    pdf_path = str(tmp_path / 'long.pdf')
+    make_pdf(pdf_path, page_extraction.PARALLEL_MIN_PAGES)
+    script_path = tmp_path / 'script.py'
+    script_path.write_text(SCRIPT.format(common=os.path.dirname(page_extraction.__file__), pdf=pdf_path))
+    output = subprocess.run([sys.executable, str(script_path)], capture_output=True, text=True, timeout=60,
+                            check=True).stdout
+    assert output.count('script imported') == 1
+    assert f'{page_extraction.PARALLEL_MIN_PAGES} Page 0 Page {page_extraction.PARALLEL_MIN_PAGES - 1}' in output
@@ -0,0 +1,26 @@
+from page_filter import score_page, candidate_pages, skipped_pages
+
+DONOR_PAGE = 'Honor Roll of Donors\n$1,000 - $4,999\nJane Smith\nJohn Q. Public\n$500 to $999\nMr. and Mrs. Lee'
+CAPS_CONTINUATION = 'JOHN AND MARY SMITH\nACME CORPORATION\nTHE WILSON FAMILY FOUNDATION\nROBERT JONES'
+PROSE = 'our programs reached more students this year than ever before, thanks to the volunteers.'
+
+
+def test_upper_case_names_count_as_names():
+    assert score_page(CAPS_CONTINUATION)['score'] >= 2.0
+
+
+def test_prose_scores_low():
+    assert score_page(PROSE)['score'] < 2.0
+
+
+def test_neighbours_of_candidate_pages_are_kept():
+    scores = [{'score': 0.0}, {'score': 5.0}, {'score': 0.0}, {'score': 0.0}]
+    assert candidate_pages(scores, threshold=2.0, neighbors=1) == [0, 1, 2]
+    assert candidate_pages(scores, threshold=2.0, neighbors=0) == [1]
+    assert candidate_pages(scores, threshold=2.0, pages=[2, 3], neighbors=1) == [2]
+
+
+def test_skipped_pages_lists_pages_with_text_not_sent():
+    text_list = [DONOR_PAGE, PROSE, '  ', PROSE, PROSE]
+    assert skipped_pages(text_list, [0, 1]) == [3, 4]
+    assert skipped_pages(text_list, [0, 1], pages=[3]) == [3]
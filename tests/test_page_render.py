@@ -0,0 +1,80 @@
+import os
+
+import pymupdf
+import pytest
+
+import page_render
+from page_render import RenderCache, render_page, CLIP_MARGIN
+
+MAGIC = {'jpeg': b'\xff\xd8\xff', 'png': b'\x89PNG'}
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = str(tmp_path / 'doc.pdf')
+    with pymupdf.open() as pdf_document:
+        for _ in range(2):
+            pdf_document.new_page(width=600, height=800).insert_text((72, 72), 'Donor list')
+        pdf_document.save(path)
+    return path
+
+
+def size(image_bytes):
+    pix = pymupdf.Pixmap(image_bytes)
+    return pix.width, pix.height
+
+
+@pytest.mark.parametrize('image_format', ['jpeg', 'png'])
+def test_formats(pdf_path, image_format):
+    image_bytes = render_page(pdf_path, 0, dpi=72, image_format=image_format)
+    assert image_bytes.startswith(MAGIC[image_format])
+    assert size(image_bytes) == (600, 800)
+
+
+def test_webp_needs_pillow(pdf_path):
+    pytest.importorskip('PIL')
+    image_bytes = render_page(pdf_path, 0, dpi=72, image_format='webp')
+    assert image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP'
+
+
+def test_unsupported_format_is_rejected(pdf_path, tmp_path):
+    with pytest.raises(ValueError):
+        render_page(pdf_path, 0, image_format='gif')
+    with pytest.raises(ValueError):
+        RenderCache(str(tmp_path / 'renders'), image_format='gif')
+
+
+def test_clip_renders_the_region_with_a_margin_inside_the_page(pdf_path):
+    assert size(render_page(pdf_path, 0, dpi=72, image_format='png', clip=(100, 100, 200, 150))) == \
+        (100 + 2 * CLIP_MARGIN, 50 + 2 * CLIP_MARGIN)
+    # The margin never extends past the page
+    assert size(render_page(pdf_path, 0, dpi=72, image_format='png', clip=(0, 0, 50, 50))) == \
+        (50 + CLIP_MARGIN, 50 + CLIP_MARGIN)
+    assert size(render_page(pdf_path, 0, dpi=144, image_format='png', clip=(100, 100, 200, 150))) == \
+        (2 * (100 + 2 * CLIP_MARGIN), 2 * (50 + 2 * CLIP_MARGIN))
+
+
+def test_pages_are_rendered_once_and_evicted_by_size(pdf_path, tmp_path, monkeypatch):
+    rendered = []
+    render = page_render.render_page
+
+    def counting_render(*args):
+        rendered.append(args[1:2] + args[-1:])
+        return render(*args)
+
+    monkeypatch.setattr(page_render, 'render_page', counting_render)
+    root = str(tmp_path / 'renders')
+    cache = RenderCache(root, dpi=72, image_format='png')
+    page = cache.get_page_image(pdf_path, 'doc', 0)
+    crop = cache.get_page_image(pdf_path, 'doc', 0, clip=(100, 100, 200, 150))
+    assert cache.get_page_image(pdf_path, 'doc', 0) == page and page != crop
+    assert rendered == [(0, None), (0, (100, 100, 200, 150))]
+
+    # Room for two pages (both hold the same text): the least recently used crop goes
+    cache.max_bytes = 2 * os.path.getsize(page) + 100
+    assert cache.get_page_image(pdf_path, 'doc', 0) == page
+    other = cache.get_page_image(pdf_path, 'doc', 1)
+    assert sorted(os.listdir(root)) == sorted(os.path.basename(path) for path in (page, other))
+
+    cache.drop('doc')
+    assert os.listdir(root) == []
@@ -0,0 +1,93 @@
+import re
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+pytest.importorskip('streamlit')
+import pdf_processing
+from extraction_cache import ExtractionCache
+from pdf_processing import page_windows, extract_donations, process_pdf_with_gpt, retry_failed_pages
+
+PAGES = [f'Donor list {i}: Smith Family $1,000 - $4,999 Annual' for i in range(10)]
+
+
+class FakeChat:
+    """
+    Chat client answering each extraction request with one group per page it names,
+    after a random delay, and failing the pages in failing_pages.
+    """
+
+    def __init__(self, failing_pages=()):
+        self.failing_pages = set(failing_pages)
+        self.windows = []
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        window = [int(page) for page in re.findall(r'^page (\d+):', messages[0]['content'], re.MULTILINE)]
+        with self._lock:
+            self.windows.append(window)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(random.uniform(0, 0.01))
+            if self.failing_pages & set(window):
+                raise openai.OpenAIError('server error')
+            answer = [{'data': [{'donor_names_group': [f'Donor {page}'], 'amount_donated_by_group': ['1000', '4999'],
+                                 'gift_type': 'Annual'}], 'page': str(page)} for page in window]
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(answer)),
+                                                            finish_reason='stop')])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_processing, 'extraction_cache', ExtractionCache(str(tmp_path / 'cache'), 10 ** 7))
+    monkeypatch.setattr(pdf_processing, 'RETRY_BACKOFF', 0)
+
+
+def test_page_windows_group_consecutive_pages():
+    text_list = ['a', 'b', '', 'c', 'd', 'e', 'f']
+    assert page_windows(text_list, 2) == [[0, 1], [3, 4], [5, 6]]
+    assert page_windows(text_list, 3, pages=[6, 0, 4, 5]) == [[0], [4, 5, 6]]
+
+
+def test_windows_run_concurrently_and_results_keep_page_order():
+    client = FakeChat()
+    datasets, failed = extract_donations(client, PAGES, pages_per_window=3, max_workers=2, threshold=0)
+    assert failed == []
+    assert [dataset['page'] for dataset in datasets] == [str(page) for page in range(10)]
+    assert sorted(client.windows) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    assert client.max_in_flight <= 2
+
+
+def test_failed_window_is_reported_and_retried_alone():
+    client = FakeChat(failing_pages={4})
+    datasets, failed = extract_donations(client, PAGES, pages_per_window=2, max_workers=4, threshold=0)
+    assert failed == [4, 5]
+    assert [dataset['page'] for dataset in datasets] == ['0', '1', '2', '3', '6', '7', '8', '9']
+    assert client.windows.count([4, 5]) == 1 + pdf_processing.EXTRACTION_RETRIES
+    assert all(client.windows.count(window) == 1 for window in ([0, 1], [2, 3], [6, 7], [8, 9]))
+
+
+def test_results_are_cached_and_only_failed_pages_are_retried():
+    client = FakeChat(failing_pages={4})
+    datasets, failed = process_pdf_with_gpt(client, 'doc', PAGES)
+    assert 4 in failed and '4' not in [dataset['page'] for dataset in datasets]
+    requests = len(client.windows)
+    assert process_pdf_with_gpt(client, 'doc', PAGES) == (datasets, failed)
+    assert len(client.windows) == requests
+
+    client.failing_pages.clear()
+    datasets, failed = retry_failed_pages(client, 'doc', PAGES)
+    assert failed == [] and [dataset['page'] for dataset in datasets] == [str(page) for page in range(10)]
+    assert all(4 in window for window in client.windows[requests:])
+    assert process_pdf_with_gpt(client, 'doc', PAGES) == (datasets, [])
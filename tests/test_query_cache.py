@@ -0,0 +1,52 @@
+import pytest
+
+import query_cache
+from query_cache import TTLCache, normalize_query
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    clock[0] += 60
+    assert cache.get('a') == 1
+    clock[0] += 0.5
+    assert cache.get('a', 'expired') == 'expired'
+    assert cache.stats() == {'entries': 0, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_setting_an_entry_again_restarts_its_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    clock[0] += 50
+    cache.set('a', 2)
+    clock[0] += 50
+    assert cache.get('a') == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_invalidate_drops_matching_keys(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    for key in [('doc1', 'q1'), ('doc1', 'q2'), ('doc2', 'q1')]:
+        cache.set(key, 'answer')
+    assert cache.invalidate(lambda key: key[0] == 'doc1') == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_normalize_query_ignores_case_spacing_and_punctuation():
+    assert normalize_query('  Who gave   the most? ') == normalize_query('who gave the most') == 'who gave the most'
@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.fixture
+def retrieved_k(backend, monkeypatch):
+    calls = []
+    retrieve = backend.retrieve_from_documents
+
+    def record(client_cdb, embedder, selected, query, k):
+        calls.append(k)
+        return retrieve(client_cdb, embedder, selected, query, k)
+
+    monkeypatch.setattr(backend, 'retrieve_from_documents', record)
+    monkeypatch.setattr(backend, 'QUERY_MAX_K', 5)
+    return calls
+
+
+@pytest.mark.parametrize('k, expected', [(None, 3), (2, 2), ('4', 4), (0, 1), (-3, 1), (100, 5)])
+def test_k_is_clamped(backend, upload, report_pdf, retrieved_k, k, expected):
+    assert upload(report_pdf, doc_id='ranked')['status'] == 'done'
+    question = {'query': f'Who gave to the scholarship fund? {k}', 'doc_id': 'ranked'}
+    if k is not None:
+        question['k'] = k
+    assert backend.app.test_client().post('/query', json=question).status_code == 200
+    assert retrieved_k == [expected]
+
+
+@pytest.mark.parametrize('k', ['three', '2.5', [3], {'k': 3}])
+def test_k_must_be_an_integer(backend, upload, report_pdf, retrieved_k, k):
+    assert upload(report_pdf, doc_id='ranked')['status'] == 'done'
+    response = backend.app.test_client().post('/query', json={'query': 'Who gave?', 'doc_id': 'ranked', 'k': k})
+    assert (response.status_code, response.data) == (400, b'k must be an integer')
+    assert retrieved_k == []
@@ -0,0 +1,34 @@
+from conftest import ANSWER
+
+
+def answer_requests(server):
+    # Summaries are requested from another model
+    return [body for endpoint, body in server.requests if endpoint == 'completions' and body['model'] == 'gpt-4o']
+
+
+def test_streamed_answer_arrives_in_fragments_and_is_cached(backend, openai_server, upload, report_pdf):
+    assert upload(report_pdf, doc_id='streamed')['status'] == 'done'
+    client = backend.app.test_client()
+    question = {'query': 'What did the programs achieve?', 'doc_id': 'streamed', 'stream': True}
+
+    response = client.post('/query', json=question, buffered=False)
+    assert response.status_code == 200 and response.is_streamed
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    fragments = [fragment.decode() for fragment in response.response if fragment]
+    assert len(fragments) == len(ANSWER.split(' ')) and ''.join(fragments) == ANSWER
+    chat_requests = answer_requests(openai_server)
+    assert len(chat_requests) == 1
+    assert chat_requests[0]['stream'] and chat_requests[0]['stream_options'] == {'include_usage': True}
+
+    # The complete streamed answer is cached, and served without another model call
+    response = client.post('/query', json=dict(question, stream=False))
+    assert response.data.decode() == ANSWER
+    assert len(answer_requests(openai_server)) == 1
+
+
+def test_unstreamed_answer(backend, openai_server, upload, report_pdf):
+    assert upload(report_pdf, doc_id='unstreamed')['status'] == 'done'
+    response = backend.app.test_client().post('/query', json={'query': 'Who gave to the fund?', 'doc_id': 'unstreamed'})
+    assert response.status_code == 200 and 'X-Accel-Buffering' not in response.headers
+    assert response.data.decode() == ANSWER
+    assert [body.get('stream') for body in answer_requests(openai_server)] == [False]
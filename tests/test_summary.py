@@ -0,0 +1,88 @@
+import re
+import threading
+import uuid
+from types import SimpleNamespace
+
+import pymupdf
+
+import chat_doc_f
+from chat_doc_f import generate_summary
+from conftest import ANSWER
+
+
+class FakeSummaries:
+    """
+    Chat client that summarizes a prompt as the page labels it contains, padded to
+    most of the requested length.
+    """
+
+    def __init__(self):
+        self.prompts = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        content = messages[0]['content']
+        with self._lock:
+            self.prompts.append(content)
+        labels = re.findall(r'^Pages? [\d-]+', content, re.MULTILINE)
+        summary = 'summary of ' + ', '.join(labels) + '\n' + '.' * (kwargs['max_tokens'] * 3)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=summary))])
+
+
+def test_short_document_costs_one_request():
+    client = FakeSummaries()
+    assert generate_summary(client, ['Annual report', '', 'Donor list']).startswith('summary of Page 1, Page 3\n')
+    assert len(client.prompts) == 1
+    assert generate_summary(client, ['', '  ']) == ''
+    assert len(client.prompts) == 1
+
+
+def test_every_page_of_a_long_document_is_summarized():
+    client = FakeSummaries()
+    pages = [f'Page text {i} ' * 200 for i in range(30)]
+    progress = []
+    summary = generate_summary(client, pages, window_tokens=chat_doc_f.SUMMARY_PART_TOKENS * 4, max_workers=3,
+                               progress=progress.append)
+    first_level = [prompt for prompt in client.prompts if re.search(r'^Page \d+:', prompt, re.MULTILINE)]
+    summarized = sorted(int(page) for prompt in first_level for page in re.findall(r'^Page (\d+):', prompt, re.MULTILINE))
+    assert summarized == list(range(1, 31))
+    # Partial summaries keep the page ranges they cover, and are combined level by level
+    deeper = [prompt for prompt in client.prompts[len(first_level):] if 'Pages 1-' in prompt]
+    assert len(deeper) >= 2
+    assert re.match(r'summary of Pages 1-\d+, .*Pages \d+-30\n', summary)
+    assert progress[-1] == 1.0 and progress == sorted(progress)
+
+
+def test_summary_endpoint_generates_caches_and_retries(backend, openai_server, upload, tmp_path, monkeypatch):
+    path = str(tmp_path / 'summary.pdf')
+    with pymupdf.open() as pdf_document:
+        pdf_document.new_page().insert_text((72, 72), f'Report {uuid.uuid4().hex}')
+        pdf_document.save(path)
+    client = backend.app.test_client()
+    failures = []
+
+    def failing_summary(*args, **kwargs):
+        failures.append(1)
+        raise RuntimeError('model unavailable')
+
+    monkeypatch.setattr(backend, 'generate_summary', failing_summary)
+    doc_id = upload(path)['result']['doc_id']
+    response = client.get(f'/documents/{doc_id}/summary')
+    assert response.status_code == 202
+    assert (response.json['status'], response.json['error']) == ('failed', 'model unavailable')
+    # A failed summary is only started again when asked to
+    assert client.get(f'/documents/{doc_id}/summary').status_code == 202 and len(failures) == 1
+
+    monkeypatch.undo()
+    monkeypatch.setattr(backend, 'get_openai_client', openai_server.client)
+    for _ in range(500):
+        response = client.get(f'/documents/{doc_id}/summary?retry=1')
+        if response.status_code == 200:
+            break
+        threading.Event().wait(0.01)
+    assert response.json == {'doc_id': doc_id, 'status': 'done', 'summary': ANSWER}
+    requests = len(openai_server.requests)
+    assert client.get(f'/documents/{doc_id}/summary').json['summary'] == ANSWER
+    assert len(openai_server.requests) == requests
+    assert client.get('/documents/unknown/summary').status_code == 404
@@ -0,0 +1,56 @@
+import io
+import uuid
+import threading
+
+import pymupdf
+
+
+def unique_pdf(tmp_path, pages=3):
+    # Content the document cache has not seen in this session
+    path = str(tmp_path / f'{uuid.uuid4().hex}.pdf')
+    marker = uuid.uuid4().hex
+    with pymupdf.open() as pdf_document:
+        for i in range(pages):
+            pdf_document.new_page().insert_text((72, 72), f'Page {i + 1} of report {marker}')
+        pdf_document.save(path)
+    return path
+
+
+def test_upload_job_reports_each_stage(backend, upload, tmp_path):
+    path = unique_pdf(tmp_path)
+    job = upload(path)
+    assert job['status'] == 'done' and job['error'] is None
+    for name in ('extract', 'index'):
+        assert job['stages'][name]['status'] == 'done'
+        assert job['stages'][name]['progress'] == 1.0 and job['stages'][name]['seconds'] >= 0
+    doc_id = job['result']['doc_id']
+    assert job['result']['summary_url'] == f'/documents/{doc_id}/summary'
+    assert backend.documents.get(doc_id)['filename'] == path.rsplit('/', 1)[-1]
+
+    # The same bytes again are served from the document cache
+    again = upload(path, doc_id='again')
+    assert again['stages']['extract']['status'] == 'skipped'
+    assert again['stages']['index']['status'] == 'done'
+
+
+def test_failed_upload_reports_the_failing_stage(backend, openai_server):
+    client = backend.app.test_client()
+    response = client.post('/upload', data={'file': (io.BytesIO(b'not a pdf'), 'notes.pdf')})
+    assert response.status_code == 202
+    for _ in range(500):
+        job = client.get(response.json['status_url']).json
+        if job['status'] in ('done', 'failed'):
+            break
+        threading.Event().wait(0.01)
+    assert job['status'] == 'failed' and job['error']
+    assert job['stages']['extract']['status'] == 'failed'
+    assert job['stages']['index']['status'] == 'pending'
+
+
+def test_upload_and_job_errors(backend):
+    client = backend.app.test_client()
+    assert client.post('/upload', data={}).status_code == 400
+    assert client.post('/upload', data={'file': (io.BytesIO(b''), '')}).status_code == 400
+    response = client.post('/upload', data={'file': (io.BytesIO(b'%PDF'), 'a.pdf'), 'doc_id': '../etc'})
+    assert response.status_code == 400
+    assert client.get('/jobs/unknown').status_code == 404
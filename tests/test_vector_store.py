@@ -0,0 +1,81 @@
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+import vector_store
+from vector_store import NumpyVectorStore
+
+chromadb = pytest.importorskip('chromadb')
+
+DIM = 8
+
+
+def assert_same_results(collection, reference, queries):
+    assert collection.count() == reference.count()
+    expected = reference.query(query_embeddings=queries, n_results=5, include=['documents', 'distances'])
+    actual = collection.query(query_embeddings=queries, n_results=5, include=['documents', 'distances'])
+    assert actual['ids'] == expected['ids']
+    assert actual['documents'] == expected['documents']
+    np.testing.assert_allclose(actual['distances'], expected['distances'], rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('memory_map', [True, False])
+def test_results_match_chroma(tmp_path, monkeypatch, memory_map):
+    monkeypatch.setattr(vector_store, 'MEMORY_MAP', memory_map)
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((3, DIM)).astype(np.float32).tolist()
+    reference = chromadb.EphemeralClient().get_or_create_collection(f'parity-{uuid.uuid4().hex}')
+    collection = NumpyVectorStore(str(tmp_path)).get_or_create_collection('parity')
+
+    def apply(method, **kwargs):
+        getattr(reference, method)(**kwargs)
+        getattr(collection, method)(**kwargs)
+
+    ids = [f'chunk-{i}' for i in range(20)]
+    apply('upsert', ids=ids, embeddings=rng.standard_normal((20, DIM)).astype(np.float32).tolist(),
+          documents=[f'text {i}' for i in range(20)])
+    assert_same_results(collection, reference, queries)
+
+    # Overwrites rewrite the matrix, new IDs are appended to it
+    apply('upsert', ids=ids[:5] + ['chunk-20'], embeddings=rng.standard_normal((6, DIM)).astype(np.float32).tolist(),
+          documents=[f'new text {i}' for i in range(6)])
+    assert_same_results(collection, reference, queries)
+
+    apply('delete', ids=['chunk-3', 'chunk-7', 'chunk-11'])
+    assert_same_results(collection, reference, queries)
+
+    reopened = NumpyVectorStore(str(tmp_path)).get_or_create_collection('parity')
+    assert_same_results(reopened, reference, queries)
+
+
+@pytest.mark.parametrize('failing_call', [0, 1, 2])
+def test_interrupted_rewrite_keeps_the_previous_rows(tmp_path, monkeypatch, failing_call):
+    collection = NumpyVectorStore(str(tmp_path)).get_or_create_collection('atomic')
+    collection.upsert(ids=['a', 'b'], embeddings=[[1.0, 0.0], [0.0, 1.0]], documents=['first', 'second'])
+    replace, calls = os.replace, []
+
+    def crash(src, dst):
+        calls.append(dst)
+        if len(calls) - 1 == failing_call:
+            raise OSError('disk full')
+        replace(src, dst)
+
+    monkeypatch.setattr(vector_store.os, 'replace', crash)
+    try:
+        collection.upsert(ids=['a'], embeddings=[[5.0, 5.0]], documents=['changed'])
+    except OSError:
+        pass
+    monkeypatch.undo()
+
+    # Whichever step fails, the collection holds either every old row or every new one
+    reopened = NumpyVectorStore(str(tmp_path)).get_or_create_collection('atomic')
+    for current in (collection, reopened):
+        documents = current.get(ids=['a', 'b'])['documents']
+        assert documents in (['first', 'second'], ['changed', 'second'])
+        assert current.query([[1.0, 0.0]], n_results=1)['ids'] == [['a' if documents[0] == 'first' else 'b']]
+    if failing_call == 0:
+        assert reopened.get(ids=['a', 'b'])['documents'] == ['first', 'second']
+    # Matrix files of interrupted rewrites are removed when the collection is reopened
+    assert len([name for name in os.listdir(tmp_path / 'atomic') if name.startswith('vectors')]) == 1